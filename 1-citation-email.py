@@ -2,9 +2,15 @@
 #generate_citation_map
 
 # Import the citation map directly from scripts folder
-from scripts.citation_map.citation_map import generate_citation_map
+from scripts.citation_map.citation_map import generate_citation_map, generate_citation_maps
 from scripts.citation_map.citation_map import save_author_ids_for_debugging
-from scripts.scrape_email import scrape_email_from_google_scholar_profile
+from scripts.citation_map.citation_store import CitationStore
+from scripts.citation_map.metrics import MetricsCollector, metrics_path_for_csv
+from scripts.driver_pool import DriverPool
+from scripts.email_store import EmailStore
+from scripts.scrape_email import discover_emails_from_google_scholar_profile
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 import logging
 import config
@@ -13,7 +19,6 @@ from googleapiclient.discovery import build
 import os
 import warnings
 from tqdm import tqdm
-import time
 
 # Suppress oauth2client warning
 warnings.filterwarnings('ignore', message='file_cache is only supported with oauth2client<4.0.0')
@@ -81,72 +86,124 @@ def get_google_sheet_data(sheet_id, credentials_path):
         logging.error("Error reading from Google Sheet: %s", str(e))
         return None
 
-def add_emails_to_csv(csv_path):
+EMAIL_QUESTION = "What's your email address used in your application with us at TurboNIW?"
+SCHOLAR_LINK_QUESTION = "2.1. What is your Google Scholar profile link?"
+
+def get_applicant_scholar_ids(scholar_df):
+    """
+    Map each applicant's email address to the Google Scholar ID in their profile link.
+    Rows without a usable link are skipped; for repeated emails the last row wins.
+    """
+    applicants = {}
+    for email, scholar_link in zip(scholar_df[EMAIL_QUESTION], scholar_df[SCHOLAR_LINK_QUESTION]):
+        email, scholar_link = email.strip(), scholar_link.strip()
+        if not email or 'user=' not in scholar_link:
+            if email:
+                logging.warning(f"No Google Scholar profile link found for {email}")
+            continue
+        applicants[email] = scholar_link.split('user=')[1].split('&')[0]
+    return applicants
+
+def run_citation_batch(sheet_id, credentials_path, output_base_folder='filled', emails=None):
+    """
+    Batch mode: read every applicant's Google Scholar link from the sheet and generate all citation maps
+    in one process, sharing the Scholar fetcher and caches (see `generate_citation_maps`).
+    With `emails`, only those applicants are processed.
+    """
+    scholar_df = get_google_sheet_data(sheet_id, credentials_path)
+    if scholar_df is None:
+        logging.error("Failed to load data from Google Scholar Sheet. Exiting.")
+        return {}
+    applicants = get_applicant_scholar_ids(scholar_df)
+    if emails:
+        applicants = {email: scholar_id for email, scholar_id in applicants.items() if email in emails}
+    logging.info(f"Generating citation maps for {len(applicants)} applicants")
+    return generate_citation_maps(applicants, output_base_folder)
+
+EMAIL_SCRAPE_WORKERS = 16
+EMAIL_SCRAPE_BROWSERS = 4
+
+def scrape_profile_email(google_scholar_link, driver_pool, metrics, email_store=None, refresh=False):
+    """
+    First email found on one Google Scholar profile ('' if none), recording the outcome in `metrics`.
+    Profiles and homepages found in `email_store` (an EmailStore) are not scraped again unless `refresh` is set.
+    """
+    try:
+        with metrics.time_stage('email_scrape'):
+            discovery = discover_emails_from_google_scholar_profile(google_scholar_link, driver_pool,
+                                                                     email_store=email_store, refresh=refresh,
+                                                                     metrics=metrics)
+    except Exception as e:
+        metrics.count('email.error')
+        logging.error(f"Error scraping {google_scholar_link}: {str(e)}")
+        return ''
+    if discovery.error is not None:
+        # 'email.blocked' (CAPTCHA) or 'email.error'; failed scrapes are not cached, so they are retried next run
+        metrics.count(f'email.{discovery.error}')
+        logging.error(f"Failed to scrape {google_scholar_link} ({discovery.error})")
+        return ''
+    if email_store is not None:
+        metrics.record_cache('email_store', hits=int(discovery.from_cache), misses=int(not discovery.from_cache))
+    emails = discovery.emails
+    if emails:
+        metrics.count('email.found')
+        logging.info(f"Found email for {google_scholar_link}: {emails[0]} (source: {discovery.source})")
+        return emails[0]
+    metrics.count('email.not_found')
+    logging.warning(f"No email found for {google_scholar_link}")
+    return ''
+
+def add_emails_to_csv(csv_path, metrics=None, max_workers=EMAIL_SCRAPE_WORKERS, refresh=False):
     """
-    Read the CSV file, scrape emails from Google Scholar profiles, and add them to the CSV.
-    Uses a cache to avoid scraping the same profile multiple times.
+    Read the citation table, scrape emails from Google Scholar profiles, and add them as a column.
+    The column is added in place to the Parquet store behind the CSV, and the CSV view is re-exported.
+    Each unique profile is scraped once, by `max_workers` threads at a time; requests to Google Scholar
+    are rate limited and paused by `SCHOLAR_BREAKER` when blocked, and requests to each homepage's host are capped
+    (see `scrape_email.HostThrottle`).
+    Discoveries are kept in the persistent email cache (`email_store.EmailStore`) across runs and applicants;
+    `refresh` scrapes every profile again and updates the cache.
+    Cache hits, scraping latencies, outcomes (found, not found, blocked, error) and per-host HTTP statuses and
+    CAPTCHAs are recorded in `metrics` (a MetricsCollector).
     """
+    if metrics is None:
+        metrics = MetricsCollector('email_enrichment')
     logging.info(f"Starting email scraping process for CSV: {csv_path}")
     
-    # Read the CSV file
-    df = pd.read_csv(csv_path)
+    # Read the citation table (falls back to the CSV in folders without a Parquet store)
+    citation_store = CitationStore.for_csv(csv_path)
+    df = citation_store.read()
     logging.info(f"Found {len(df)} total entries in CSV")
     
-    # Add a new column for emails
-    df['email'] = ''
+    # Count valid entries
+    google_scholar_links = df['google_scholar_link'].fillna('').astype(str)
+    is_valid = (google_scholar_links != '') & df['author_id'].notna() & (df['author_id'] != 'No_author_found')
+    valid_entries = df[is_valid]
+    logging.info(f"Found {len(valid_entries)} valid entries with Google Scholar links")
     
-    # Create a cache for emails based on Google Scholar links
+    # Scrape each profile once; rows sharing a profile are cache hits
+    unique_links = list(dict.fromkeys(google_scholar_links[is_valid]))
+    metrics.record_cache('email', hits=len(valid_entries) - len(unique_links), misses=len(unique_links))
     email_cache = {}
     
-    # Count valid entries
-    valid_entries = df[~df['google_scholar_link'].isna() & (df['author_id'] != 'No_author_found')]
-    logging.info(f"Found {len(valid_entries)} valid entries with Google Scholar links")
+    # Profiles are scraped over HTTP; browsers are only started (then reused) for JS-rendered homepages
+    with EmailStore() as email_store, DriverPool(size=EMAIL_SCRAPE_BROWSERS, warm=False) as driver_pool, \
+            ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(scrape_profile_email, link, driver_pool, metrics, email_store, refresh): link
+                   for link in unique_links}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Scraping emails"):
+            email_cache[futures[future]] = future.result()
     
-    # Process each row
-    for idx, row in tqdm(df.iterrows(), total=len(df), desc="Scraping emails"):
-        author_id = row['author_id']
-        google_scholar_link = row['google_scholar_link']
-        author_name = row['citing author name']
-        
-        # Skip if no valid author ID or link
-        if pd.isna(author_id) or author_id == 'No_author_found' or pd.isna(google_scholar_link):
-            continue
-            
-        # Check if we've already scraped this profile
-        if google_scholar_link in email_cache:
-            df.at[idx, 'email'] = email_cache[google_scholar_link]
-            logging.debug(f"Using cached email for {author_name} ({google_scholar_link})")
-            continue
-            
-        try:
-            logging.info(f"Scraping email for {author_name} ({google_scholar_link})")
-            
-            # Add delay to avoid rate limiting
-            time.sleep(2)
-            
-            # Scrape emails using the existing function
-            emails = scrape_email_from_google_scholar_profile(google_scholar_link)
-            
-            # Cache and add the first email found (if any)
-            if emails:
-                email_cache[google_scholar_link] = emails[0]  # Store first email in cache
-                df.at[idx, 'email'] = emails[0]  # Store first email in DataFrame
-                logging.info(f"Found email for {author_name}: {emails[0]}")
-            else:
-                logging.warning(f"No email found for {author_name}")
-                
-        except Exception as e:
-            logging.error(f"Error processing author {author_name} ({author_id}): {str(e)}")
-            continue
+    # Write all emails back in one assignment
+    df['email'] = google_scholar_links.map(email_cache).where(is_valid, '').fillna('')
     
-    # Save the updated CSV
-    output_path = csv_path.replace('.csv', '_with_emails.csv')
-    df.to_csv(output_path, index=False)
-    logging.info(f"Updated CSV saved to: {output_path}")
+    # Save the email column to the store and refresh the CSV view
+    df = citation_store.add_columns({'email': df['email']})
+    citation_store.export_csv(csv_path, df)
+    logging.info(f"Emails added to: {citation_store.path}")
     logging.info(f"Total unique profiles scraped: {len(email_cache)}")
     
     # Print summary
-    emails_found = df['email'].notna().sum()
+    emails_found = (df['email'].fillna('') != '').sum()
     logging.info(f"Total emails found: {emails_found} out of {len(valid_entries)} valid entries")
     
     return df
@@ -184,6 +241,20 @@ def extract_first_number(rank):
         return float('inf')
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Citation maps, citing authors' emails and ranks.")
+    parser.add_argument("--batch", action="store_true",
+                        help="Generate the citation maps of all applicants in the sheet in one process, then exit.")
+    parser.add_argument("--sheet-id", type=str, default=config.GOOGLE_SHEET_ID,
+                        help="Google Sheet with the applicants' Google Scholar links (batch mode).")
+    parser.add_argument("--email", type=str, action="append",
+                        help="Only process this applicant in batch mode (repeatable).")
+    parser.add_argument("--refresh-emails", action="store_true",
+                        help="Scrape every citing author's email again instead of using the persistent email cache.")
+    args = parser.parse_args()
+    if args.batch:
+        run_citation_batch(args.sheet_id, config.GOOGLE_SHEETS_CREDENTIALS_PATH, emails=args.email)
+        raise SystemExit(0)
+
     # # Get data from Google Sheet
     # scholar_df = get_google_sheet_data(config.GOOGLE_SCHOLAR_SHEET_ID, config.GOOGLE_CREDENTIALS_PATH)
     # if scholar_df is None:
@@ -217,7 +288,8 @@ if __name__ == '__main__':
     
     # Scrape emails and update CSV
     logging.info("Starting email scraping process...")
-    citation_df = add_emails_to_csv(csv_path)
+    metrics = MetricsCollector('email_enrichment')
+    citation_df = add_emails_to_csv(csv_path, metrics, refresh=args.refresh_emails)
     #email_df.to_csv()
 
     # Read the data files
@@ -225,17 +297,19 @@ if __name__ == '__main__':
     #citation_df = pd.read_csv(csv_path)
 
     # Add rank column to the dataframe
-    citation_df['rank'] = citation_df['affiliation'].apply(lambda x: find_rank(x, rank_df))
+    citation_df['rank'] = citation_df['affiliation'].apply(metrics.timed('rank_lookup', lambda x: find_rank(x, rank_df)))
 
     # Sort by rank, handling both numeric and range ranks
     citation_df['sort_rank'] = citation_df['rank'].apply(extract_first_number)
     citation_df = citation_df.sort_values(by='sort_rank', ascending=True)
     citation_df = citation_df.drop('sort_rank', axis=1)
     
-    # Save the updated dataframe
-    output_path = f'filled/{config.DEFAULT_EMAIL}/citation_info_with_ranks.csv'
-    citation_df.to_csv(output_path, index=False)
-    logging.info(f"Updated CSV with ranks saved to: {output_path}")
+    # Save the rank column to the store (rows sorted by rank) and refresh the CSV view
+    citation_store = CitationStore.for_csv(csv_path)
+    citation_store.write(citation_df)
+    citation_store.export_csv(csv_path, citation_df)
+    logging.info(f"Ranks added to: {citation_store.path}")
     logging.info(f"Total entries with ranks found: {citation_df['rank'].notna().sum()} out of {len(citation_df)} entries")
+    metrics.write_json(metrics_path_for_csv(csv_path))
     
     
\ No newline at end of file
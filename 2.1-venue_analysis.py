@@ -5,6 +5,8 @@ import config
 import time
 import json
 
+from scripts.citation_map.citation_store import CITATION_STORE_FILENAME, CitationStore
+
 def extract_venue_from_citation(citation):
     """
     Extract venue name and type from citation string.
@@ -81,9 +83,9 @@ def extract_venue_from_citation(citation):
 #         return None
 
 def main():
-    # Read the CSV file
-    csv_path = os.path.join(config.OUTPUT_BASE_FOLDER, config.DEFAULT_EMAIL, 'citation_info_with_ranks.csv')
-    df = pd.read_csv(csv_path)
+    # Read the citation column from the applicant's citation store (or its CSV in older folders)
+    store_path = os.path.join(config.OUTPUT_BASE_FOLDER, config.DEFAULT_EMAIL, CITATION_STORE_FILENAME)
+    df = CitationStore(store_path).read(columns=['citation'])
     
     # Extract unique venues
     venues = {}
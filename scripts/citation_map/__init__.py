@@ -1,7 +1,13 @@
 # Copyright (c) 2024 Chen Liu
 # All rights reserved.
+from .async_fetch import SCHOLAR_LIMITER, ScholarFetcher, TokenBucket
+from .circuit_breaker import CircuitBreaker, SCHOLAR_BREAKER
+from .records import CitationRecord, records_to_frame, frame_to_records, write_records
+from .proxy_pool import ProxyPool, SCHOLAR_PROXY_POOL
 from .citation_map import generate_citation_map
 from .scholarly_support import get_citing_author_ids_and_citing_papers
 
-__all__ = ['generate_citation_map', 'get_citing_author_ids_and_citing_papers']
+__all__ = ['generate_citation_map', 'get_citing_author_ids_and_citing_papers', 'ScholarFetcher', 'TokenBucket', 'SCHOLAR_LIMITER',
+           'CircuitBreaker', 'SCHOLAR_BREAKER', 'ProxyPool', 'SCHOLAR_PROXY_POOL',
+           'CitationRecord', 'records_to_frame', 'frame_to_records', 'write_records']
 
@@ -0,0 +1,143 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import functools
+import hashlib
+import pycountry
+import re
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+# Spellings that pycountry does not list as a name, common name or official name.
+COUNTRY_ALIASES = (
+    'USA', 'U.S.A.', 'US', 'U.S.', 'United States of America', 'America',
+    'UK', 'U.K.', 'Great Britain', 'Britain', 'England', 'Scotland', 'Wales', 'Northern Ireland',
+    'Korea', 'South Korea', 'Republic of Korea', 'North Korea', 'Russia', 'Iran', 'Syria', 'Vietnam',
+    'Taiwan', 'Hong Kong', 'Macau', 'Macao', 'Laos', 'Moldova', 'Bolivia', 'Venezuela', 'Tanzania',
+    'Czech Republic', 'Turkey', 'Holland', 'The Netherlands', 'UAE', 'PRC', "People's Republic of China",
+    'P.R. China', 'P. R. China', 'Mainland China',
+)
+
+# Precompiled patterns used on every affiliation string.
+AFFILIATION_SEPARATOR_PATTERN = re.compile(r'[;]|\band\b')
+AFFILIATION_PREFIX_PATTERN = re.compile(r'.*?\bat\b|.*?@', re.IGNORECASE)
+# The prefix pattern rescans the rest of the string from every position when nothing matches,
+# so it is only applied to strings that contain 'at' or '@' at all.
+_AT_PATTERN = re.compile(r'\bat\b|@', re.IGNORECASE)
+IDENTITY_STRING_PATTERN = re.compile(
+    r'\b(director|manager|chair|engineer|programmer|scientist|professor|lecturer|phd|ph\.d|postdoc|doctor|student|department of)\b',
+    re.IGNORECASE)
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def _normalize_country(string: str) -> str:
+    return _WHITESPACE_PATTERN.sub(' ', string).strip().casefold()
+
+
+def _build_country_names() -> FrozenSet[str]:
+    names = set(COUNTRY_ALIASES)
+    for country in pycountry.countries:
+        for attribute in ('name', 'common_name', 'official_name'):
+            name = getattr(country, attribute, None)
+            if name:
+                names.add(name)
+    return frozenset(_normalize_country(name) for name in names)
+
+
+# Normalized country names, common names, official names and aliases, built once at import.
+COUNTRY_NAMES = _build_country_names()
+
+# Countries that start a new fragment when they follow a comma: exactly the pycountry names (case-insensitive),
+# as matched by `pycountry.countries.get(name=...)`. Aliases and common names ('USA', 'Korea') are not used
+# here, so 'Stanford University, USA' stays one affiliation instead of producing a bare country.
+SPLIT_COUNTRY_NAMES = frozenset(country.name.lower() for country in pycountry.countries)
+
+# Bump when the cleaning logic changes; pattern and country-list changes are picked up by the fingerprint.
+CLEANING_RULES_REVISION = 2
+
+
+def _rules_fingerprint() -> str:
+    rules = [str(CLEANING_RULES_REVISION)]
+    for pattern in (AFFILIATION_SEPARATOR_PATTERN, AFFILIATION_PREFIX_PATTERN, IDENTITY_STRING_PATTERN):
+        rules.append(f'{pattern.pattern}/{pattern.flags}')
+    rules.extend(sorted(COUNTRY_NAMES))
+    rules.extend(sorted(SPLIT_COUNTRY_NAMES))
+    return hashlib.blake2b('\n'.join(rules).encode('utf-8'), digest_size=8).hexdigest()
+
+
+# Version of the cleaning rules; persistent caches of cleaned affiliations are invalidated when it changes.
+CLEANING_RULES_VERSION = f'{CLEANING_RULES_REVISION}-{_rules_fingerprint()}'
+
+
+def is_country(string: str) -> bool:
+    '''
+    Check if a string is a country name (case-insensitive; names, common names and aliases).
+    '''
+    return _normalize_country(string) in COUNTRY_NAMES
+
+
+def country_aware_comma_split(string_list: Iterable[str]) -> List[str]:
+    '''
+    Split strings by comma, but be aware of country names: a part that is a pycountry name
+    (`SPLIT_COUNTRY_NAMES`) starts a new fragment, every other part stays with the one before it.
+    '''
+    result = []
+    for string in string_list:
+        if not string:
+            continue
+        parts = string.split(',')
+        current_part = parts[0]
+        for part in parts[1:]:
+            if part.strip().lower() in SPLIT_COUNTRY_NAMES:
+                result.append(current_part.strip())
+                current_part = part
+            else:
+                current_part += ',' + part
+        result.append(current_part.strip())
+    return result
+
+
+@functools.lru_cache(maxsize=65536)
+def clean_affiliation(affiliation: str) -> Tuple[str, ...]:
+    '''
+    Clean one raw affiliation string from a Google Scholar profile.
+    Returns the affiliations found in it, without identity strings such as 'PhD student'.
+    Results are memoized, so repeated affiliations are only cleaned once.
+    '''
+    # Split the string by ';' or 'and'.
+    substring_list = [part.strip() for part in AFFILIATION_SEPARATOR_PATTERN.split(affiliation)]
+    # Further split the substrings by ',' around country names.
+    substring_list = country_aware_comma_split(substring_list)
+
+    cleaned_affiliations = []
+    for substring in substring_list:
+        # Remove anything before 'at', or '@'.
+        if _AT_PATTERN.search(substring):
+            substring = AFFILIATION_PREFIX_PATTERN.sub('', substring)
+        cleaned_affiliation = substring.strip()
+        # Filter out strings that represent a person's identity rather than affiliation.
+        if not IDENTITY_STRING_PATTERN.search(cleaned_affiliation):
+            cleaned_affiliations.append(cleaned_affiliation)
+    return tuple(cleaned_affiliations)
+
+
+def clean_affiliations(affiliations: Iterable[str], store=None, metrics=None) -> Dict[str, Tuple[str, ...]]:
+    '''
+    Clean a batch of raw affiliation strings, each unique string once.
+    Returns raw affiliation -> cleaned affiliations.
+
+    Parameters
+    --------
+    affiliations: Raw affiliation strings, possibly repeated.
+    store: Optional `AffiliationStore`; strings cleaned by an earlier run with the same rules are read
+        from it and newly cleaned ones are written back.
+    metrics: Optional `MetricsCollector`; store hits and misses are recorded as the 'affiliation' cache.
+    '''
+    unique_affiliations = list(dict.fromkeys(affiliations))
+    cleaned = store.get_many(unique_affiliations) if store is not None else {}
+    newly_cleaned = {affiliation: clean_affiliation(affiliation)
+                     for affiliation in unique_affiliations if affiliation not in cleaned}
+    if store is not None and newly_cleaned:
+        store.put_many(newly_cleaned)
+    if store is not None and metrics is not None:
+        metrics.record_cache('affiliation', hits=len(cleaned), misses=len(newly_cleaned))
+    cleaned.update(newly_cleaned)
+    return {affiliation: cleaned[affiliation] for affiliation in unique_affiliations}
@@ -0,0 +1,84 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Tuple
+
+import config
+from scripts.citation_map.affiliation_cleaning import CLEANING_RULES_VERSION
+
+AFFILIATION_DB_PATH = os.path.join(config.CACHE_PATH, 'affiliation_cache.sqlite3')
+
+# SQLite limits the number of parameters in one statement.
+_MAX_QUERY_PARAMETERS = 500
+
+
+class AffiliationStore:
+    '''
+    Persistent cache of cleaned affiliations (raw affiliation string -> cleaned fragments) backed by SQLite.
+
+    Entries are tagged with the cleaning rules version they were produced with; entries from other
+    versions are dropped when the store is opened, so a rule change re-cleans everything once.
+
+    Parameters
+    --------
+    db_path: Location of the SQLite database.
+    rules_version: Version of the cleaning rules, `affiliation_cleaning.CLEANING_RULES_VERSION` by default.
+    '''
+
+    def __init__(self, db_path: str = AFFILIATION_DB_PATH, rules_version: str = CLEANING_RULES_VERSION):
+        self.db_path = db_path
+        self.rules_version = rules_version
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS affiliation (
+                    raw TEXT PRIMARY KEY,
+                    cleaned TEXT NOT NULL,
+                    rules_version TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )''')
+            num_stale = self._connection.execute('DELETE FROM affiliation WHERE rules_version != ?',
+                                                 (rules_version,)).rowcount
+        if num_stale > 0:
+            print(f"Affiliation cleaning rules changed; dropped {num_stale} cached affiliations.")
+
+    def get_many(self, affiliations: Iterable[str]) -> Dict[str, Tuple[str, ...]]:
+        '''
+        Cached cleaned fragments for those of `affiliations` that are in the store.
+        '''
+        affiliations = list(affiliations)
+        cleaned = {}
+        with self._lock:
+            for start in range(0, len(affiliations), _MAX_QUERY_PARAMETERS):
+                chunk = affiliations[start:start + _MAX_QUERY_PARAMETERS]
+                rows = self._connection.execute(
+                    'SELECT raw, cleaned FROM affiliation WHERE rules_version = ? AND raw IN (%s)' % ','.join('?' * len(chunk)),
+                    [self.rules_version, *chunk]).fetchall()
+                cleaned.update((raw, tuple(json.loads(fragments))) for raw, fragments in rows)
+        return cleaned
+
+    def put_many(self, cleaned: Dict[str, Tuple[str, ...]]) -> None:
+        '''
+        Insert or update cleaned fragments, in one transaction.
+        '''
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO affiliation (raw, cleaned, rules_version, updated_at) VALUES (?, ?, ?, ?)',
+                [(raw, json.dumps(list(fragments)), self.rules_version, now) for raw, fragments in cleaned.items()])
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM affiliation').fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,306 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import aiohttp
+import asyncio
+import collections
+import random
+import threading
+import time
+from typing import Dict, Hashable, List, Optional
+
+from scripts.citation_map.circuit_breaker import CircuitBreaker, SCHOLAR_BREAKER, is_blocked_page
+from scripts.citation_map.http_fixtures import route_url
+from scripts.citation_map.metrics import MetricsCollector, PIPELINE_METRICS, url_host
+from scripts.citation_map.proxy_pool import PROXY_CONNECT_TIMEOUT, ProxyPool, SCHOLAR_PROXY_POOL
+
+# Default request rate for Google Scholar. Scholar starts serving CAPTCHAs
+# somewhere above one request every few seconds per client, so we stay just under it.
+SCHOLAR_REQUESTS_PER_SECOND = 0.4
+SCHOLAR_BURST = 2
+SCHOLAR_MAX_CONCURRENCY = 4
+SCHOLAR_JITTER_SECONDS = 1.5
+
+SCHOLAR_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+    'Cache-Control': 'max-age=0',
+    'Sec-Fetch-Dest': 'document',
+    'Sec-Fetch-Mode': 'navigate',
+    'Sec-Fetch-Site': 'none',
+    'Sec-Fetch-User': '?1',
+}
+
+
+class TokenBucket:
+    '''
+    Token-bucket rate limiter for asyncio code and threads.
+
+    Tokens are reserved synchronously under a lock (there is no `await` between reading and updating
+    the bucket), so concurrent coroutines and threads never race, and callers that find the bucket
+    empty queue up behind each other instead of all waking at once. Use `acquire` from coroutines
+    and `wait` from threads. A bucket shared by callers that want different jitter can be given
+    `jitter=0` and each caller passes its own to `acquire`/`wait`.
+
+    Parameters
+    --------
+    rate: Tokens added per second.
+    capacity: Maximum number of tokens, i.e. the largest burst allowed.
+    jitter: Upper bound (seconds) of a uniform random delay added to every acquisition.
+    '''
+
+    def __init__(self, rate: float, capacity: int = 1, jitter: float = 0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.jitter = jitter
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, jitter: Optional[float] = None) -> float:
+        '''
+        Take one token and return how many seconds the caller must wait before using it.
+        `jitter` overrides the bucket's own jitter for this acquisition.
+        '''
+        jitter = self.jitter if jitter is None else jitter
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if jitter:
+            wait_time += random.uniform(0, jitter)
+        return wait_time
+
+    async def acquire(self, jitter: Optional[float] = None) -> None:
+        wait_time = self.reserve(jitter)
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+    def wait(self, jitter: Optional[float] = None) -> None:
+        wait_time = self.reserve(jitter)
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+
+class FairScheduler:
+    '''
+    Round-robin admission across keys (e.g. applicants) in front of a `TokenBucket`, for asyncio code.
+
+    Requests wait in one queue per key and a single dispatcher hands out the bucket's tokens to the
+    keys in turn, so a key with thousands of queued requests only gets its share of the rate while
+    other keys have requests waiting. Jitter is applied to each release, not to the dispatcher, so it
+    does not lower the overall rate.
+
+    Parameters
+    --------
+    limiter: The shared token bucket; it should have no jitter of its own.
+    jitter: Upper bound (seconds) of a uniform random delay added to every release.
+    '''
+
+    def __init__(self, limiter: TokenBucket, jitter: float = 0.0):
+        self.limiter = limiter
+        self.jitter = jitter
+        self._queues: Dict[Hashable, collections.deque] = collections.OrderedDict()
+        self._dispatcher = None
+
+    async def acquire(self, key: Hashable = None) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queues.setdefault(key, collections.deque()).append(future)
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._queues:
+            # Serve the first key, then move it to the back of the rotation.
+            key, queue = self._queues.popitem(last=False)
+            future = queue.popleft()
+            if queue:
+                self._queues[key] = queue
+            if future.done():
+                continue
+            wait_time = self.limiter.reserve()
+            release_time = wait_time + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+            loop.call_later(release_time, _release, future)
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+
+
+def _release(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+# The one request budget for Google Scholar in this process, shared by every fetcher, the organization-name
+# requests and the email scraper. It has no jitter of its own: each caller adds `SCHOLAR_JITTER_SECONDS`.
+SCHOLAR_LIMITER = TokenBucket(rate=SCHOLAR_REQUESTS_PER_SECOND, capacity=SCHOLAR_BURST)
+
+
+class ScholarFetcher:
+    '''
+    Asynchronous HTML fetcher for Google Scholar.
+
+    A single instance owns one `aiohttp.ClientSession` and one concurrency semaphore, and every
+    instance draws from the process-wide `SCHOLAR_LIMITER` token bucket, so all Scholar pages share
+    the same request budget no matter how many fetchers or coroutines are in flight. Block signals are reported to `breaker`, which pauses every Scholar
+    caller at once, and each request is routed through the healthiest endpoint of `proxy_pool`.
+    Responses, retries, CAPTCHA hits and page latencies are recorded in `metrics`.
+    Use it as an async context manager, or call `close()` when done.
+
+    When one fetcher serves several applicants, `fair=True` admits their requests round-robin by the
+    `key` passed to `fetch` (see `FairScheduler`), and a `response_cache` dict shares pages between
+    them: a URL requested by several callers is fetched once.
+    '''
+
+    def __init__(self,
+                 limiter: TokenBucket = SCHOLAR_LIMITER,
+                 max_concurrency: int = SCHOLAR_MAX_CONCURRENCY,
+                 jitter: float = SCHOLAR_JITTER_SECONDS,
+                 max_retries: int = 3,
+                 timeout: float = 30,
+                 headers: Optional[Dict[str, str]] = None,
+                 breaker: CircuitBreaker = SCHOLAR_BREAKER,
+                 proxy_pool: ProxyPool = SCHOLAR_PROXY_POOL,
+                 metrics: MetricsCollector = PIPELINE_METRICS,
+                 fair: bool = False,
+                 response_cache: Optional[Dict[str, str]] = None):
+        self.limiter = limiter
+        self.jitter = jitter
+        self.scheduler = FairScheduler(self.limiter, jitter) if fair else None
+        self.response_cache = response_cache
+        self._pending_responses: Dict[str, asyncio.Future] = {}
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.headers = headers or SCHOLAR_HEADERS
+        self.breaker = breaker
+        self.proxy_pool = proxy_pool
+        self.metrics = metrics
+        self._semaphore = None
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _ensure_session(self) -> None:
+        # The session and semaphore are bound to the running event loop, so create them lazily.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers=self.headers,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout,
+                                                                                sock_connect=PROXY_CONNECT_TIMEOUT))
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def fetch(self, url: str, key: Hashable = None) -> Optional[str]:
+        '''
+        Fetch one page through the shared rate limiter.
+        Returns the HTML text, or None if every attempt failed or was blocked.
+
+        Parameters
+        --------
+        url: Page to fetch.
+        key: Caller the request is scheduled for when the fetcher is `fair`, e.g. the applicant.
+        '''
+        if self.response_cache is None:
+            return await self._fetch(url, key)
+        if url in self.response_cache:
+            self.metrics.record_cache('scholar_response', hits=1)
+            return self.response_cache[url]
+        pending = self._pending_responses.get(url)
+        if pending is not None:
+            self.metrics.record_cache('scholar_response', hits=1)
+            return await asyncio.shield(pending)
+        self.metrics.record_cache('scholar_response', misses=1)
+        pending = self._pending_responses[url] = asyncio.get_running_loop().create_future()
+        try:
+            text = await self._fetch(url, key)
+        except BaseException:
+            # Callers sharing this request see a failed fetch; the exception (e.g. a cancellation) stays here.
+            pending.set_result(None)
+            raise
+        finally:
+            del self._pending_responses[url]
+        if text is not None:
+            self.response_cache[url] = text
+        pending.set_result(text)
+        return text
+
+    async def _fetch(self, url: str, key: Hashable) -> Optional[str]:
+        self._ensure_session()
+        host = url_host(url)
+        for attempt in range(self.max_retries):
+            if attempt > 0:
+                self.metrics.record_retry('scholar_page')
+            await self.breaker.wait_async()
+            # This attempt may hold the breaker's half-open probe slot: any exit that records neither a
+            # success nor a block (errors, cancellation while queued for the limiter, ...) gives it back.
+            outcome_recorded = False
+            try:
+                if self.scheduler is not None:
+                    await self.scheduler.acquire(key)
+                else:
+                    await self.limiter.acquire(jitter=self.jitter)
+                proxy = await self.proxy_pool.acquire_async()
+                try:
+                    async with self._semaphore:
+                        start_time = time.monotonic()
+                        async with self._session.get(route_url(url), proxy=proxy) as response:
+                            text = await response.text()
+                            status = response.status
+                            final_url = str(response.url)
+                        latency = time.monotonic() - start_time
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self.metrics.record_http(host, type(e).__name__)
+                    self.breaker.record_failure()
+                    outcome_recorded = True
+                    self.proxy_pool.report_failure(proxy)
+                    print(f'[ERROR!] Exception on attempt {attempt + 1} when fetching {url}: {str(e)}')
+                    await asyncio.sleep((2 ** attempt) * random.uniform(5, 15))
+                    continue
+
+                self.metrics.record_http(host, status)
+                if is_blocked_page(text, status, final_url):
+                    self.metrics.record_captcha(host)
+                    # The breaker pauses all Scholar traffic, so no extra per-call backoff is needed here.
+                    self.breaker.record_block(reason=f'HTTP {status} for {url}')
+                    outcome_recorded = True
+                    self.proxy_pool.report_block(proxy)
+                    print(f'[WARNING!] Blocked by CAPTCHA or robot check when fetching {url}. Attempt {attempt + 1}/{self.max_retries}')
+                    continue
+                if status != 200:
+                    self.breaker.record_failure()
+                    outcome_recorded = True
+                    self.proxy_pool.report_failure(proxy)
+                    print(f'[WARNING!] Failed (HTTP {status}) when fetching {url}. Attempt {attempt + 1}/{self.max_retries}')
+                    await asyncio.sleep((2 ** attempt) * random.uniform(5, 15))
+                    continue
+                self.breaker.record_success()
+                outcome_recorded = True
+                self.proxy_pool.report_success(proxy, latency)
+                self.metrics.record_latency('scholar_page', latency)
+                return text
+            finally:
+                if not outcome_recorded:
+                    self.breaker.record_failure()
+        return None
+
+    async def fetch_many(self, urls: List[str], key: Hashable = None) -> List[Optional[str]]:
+        '''
+        Fetch several pages concurrently. Results are returned in the order of `urls`.
+        '''
+        return await asyncio.gather(*(self.fetch(url, key) for url in urls))
+
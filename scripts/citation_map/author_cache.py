@@ -0,0 +1,67 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import threading
+from typing import Callable, Dict, Tuple
+
+from scripts.citation_map.metrics import MetricsCollector, PIPELINE_METRICS
+from scripts.citation_map.records import CitationRecord
+from scripts.citation_map.scholarly_support import NO_AUTHOR_FOUND_STR
+
+
+class AuthorCache:
+    '''
+    In-process cache of citing authors' (name, affiliation), shared by every applicant of a batch run
+    and safe to call from many threads.
+
+    An author who cites several applicants is looked up on Scholar once; concurrent requests for the
+    same author share a single lookup. Failed lookups are not cached, so a later request retries them.
+
+    Parameters
+    --------
+    metrics: Collector that hits and misses are recorded in, as the 'author' cache.
+    '''
+
+    def __init__(self, metrics: MetricsCollector = PIPELINE_METRICS):
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._authors: Dict[str, Tuple[str, str]] = {}
+        self._in_flight: Dict[str, threading.Event] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._authors)
+
+    def lookup(self, citing_author_paper_record: CitationRecord,
+               resolve: Callable[[CitationRecord], CitationRecord]) -> CitationRecord:
+        '''
+        `citing_author_paper_record` with its author name and affiliation filled in, from the cache or
+        by calling `resolve` (one of the Scholar affiliation lookups) on a miss.
+        '''
+        author_id = citing_author_paper_record.author_id
+        if author_id == NO_AUTHOR_FOUND_STR:
+            return resolve(citing_author_paper_record)
+
+        while True:
+            with self._lock:
+                author = self._authors.get(author_id)
+                in_flight = self._in_flight.get(author_id) if author is None else None
+                if author is None and in_flight is None:
+                    self._in_flight[author_id] = threading.Event()
+            if author is not None:
+                self.metrics.record_cache('author', hits=1)
+                return citing_author_paper_record.replace(author_name=author[0], affiliation=author[1])
+            if in_flight is None:
+                break
+            # Another thread is looking this author up; use its result, or retry if it failed.
+            in_flight.wait()
+
+        self.metrics.record_cache('author', misses=1)
+        try:
+            resolved_record = resolve(citing_author_paper_record)
+            if resolved_record.author_name != NO_AUTHOR_FOUND_STR:
+                with self._lock:
+                    self._authors[author_id] = (resolved_record.author_name, resolved_record.affiliation)
+        finally:
+            with self._lock:
+                self._in_flight.pop(author_id).set()
+        return resolved_record
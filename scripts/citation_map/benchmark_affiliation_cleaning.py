@@ -0,0 +1,107 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+'''
+Micro-benchmark of affiliation cleaning: the previous per-fragment pycountry implementation
+against `affiliation_cleaning` on a large synthetic affiliation list.
+
+    python -m scripts.citation_map.benchmark_affiliation_cleaning [num_affiliations] [num_unique]
+'''
+import random
+import re
+import sys
+import time
+import pycountry
+from typing import List
+
+from scripts.citation_map.affiliation_cleaning import clean_affiliation, clean_affiliations
+
+_INSTITUTIONS = ['Stanford University', 'Massachusetts Institute of Technology', 'Tsinghua University',
+                 'University of Oxford', 'ETH Zurich', 'Google Research', 'Microsoft Research Asia',
+                 'National University of Singapore', 'University of Toronto', 'Max Planck Institute for Informatics']
+_ROLES = ['PhD student', 'Professor', 'Assistant Professor', 'Research Scientist', 'Postdoc', 'Lecturer']
+_PLACES = ['Stanford, CA', 'Cambridge', 'Beijing', 'Oxford, UK', 'Zurich, Switzerland', 'Toronto, Canada',
+           'Singapore', 'Germany', 'United States', 'China']
+
+
+def _legacy_iscountry(string: str) -> bool:
+    try:
+        return pycountry.countries.get(name=string) is not None
+    except:
+        return False
+
+
+def _legacy_country_aware_comma_split(string_list: List[str]) -> List[str]:
+    result = []
+    for string in string_list:
+        if not string:
+            continue
+        parts = string.split(',')
+        current_part = parts[0]
+        for part in parts[1:]:
+            if _legacy_iscountry(part.strip()):
+                result.append(current_part.strip())
+                current_part = part
+            else:
+                current_part += ',' + part
+        result.append(current_part.strip())
+    return result
+
+
+def _legacy_clean_affiliation(affiliation: str) -> List[str]:
+    substring_list = [part.strip() for part in re.split(r'[;]|\band\b', affiliation)]
+    substring_list = _legacy_country_aware_comma_split(substring_list)
+    cleaned_affiliations = []
+    for substring in substring_list:
+        cleaned_affiliation = re.sub(r'.*?\bat\b|.*?@', '', substring, flags=re.IGNORECASE).strip()
+        is_common_identity_string = re.search(
+            re.compile(
+                r'\b(director|manager|chair|engineer|programmer|scientist|professor|lecturer|phd|ph\.d|postdoc|doctor|student|department of)\b',
+                re.IGNORECASE),
+            cleaned_affiliation)
+        if not is_common_identity_string:
+            cleaned_affiliations.append(cleaned_affiliation)
+    return cleaned_affiliations
+
+
+def make_affiliations(num_affiliations: int, num_unique: int, seed: int = 0) -> List[str]:
+    '''
+    Synthetic Scholar-style affiliation strings, `num_unique` distinct ones repeated up to `num_affiliations`.
+    '''
+    rng = random.Random(seed)
+    unique = []
+    for index in range(num_unique):
+        institution = rng.choice(_INSTITUTIONS)
+        pattern = index % 4
+        if pattern == 0:
+            unique.append(f'{rng.choice(_ROLES)} at {institution}, {rng.choice(_PLACES)}')
+        elif pattern == 1:
+            unique.append(f'{institution}; {rng.choice(_INSTITUTIONS)}, {rng.choice(_PLACES)} (lab {index})')
+        elif pattern == 2:
+            unique.append(f'Department of Computer Science, {institution}, {rng.choice(_PLACES)}, {index}')
+        else:
+            unique.append(f'{rng.choice(_ROLES)}, {institution} and {rng.choice(_INSTITUTIONS)} #{index}')
+    return [rng.choice(unique) for _ in range(num_affiliations)]
+
+
+def main(num_affiliations: int = 50000, num_unique: int = 5000) -> None:
+    affiliations = make_affiliations(num_affiliations, num_unique)
+
+    start = time.perf_counter()
+    legacy = [_legacy_clean_affiliation(affiliation) for affiliation in affiliations]
+    legacy_seconds = time.perf_counter() - start
+
+    clean_affiliation.cache_clear()
+    start = time.perf_counter()
+    cleaned = clean_affiliations(affiliations)
+    batched = [list(cleaned[affiliation]) for affiliation in affiliations]
+    batched_seconds = time.perf_counter() - start
+
+    num_different = sum(1 for old, new in zip(legacy, batched) if old != new)
+    print(f"{num_affiliations} affiliations ({num_unique} unique)")
+    print(f"  legacy per-fragment pycountry: {legacy_seconds:.3f} s")
+    print(f"  precomputed index, batched:    {batched_seconds:.3f} s ({legacy_seconds / batched_seconds:.1f}x faster)")
+    print(f"  results differing from legacy: {num_different}")
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
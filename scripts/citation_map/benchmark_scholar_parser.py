@@ -0,0 +1,77 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+'''
+Golden check and micro-benchmark of the Scholar result page parsers.
+
+Every backend in `scholar_parser.PARSER_BACKENDS` must produce exactly the `<fixture>.golden.json`
+next to each `fixtures/*.html` page; then each backend's parse time per page is reported.
+The golden files are written by the BeautifulSoup parser (the reference) with `--update-golden`.
+
+    python -m scripts.citation_map.benchmark_scholar_parser [--update-golden] [num_repeats]
+'''
+import glob
+import json
+import os
+import sys
+import time
+
+from scripts.citation_map.scholar_parser import PARSER_BACKENDS, get_citation_page_parser
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def _golden_path(fixture_path: str) -> str:
+    return os.path.splitext(fixture_path)[0] + '.golden.json'
+
+
+def _as_json(page) -> dict:
+    # JSON object keys are strings, so compare the page numbers the same way.
+    return json.loads(json.dumps(page.as_dict()))
+
+
+def main(num_repeats: int = 50, update_golden: bool = False) -> int:
+    fixture_paths = sorted(glob.glob(os.path.join(FIXTURES_PATH, 'scholar_*.html')))
+    pages = {}
+    for fixture_path in fixture_paths:
+        with open(fixture_path, encoding='utf-8') as fd:
+            pages[fixture_path] = fd.read()
+
+    if update_golden:
+        reference = get_citation_page_parser('bs4')
+        for fixture_path, html in pages.items():
+            with open(_golden_path(fixture_path), 'w', encoding='utf-8') as fd:
+                json.dump(_as_json(reference.parse(html)), fd, indent=2, ensure_ascii=False)
+                fd.write('\n')
+            print(f"Golden file written for {os.path.basename(fixture_path)}")
+
+    num_failures = 0
+    for backend in PARSER_BACKENDS:
+        parser = get_citation_page_parser(backend)
+        for fixture_path, html in pages.items():
+            with open(_golden_path(fixture_path), encoding='utf-8') as fd:
+                golden = json.load(fd)
+            if _as_json(parser.parse(html)) != golden:
+                print(f"[ERROR!] {backend} does not match the golden output of {os.path.basename(fixture_path)}")
+                num_failures += 1
+
+    total_kib = sum(len(html) for html in pages.values()) / 1024
+    print(f"{len(pages)} fixture pages ({total_kib:.0f} KiB), {num_repeats} repeats")
+    seconds_per_backend = {}
+    for backend in [*PARSER_BACKENDS, None]:
+        parser = get_citation_page_parser(backend)
+        start = time.perf_counter()
+        for _ in range(num_repeats):
+            for html in pages.values():
+                parser.parse(html)
+        seconds_per_backend[parser.name] = (time.perf_counter() - start) / (num_repeats * len(pages))
+    baseline = seconds_per_backend['bs4']
+    for name, seconds in seconds_per_backend.items():
+        print(f"  {name:10s} {seconds * 1000:8.2f} ms/page ({baseline / seconds:.1f}x bs4)")
+    return num_failures
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    update_golden = '--update-golden' in args
+    args = [arg for arg in args if arg != '--update-golden']
+    sys.exit(1 if main(*(int(arg) for arg in args[:1]), update_golden=update_golden) else 0)
@@ -0,0 +1,202 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import asyncio
+import random
+import re
+import threading
+import time
+from scholarly import DOSException, MaxTriesExceededException
+from typing import Any, Callable, Dict, List, Tuple, Type
+
+# Block signals: these statuses, the CAPTCHA widgets' markup (never the page text, which includes result
+# titles and snippets), and Google's "sorry" interstitial that blocked requests are redirected to.
+BLOCK_STATUSES = (403, 429)
+_BLOCK_MARKUP_PATTERN = re.compile(
+    r'''<[^>]+\b(?:id|class)\s*=\s*["'][^"']*\b(?:gs_captcha\w*|g-recaptcha)\b'''
+    r'''|<(?:script|iframe)\b[^>]*\bsrc\s*=\s*["'][^"']*/recaptcha/''',
+    re.IGNORECASE)
+_BLOCK_URL_PATTERN = re.compile(r'^https?://[^/]*google\.[^/]+/sorry/', re.IGNORECASE)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ScholarBlockedError(Exception):
+    '''
+    Raised when Google Scholar answers with a CAPTCHA, robot check or access-denied page.
+    '''
+
+
+class CircuitBreaker:
+    '''
+    Circuit breaker shared by every caller of one rate-limited service.
+
+    The first block signal opens the circuit and pauses all traffic for an exponentially growing
+    backoff period. When it expires the circuit becomes half-open and exactly one caller is let through
+    as a probe: success closes the circuit, another block re-opens it with a longer backoff.
+    Thread-safe, and usable from both threads (`wait`, `call`) and asyncio code (`wait_async`).
+    Every successful `wait`/`wait_async` must be followed by exactly one `record_success`, `record_block`
+    or `record_failure`, whatever happens to the request, or a half-open circuit never lets anyone through.
+
+    Parameters
+    --------
+    name: Name used in log messages and statistics.
+    base_backoff: Seconds the circuit stays open after the first block.
+    max_backoff: Upper bound on the backoff.
+    jitter: Relative random jitter added to each backoff, e.g. 0.25 for up to +25%.
+    block_exceptions: Exception types that count as block signals in `call`.
+    '''
+
+    def __init__(self,
+                 name: str,
+                 base_backoff: float = 30,
+                 max_backoff: float = 900,
+                 jitter: float = 0.25,
+                 probe_poll_interval: float = 1.0,
+                 block_exceptions: Tuple[Type[BaseException], ...] = (ScholarBlockedError,)):
+        self.name = name
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.probe_poll_interval = probe_poll_interval
+        self.block_exceptions = block_exceptions
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._open_until = 0.0
+        self._consecutive_opens = 0
+        self._probe_in_flight = False
+        self._num_calls = 0
+        self._num_blocks = 0
+        self.events: List[Dict[str, Any]] = []
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def try_acquire(self) -> float:
+        '''
+        Ask for permission to send one request.
+        Returns 0 if the caller may proceed, otherwise the number of seconds to wait before asking again.
+        '''
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN:
+                if now < self._open_until:
+                    return self._open_until - now
+                self._transition(HALF_OPEN)
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    return self.probe_poll_interval
+                self._probe_in_flight = True
+            self._num_calls += 1
+            return 0.0
+
+    def wait(self) -> None:
+        '''
+        Block the calling thread until a request may be sent.
+        '''
+        while True:
+            wait_time = self.try_acquire()
+            if wait_time <= 0:
+                return
+            time.sleep(wait_time)
+
+    async def wait_async(self) -> None:
+        '''
+        Suspend the calling coroutine until a request may be sent.
+        '''
+        while True:
+            wait_time = self.try_acquire()
+            if wait_time <= 0:
+                return
+            await asyncio.sleep(wait_time)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._consecutive_opens = 0
+                self._transition(CLOSED)
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        '''
+        Record an error that is not a block signal (e.g. a timeout).
+        A failed probe frees the half-open slot so another caller can probe.
+        '''
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_block(self, reason: str = '') -> None:
+        with self._lock:
+            self._num_blocks += 1
+            self._probe_in_flight = False
+            if self._state == OPEN:
+                # Requests that were already in flight when the circuit opened.
+                return
+            backoff = min(self.max_backoff, self.base_backoff * (2 ** self._consecutive_opens))
+            backoff *= random.uniform(1, 1 + self.jitter)
+            self._consecutive_opens += 1
+            self._open_until = time.monotonic() + backoff
+            self._transition(OPEN, backoff=backoff, reason=reason)
+
+    def call(self, func: Callable, *args, **kwargs):
+        '''
+        Run `func(*args, **kwargs)` under the breaker, treating `block_exceptions` as block signals.
+        '''
+        self.wait()
+        try:
+            result = func(*args, **kwargs)
+        except self.block_exceptions as e:
+            self.record_block(reason=str(e))
+            raise
+        except BaseException:
+            # Including KeyboardInterrupt/cancellation, so a half-open probe slot is always given back.
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'state': self._state,
+                'num_calls': self._num_calls,
+                'num_blocks': self._num_blocks,
+                'block_rate': self._num_blocks / self._num_calls if self._num_calls else 0.0,
+                'num_opens': sum(1 for event in self.events if event['event'] == OPEN),
+                'events': list(self.events),
+            }
+
+    def _transition(self, new_state: str, **details) -> None:
+        # Must be called with the lock held.
+        self._state = new_state
+        self.events.append({'time': time.time(), 'event': new_state, **details})
+        if new_state == OPEN:
+            print(f"[WARNING!] {self.name} circuit opened, pausing all requests for {details['backoff']:.1f} seconds.")
+        elif new_state == CLOSED:
+            print(f"{self.name} circuit closed, resuming requests.")
+
+
+def is_blocked_page(text: str, status: int = 200, url: str = '') -> bool:
+    '''
+    Check whether Google Scholar refused to serve a page: a 403/429 status, a CAPTCHA or reCAPTCHA
+    widget in the markup, or a final `url` on Google's "sorry" page. Free text is never matched, so a
+    paper titled "... Access Denied ..." is not a block.
+
+    Parameters
+    --------
+    text: The HTML of the response.
+    status: The HTTP status of the response.
+    url: The URL the response was served from, after redirects.
+    '''
+    return (status in BLOCK_STATUSES
+            or bool(_BLOCK_URL_PATTERN.match(url))
+            or _BLOCK_MARKUP_PATTERN.search(text) is not None)
+
+
+# One breaker for all Google Scholar traffic in this process: the async page fetcher,
+# `scholarly` lookups and organization-name requests.
+SCHOLAR_BREAKER = CircuitBreaker('Google Scholar',
+                                 block_exceptions=(ScholarBlockedError, MaxTriesExceededException, DOSException))
@@ -1,42 +1,76 @@
 # Copyright (c) 2024 Chen Liu
 # All rights reserved.
-import folium
+import asyncio
 import itertools
 import pandas as pd
 import os
 import pickle
-import pycountry
-import re
-import random
 import time
-import requests
 import json
 
-from geopy.geocoders import Nominatim
-from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.pool import ThreadPool as Pool
 from scholarly import scholarly, ProxyGenerator
 from tqdm import tqdm
-from typing import Any, List, Tuple
-
-from scripts.citation_map.scholarly_support import get_citing_author_ids_and_citing_papers, get_organization_name, NO_AUTHOR_FOUND_STR
-from config import GOOGLE_MAPS_API_KEY
-
-
-def find_all_citing_authors(scholar_id: str, num_processes: int = 16) -> List[Tuple[str]]:
+from typing import Any, Dict, List, Optional, Tuple
+
+from scripts.citation_map.affiliation_cleaning import clean_affiliation, clean_affiliations
+from scripts.citation_map.affiliation_store import AffiliationStore
+from scripts.citation_map.async_fetch import ScholarFetcher
+from scripts.citation_map.author_cache import AuthorCache
+from scripts.citation_map.citation_store import CitationStore
+from scripts.citation_map.circuit_breaker import SCHOLAR_BREAKER
+from scripts.citation_map.dedup import CitingPaperIndex, deduplicate_citing_records
+from scripts.citation_map.geocode_store import GeocodeStore
+from scripts.citation_map.geocoders import CachingGeocoder, GeocoderChain, default_geocoders
+from scripts.citation_map.http_fixtures import fixture_server_url
+from scripts.citation_map.map_render import create_map, save_map
+from scripts.citation_map.metrics import METRICS_FILENAME, MetricsCollector, PIPELINE_METRICS, metrics_path_for_csv
+from scripts.citation_map.pipeline import DEFAULT_QUEUE_SIZE, stream_async, stream_stage
+from scripts.citation_map.proxy_pool import SCHOLAR_PROXY_POOL
+from scripts.citation_map.records import COLUMN_DTYPES, CitationRecord, frame_to_records, records_to_frame
+from scripts.citation_map.reverse_geocode import load_reverse_geocoder
+from scripts.citation_map.scholarly_support import fetch_citing_author_ids_and_citing_papers, get_citing_author_ids_and_citing_papers, get_organization_name, NO_AUTHOR_FOUND_STR
+
+
+def find_all_citing_authors(scholar_id: str, num_processes: int = 16,
+                            citing_paper_index: Optional[CitingPaperIndex] = None,
+                            metrics: MetricsCollector = PIPELINE_METRICS) -> List[CitationRecord]:
     '''
     Step 1. Find all publications of the given Google Scholar ID.
     Step 2. Find all citing authors.
+    A citing paper that cites several publications is only kept once; which publications it cites
+    is recorded in `citing_paper_index`.
+    '''
+    if citing_paper_index is None:
+        citing_paper_index = CitingPaperIndex()
+    all_publication_info = find_all_publication_info(scholar_id, num_processes, metrics)
+
+    # Find all citing authors from all publications.
+    # This is purely I/O-bound, so all requests go through one rate-limited asyncio fetcher.
+    all_citing_author_paper_info_nested = asyncio.run(__citing_authors_and_papers_from_publications(all_publication_info, metrics))
+    all_citing_author_paper_info_nested = [deduplicate_citing_records(citing_author_paper_info, citing_paper_index)
+                                           for citing_author_paper_info in all_citing_author_paper_info_nested]
+    all_citing_author_paper_records = list(itertools.chain(*all_citing_author_paper_info_nested))
+    return all_citing_author_paper_records
+
+def find_all_publication_info(scholar_id: str, num_processes: int = 16,
+                              metrics: MetricsCollector = PIPELINE_METRICS) -> List[Tuple[str, str, str]]:
+    '''
+    Step 1. Find all publications of the given Google Scholar ID,
+    as (Google Scholar publication ID, paper title, citation) tuples.
     '''
     # Find Google Scholar Profile using Scholar ID.
-    author = scholarly.search_author_id(scholar_id)
-    author = scholarly.fill(author, sections=['publications'])
+    author = SCHOLAR_BREAKER.call(scholarly.search_author_id, scholar_id)
+    author = SCHOLAR_BREAKER.call(scholarly.fill, author, sections=['publications'])
     publications = author['publications']
     print('Author profile found, with %d publications.\n' % len(publications))
 
     # Fetch metadata for all publications.
+    __fill_publication_metadata_timed = metrics.timed('publication_metadata', __fill_publication_metadata)
     if num_processes > 1 and isinstance(num_processes, int):
         with Pool(processes=num_processes) as pool:
-            all_publications = list(tqdm(pool.imap(__fill_publication_metadata, publications),
+            all_publications = list(tqdm(pool.imap(__fill_publication_metadata_timed, publications),
                                          desc='Filling metadata for your %d publications' % len(publications),
                                          total=len(publications)))
     else:
@@ -44,7 +78,7 @@ def find_all_citing_authors(scholar_id: str, num_processes: int = 16) -> List[Tu
         for pub in tqdm(publications,
                         desc='Filling metadata for your %d publications' % len(publications),
                         total=len(publications)):
-            all_publications.append(__fill_publication_metadata(pub))
+            all_publications.append(__fill_publication_metadata_timed(pub))
 
     # Convert all publications to Google Scholar publication IDs and paper titles.
     # This is fast and no parallel processing is needed.
@@ -55,423 +89,363 @@ def find_all_citing_authors(scholar_id: str, num_processes: int = 16) -> List[Tu
                 pub_title = pub['bib']['title']
                 citation = pub['bib'].get('citation', '')  # Get citation info
                 all_publication_info.append((cites_id, pub_title, citation))
+    return all_publication_info
 
-    # Find all citing authors from all publications.
-    if num_processes > 1 and isinstance(num_processes, int):
-        with Pool(processes=num_processes) as pool:
-            all_citing_author_paper_info_nested = list(tqdm(pool.imap(__citing_authors_and_papers_from_publication, all_publication_info),
-                                                            desc='Finding citing authors and papers on your %d publications' % len(all_publication_info),
-                                                            total=len(all_publication_info)))
-    else:
-        all_citing_author_paper_info_nested = []
-        for pub in tqdm(all_publication_info,
-                        desc='Finding citing authors and papers on your %d publications' % len(all_publication_info),
-                        total=len(all_publication_info)):
-            all_citing_author_paper_info_nested.append(__citing_authors_and_papers_from_publication(pub))
-    all_citing_author_paper_tuple_list = list(itertools.chain(*all_citing_author_paper_info_nested))
-    return all_citing_author_paper_tuple_list
-
-def find_all_citing_affiliations(all_citing_author_paper_tuple_list: List[Tuple[str]],
+def find_all_citing_affiliations(all_citing_author_paper_records: List[CitationRecord],
                                  num_processes: int = 16,
-                                 affiliation_conservative: bool = False):
+                                 affiliation_conservative: bool = False,
+                                 metrics: MetricsCollector = PIPELINE_METRICS,
+                                 author_cache: Optional[AuthorCache] = None) -> List[CitationRecord]:
     '''
     Step 3. Find all citing affiliations.
+    With `author_cache` (shared by the applicants of a batch), each citing author is looked up once.
     '''
     if affiliation_conservative:
         __affiliations_from_authors = __affiliations_from_authors_conservative
     else:
         __affiliations_from_authors = __affiliations_from_authors_aggressive
+    if author_cache is not None:
+        __resolve_author = __affiliations_from_authors
+        __affiliations_from_authors = lambda record: author_cache.lookup(record, __resolve_author)
+    __affiliations_from_authors = metrics.timed('affiliation_lookup', __affiliations_from_authors)
 
     # Find all citing insitutions from all citing authors.
     if num_processes > 1 and isinstance(num_processes, int):
         with Pool(processes=num_processes) as pool:
-            author_paper_affiliation_tuple_list = list(tqdm(pool.imap(__affiliations_from_authors, all_citing_author_paper_tuple_list),
-                                                            desc='Finding citing affiliations from %d citing authors' % len(all_citing_author_paper_tuple_list),
-                                                            total=len(all_citing_author_paper_tuple_list)))
+            author_paper_affiliation_records = list(tqdm(pool.imap(__affiliations_from_authors, all_citing_author_paper_records),
+                                                         desc='Finding citing affiliations from %d citing authors' % len(all_citing_author_paper_records),
+                                                         total=len(all_citing_author_paper_records)))
     else:
-        author_paper_affiliation_tuple_list = []
-        for author_and_paper in tqdm(all_citing_author_paper_tuple_list,
-                                     desc='Finding citing affiliations from %d citing authors' % len(all_citing_author_paper_tuple_list),
-                                     total=len(all_citing_author_paper_tuple_list)):
-            author_paper_affiliation_tuple_list.append(__affiliations_from_authors(author_and_paper))
+        author_paper_affiliation_records = []
+        for author_and_paper in tqdm(all_citing_author_paper_records,
+                                     desc='Finding citing affiliations from %d citing authors' % len(all_citing_author_paper_records),
+                                     total=len(all_citing_author_paper_records)):
+            author_paper_affiliation_records.append(__affiliations_from_authors(author_and_paper))
 
     # Filter empty items.
-    author_paper_affiliation_tuple_list = [item for item in author_paper_affiliation_tuple_list if item]
-    return author_paper_affiliation_tuple_list
+    author_paper_affiliation_records = [item for item in author_paper_affiliation_records if item]
+    return author_paper_affiliation_records
 
-def clean_affiliation_names(author_paper_affiliation_tuple_list: List[Tuple[str]]) -> List[Tuple[str]]:
+def clean_affiliation_names(author_paper_affiliation_records: List[CitationRecord],
+                            metrics: MetricsCollector = PIPELINE_METRICS) -> List[CitationRecord]:
     '''
     Optional Step. Clean up the names of affiliations from the authors' affiliation tab on their Google Scholar profiles.
     NOTE: This logic is very naive. Please send an issue or pull request if you have any idea how to improve it.
     Currently we will not consider any paid service or tools that pose extra burden on the users, such as GPT API.
     '''
-    cleaned_author_paper_affiliation_tuple_list = []
-    for author_name, citing_paper_title, cited_paper_title, affiliation_string, author_id, *rest in author_paper_affiliation_tuple_list:
-        citation = rest[0] if rest else ''
-        if author_name == NO_AUTHOR_FOUND_STR:
-            cleaned_author_paper_affiliation_tuple_list.append((NO_AUTHOR_FOUND_STR, citing_paper_title, cited_paper_title, NO_AUTHOR_FOUND_STR, NO_AUTHOR_FOUND_STR, citation))
-        else:
-            # Use a regular expression to split the string by ';' or 'and'.
-            substring_list = [part.strip() for part in re.split(r'[;]|\band\b', affiliation_string)]
-            # Further split the substrings by ',' if the latter component is not a country.
-            substring_list = __country_aware_comma_split(substring_list)
-
-            for substring in substring_list:
-                # Use a regular expression to remove anything before 'at', or '@'.
-                cleaned_affiliation = re.sub(r'.*?\bat\b|.*?@', '', substring, flags=re.IGNORECASE).strip()
-                # Use a regular expression to filter out strings that represent
-                # a person's identity rather than affiliation.
-                is_common_identity_string = re.search(
-                    re.compile(
-                        r'\b(director|manager|chair|engineer|programmer|scientist|professor|lecturer|phd|ph\.d|postdoc|doctor|student|department of)\b',
-                        re.IGNORECASE),
-                    cleaned_affiliation)
-                if not is_common_identity_string:
-                    cleaned_author_paper_affiliation_tuple_list.append(
-                        (author_name, citing_paper_title, cited_paper_title, cleaned_affiliation, author_id, citation)
-                    )
-    return cleaned_author_paper_affiliation_tuple_list
-
-def affiliation_text_to_geocode(author_paper_affiliation_tuple_list: List[Tuple[str]], max_attempts: int = 3) -> List[Tuple[str]]:
+    # Clean each unique affiliation string once (or reuse an earlier run's result), then expand the records.
+    affiliation_store = AffiliationStore()
+    try:
+        with metrics.time_stage('affiliation_cleaning_batch'):
+            cleaned_affiliations = clean_affiliations((record.affiliation for record in author_paper_affiliation_records
+                                                       if record.author_name != NO_AUTHOR_FOUND_STR),
+                                                      affiliation_store, metrics)
+    finally:
+        affiliation_store.close()
+    cleaned_author_paper_affiliation_records = []
+    for author_paper_affiliation_record in author_paper_affiliation_records:
+        cleaned_author_paper_affiliation_records.extend(
+            __clean_affiliation_record(author_paper_affiliation_record, cleaned_affiliations))
+    return cleaned_author_paper_affiliation_records
+
+def affiliation_text_to_geocode(author_paper_affiliation_records: List[CitationRecord], max_attempts: int = 3,
+                                num_geocoding_workers: int = 8, offline_geocoding: bool = False,
+                                metrics: MetricsCollector = PIPELINE_METRICS,
+                                geocoder: Optional[CachingGeocoder] = None) -> List[CitationRecord]:
     '''
     Step 4: Convert affiliations in plain text to Geocode.
-    First tries Nominatim, falls back to Google Maps API if it times out.
-    Uses caching to store and retrieve previously geocoded affiliations.
+    Unique affiliations are geocoded concurrently, each through the provider chain (offline institution gazetteer,
+    then Nominatim, then Google Maps API) within every provider's own rate limit.
+    With `offline_geocoding`, only the gazetteer is used. Uses caching to store and retrieve previously geocoded affiliations.
+    A `geocoder` shared by several applicants is used instead of a new one, and left open.
     '''
     coordinates_and_info = []
-    import requests
-    import time
-    import json
-    import os
-    from config import GOOGLE_MAPS_API_KEY
-    from geopy.geocoders import Nominatim
-
-    # Initialize geocoders
-    nominatim = Nominatim(user_agent='citation_mapper')
-    
-    # Load cache if it exists
-    cache_file = 'geocode_cache.json'
-    geocode_cache = {}
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r') as f:
-                geocode_cache = json.load(f)
-        except Exception as e:
-            print(f"Error loading cache file: {str(e)}")
 
     # Find unique affiliations and record their corresponding entries.
     affiliation_map = {}
-    for entry_idx, (_, _, _, affiliation_name, _, *_) in enumerate(author_paper_affiliation_tuple_list):
+    for entry_idx, record in enumerate(author_paper_affiliation_records):
+        affiliation_name = record.affiliation
         if affiliation_name not in affiliation_map.keys():
             affiliation_map[affiliation_name] = [entry_idx]
         else:
             affiliation_map[affiliation_name].append(entry_idx)
 
-    num_total_affiliations = len(affiliation_map)
-    num_located_affiliations = 0
-    
-    for affiliation_name in tqdm(affiliation_map,
-                                 desc='Finding geographic coordinates from %d unique citing affiliations in %d entries' % (
-                                     len(affiliation_map), len(author_paper_affiliation_tuple_list)),
-                                 total=len(affiliation_map),
-                                 position=0,
-                                 leave=True):
-        if affiliation_name == NO_AUTHOR_FOUND_STR:
-            corresponding_entries = affiliation_map[affiliation_name]
-            for entry_idx in corresponding_entries:
-                author_name, citing_paper_title, cited_paper_title, affiliation_name, author_id, *rest = author_paper_affiliation_tuple_list[entry_idx]
-                citation = rest[0] if rest else ''
-                coordinates_and_info.append((author_name, citing_paper_title, cited_paper_title, affiliation_name,
-                                           '', '', '', '', '', '', author_id, citation))
-        else:
-            # Check cache first - only based on affiliation name
-            if affiliation_name in geocode_cache:
-                cached_data = geocode_cache[affiliation_name]
-                # Use cached data for all entries with this affiliation
-                corresponding_entries = affiliation_map[affiliation_name]
-                for entry_idx in corresponding_entries:
-                    author_name, citing_paper_title, cited_paper_title, affiliation_name, author_id, *rest = author_paper_affiliation_tuple_list[entry_idx]
-                    citation = rest[0] if rest else ''
-                    coordinates_and_info.append((author_name, citing_paper_title, cited_paper_title, affiliation_name,
-                                               cached_data['lat'], cached_data['lng'], cached_data['county'],
-                                               cached_data['city'], cached_data['state'], cached_data['country'], author_id, citation))
-                num_located_affiliations += 1
-                continue
-
-            # If not in cache, try to geocode
-            for attempt in range(max_attempts):
-                try:
-                    # Add a longer delay between requests to respect rate limits
-                    if attempt > 0:
-                        time.sleep(2)  # 2 second delay between retries
-                    else:
-                        time.sleep(1)  # 1 second delay between different affiliations
-
-                    # Try Nominatim first
-                    if attempt == 0:
-                        geo_location = nominatim.geocode(affiliation_name, timeout=30)  # Increased timeout to 30 seconds
-                        if geo_location:
-                            # Get the full location metadata
-                            time.sleep(1)  # Additional delay before reverse geocoding
-                            location_metadata = nominatim.reverse(str(geo_location.latitude) + ',' + str(geo_location.longitude), 
-                                                                language='en', timeout=30)  # Increased timeout to 30 seconds
-                            address = location_metadata.raw['address']
-                            lat, lng = geo_location.latitude, geo_location.longitude
-                            county = address.get('county')
-                            city = address.get('city')
-                            state = address.get('state')
-                            country = address.get('country')
-                    else:
-                        # Fall back to Google Maps API
-                        time.sleep(0.1)  # Respect rate limits
-                        url = f'https://maps.googleapis.com/maps/api/geocode/json?address={affiliation_name}&key={GOOGLE_MAPS_API_KEY}'
-                        response = requests.get(url)
-                        data = response.json()
-                        
-                        if data['status'] == 'OK':
-                            result = data['results'][0]
-                            location = result['geometry']['location']
-                            lat, lng = location['lat'], location['lng']
-                            
-                            # Get address components
-                            address_components = result.get('address_components', [])
-                            county, city, state, country = None, None, None, None
-                            
-                            for component in address_components:
-                                types = component['types']
-                                if 'administrative_area_level_2' in types:
-                                    county = component['long_name']
-                                elif 'locality' in types:
-                                    city = component['long_name']
-                                elif 'administrative_area_level_1' in types:
-                                    state = component['long_name']
-                                elif 'country' in types:
-                                    country = component['long_name']
-                        else:
-                            lat, lng, county, city, state, country = '', '', '', '', '', ''
-                    
-                    # If we got valid coordinates, break the retry loop
-                    if lat and lng:
-                        break
-                except Exception as e:
-                    print(f"Error geocoding {affiliation_name}: {str(e)}")
-                    if attempt == max_attempts - 1:
-                        lat, lng, county, city, state, country = '', '', '', '', '', ''
-                    continue
-
-            # Cache the results
-            geocode_cache[affiliation_name] = {
-                'lat': lat,
-                'lng': lng,
-                'county': county,
-                'city': city,
-                'state': state,
-                'country': country
-            }
-
-            # Use the geocoded data for all entries with this affiliation
-            corresponding_entries = affiliation_map[affiliation_name]
-            for entry_idx in corresponding_entries:
-                author_name, citing_paper_title, cited_paper_title, affiliation_name, author_id, *rest = author_paper_affiliation_tuple_list[entry_idx]
-                citation = rest[0] if rest else ''
-                coordinates_and_info.append((author_name, citing_paper_title, cited_paper_title, affiliation_name,
-                                           lat, lng, county, city, state, country, author_id, citation))
-            num_located_affiliations += 1
-
-    # Save the updated cache
+    shared_geocoder = geocoder is not None
+    if not shared_geocoder:
+        geocoder = __caching_geocoder(max_attempts, offline_geocoding, metrics)
     try:
-        with open(cache_file, 'w') as f:
-            json.dump(geocode_cache, f)
-    except Exception as e:
-        print(f"Error saving cache file: {str(e)}")
-
-    print(f"\nSuccessfully located {num_located_affiliations} out of {num_total_affiliations} unique affiliations.")
+        locations = geocoder.geocode_many([affiliation_name for affiliation_name in affiliation_map
+                                           if affiliation_name != NO_AUTHOR_FOUND_STR],
+                                          max_workers=num_geocoding_workers)
+    finally:
+        if not shared_geocoder:
+            geocoder.close()
+
+    for affiliation_name, entry_indices in affiliation_map.items():
+        for entry_idx in entry_indices:
+            coordinates_and_info.append(__add_geocode(author_paper_affiliation_records[entry_idx], locations.get(affiliation_name)))
+
+    num_located_affiliations = sum(1 for location in locations.values() if location['lat'] and location['lng'])
+    print(f"\nSuccessfully located {num_located_affiliations} out of {len(locations)} unique affiliations.")
     coordinates_and_info = [item for item in coordinates_and_info if item is not None]  # Filter out empty entries.
     return coordinates_and_info
 
-def export_dict_to_csv(coordinates_and_info: List[Tuple[str]], csv_output_path: str) -> None:
+def stream_citation_pipeline(scholar_id: str,
+                             num_processes: int = 16,
+                             affiliation_conservative: bool = False,
+                             max_attempts: int = 3,
+                             num_geocoding_workers: int = 8,
+                             offline_geocoding: bool = False,
+                             queue_size: int = DEFAULT_QUEUE_SIZE,
+                             citing_paper_index: Optional[CitingPaperIndex] = None,
+                             metrics: MetricsCollector = PIPELINE_METRICS) -> List[CitationRecord]:
+    '''
+    Steps 2-4 as a streaming pipeline.
+    Citing records feed affiliation resolution, which feeds cleaning, which feeds geocoding. Each stage
+    runs in its own threads connected by bounded queues, so geocoding (with its own rate limit) overlaps
+    the long Google Scholar phase and the end-to-end time approaches that of the slowest stage.
+    Duplicate citing papers are dropped before affiliation resolution and recorded in `citing_paper_index`.
+    Per-item stage latencies, requests and cache hits are recorded in `metrics`.
+    '''
+    if citing_paper_index is None:
+        citing_paper_index = CitingPaperIndex()
+    if affiliation_conservative:
+        __affiliations_from_authors = __affiliations_from_authors_conservative
+    else:
+        __affiliations_from_authors = __affiliations_from_authors_aggressive
+    __affiliations_from_authors = metrics.timed('affiliation_lookup', __affiliations_from_authors)
+
+    all_publication_info = find_all_publication_info(scholar_id, num_processes, metrics)
+
+    affiliation_store = AffiliationStore()
+    geocoder = __caching_geocoder(max_attempts, offline_geocoding, metrics)
+    locations = {}
+    # Raw affiliation -> cleaned affiliations, so a repeated affiliation costs no store round trip.
+    cleaned_by_affiliation = {}
+
+    def _clean(author_paper_affiliation_record):
+        with metrics.time_stage('affiliation_cleaning'):
+            affiliation = author_paper_affiliation_record.affiliation
+            if author_paper_affiliation_record.author_name != NO_AUTHOR_FOUND_STR:
+                if affiliation in cleaned_by_affiliation:
+                    metrics.record_cache('affiliation_memo', hits=1)
+                else:
+                    metrics.record_cache('affiliation_memo', misses=1)
+                    cleaned_by_affiliation.update(clean_affiliations([affiliation], affiliation_store, metrics))
+            return __clean_affiliation_record(author_paper_affiliation_record, cleaned_by_affiliation)
+
+    def _geocode(author_paper_affiliation_record):
+        location = None
+        if author_paper_affiliation_record.affiliation != NO_AUTHOR_FOUND_STR:
+            location = geocoder.geocode(author_paper_affiliation_record.affiliation)
+            locations[author_paper_affiliation_record.affiliation] = location
+        return [__add_geocode(author_paper_affiliation_record, location)]
+
+    citing_records = stream_async(lambda: __iter_citing_authors_and_papers_from_publications(all_publication_info, citing_paper_index, metrics),
+                                 maxsize=queue_size)
+    affiliation_records = stream_stage(citing_records,
+                                       lambda item: [result for result in [__affiliations_from_authors(item)] if result],
+                                       num_workers=max(1, num_processes), maxsize=queue_size)
+    cleaned_records = stream_stage(affiliation_records, _clean, maxsize=queue_size)
+    # Each geocoding provider enforces its own rate limit, so several workers can share them.
+    geocoded_records = stream_stage(cleaned_records, _geocode, num_workers=num_geocoding_workers, maxsize=queue_size)
+
+    try:
+        coordinates_and_info = list(tqdm(geocoded_records, desc='Streaming citing entries through affiliation lookup and geocoding'))
+        # Fill county/city/state/country that the geocoders left empty, in one offline batch.
+        if geocoder.fill_admin_fields(locations):
+            coordinates_and_info = [__add_geocode(record, locations[record.affiliation]) if record.affiliation in locations else record
+                                    for record in coordinates_and_info]
+    finally:
+        geocoder.close()
+        affiliation_store.close()
+    return coordinates_and_info
+
+def export_dict_to_csv(coordinates_and_info: List[CitationRecord], csv_output_path: str,
+                       citing_paper_index: Optional[CitingPaperIndex] = None) -> None:
     '''
     Step 5.1: Export csv file recording citation information.
+    The table is written to the applicant's typed Parquet store (next to the CSV, see `CitationStore`)
+    and the CSV is exported from it as a view.
+    With `citing_paper_index`, also record how many of the applicant's papers each citing paper cites.
     '''
-    citation_df = pd.DataFrame(coordinates_and_info,
-                               columns=['citing author name', 'citing paper title', 'cited paper title',
-                                        'affiliation', 'latitude', 'longitude',
-                                        'county', 'city', 'state', 'country',
-                                        'author_id', 'citation'])  # Added citation column
+    citation_df = records_to_frame(coordinates_and_info)
 
     # Add Google Scholar profile links
     citation_df['google_scholar_link'] = citation_df['author_id'].apply(
         lambda x: f'https://scholar.google.com/citations?user={x}&hl=en' if x != NO_AUTHOR_FOUND_STR and x != '' else ''
     )
 
-    citation_df.to_csv(csv_output_path)
+    if citing_paper_index is not None:
+        # Keys were attached by de-duplication, before any stage could rewrite the author ID.
+        citing_paper_keys = [record.citing_paper_key for record in coordinates_and_info]
+        citation_df['citing_paper_key'] = citing_paper_keys
+        citation_df['num_cited_papers'] = [citing_paper_index.num_cited_papers(key) for key in citing_paper_keys]
+
+    citation_store = CitationStore.for_csv(csv_output_path)
+    citation_store.write(citation_df)
+    citation_store.export_csv(csv_output_path, citation_df)
     return
 
-def read_csv_to_dict(csv_path: str) -> None:
+def export_citation_statistics(citing_paper_index: CitingPaperIndex, json_output_path: str) -> dict:
+    '''
+    Step 5.2: Export de-duplicated citation counts (unique citing papers, citing papers per cited paper).
+    '''
+    statistics = citing_paper_index.statistics()
+    with open(json_output_path, 'w') as f:
+        json.dump(statistics, f, indent=2)
+    print(f"Found {statistics['num_unique_citing_papers']} unique citing papers "
+          f"({statistics['num_duplicates_removed']} duplicates across your publications removed).")
+    return statistics
+
+def read_csv_to_dict(csv_path: str) -> List[CitationRecord]:
     '''
     Step 5.1: Read csv file recording citation information.
-    Only relevant if `read_from_csv` is True.
+    Only relevant if `read_from_csv` is True. Reads the Parquet store behind the CSV when there is one.
     '''
-
-    citation_df = pd.read_csv(csv_path, index_col=0)
-    coordinates_and_info = list(citation_df.itertuples(index=False, name=None))
+    citation_df = CitationStore.for_csv(csv_path).read(columns=list(COLUMN_DTYPES))
+    coordinates_and_info = frame_to_records(citation_df)
     return coordinates_and_info
 
-def create_map(coordinates_and_info: List[Tuple[str]], pin_colorful: bool = True):
-    """
-    Create an interactive map using Folium.
-    """
-    # Create a map centered at the mean of all coordinates
-    valid_coords = [(float(lat), float(lng)) for _, _, _, _, lat, lng, _, _, _, _, _, _ in coordinates_and_info 
-                    if lat and lng and lat != '' and lng != '']
-    
-    if not valid_coords:
-        print("No valid coordinates found to create map.")
-        return None
-    
-    mean_lat = sum(lat for lat, _ in valid_coords) / len(valid_coords)
-    mean_lng = sum(lng for _, lng in valid_coords) / len(valid_coords)
-    
-    m = folium.Map(location=[mean_lat, mean_lng], zoom_start=2)
-    
-    # Add markers for each location
-    for author_name, citing_paper_title, cited_paper_title, affiliation_name, lat, lng, county, city, state, country, author_id, citation in coordinates_and_info:
-        if not lat or not lng or lat == '' or lng == '':
-            continue
-            
-        # Create popup content
-        popup_content = f"""
-        <b>Author:</b> {author_name}<br>
-        <b>Affiliation:</b> {affiliation_name}<br>
-        <b>Citing Paper:</b> {citing_paper_title}<br>
-        <b>Cited Paper:</b> {cited_paper_title}<br>
-        <b>Location:</b> {city}, {state}, {country}<br>
-        <b>Citation:</b> {citation}
-        """
-        
-        # Choose marker color based on pin_colorful flag
-        if pin_colorful:
-            # Use a random color for each marker
-            color = random.choice(['red', 'blue', 'green', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen', 'cadetblue', 'darkpurple', 'pink', 'lightblue', 'lightgreen', 'gray', 'black', 'lightgray'])
-        else:
-            color = 'red'
-            
-        # Add marker to map
-        folium.Marker(
-            location=[float(lat), float(lng)],
-            popup=folium.Popup(popup_content, max_width=300),
-            icon=folium.Icon(color=color, icon='info-sign')
-        ).add_to(m)
-    
-    return m
-
 def __fill_publication_metadata(pub):
     """
     Fill metadata for a single publication.
     """
     try:
-        return scholarly.fill(pub)
+        return SCHOLAR_BREAKER.call(scholarly.fill, pub)
     except Exception as e:
         print(f"Error filling publication metadata: {str(e)}")
         return pub
 
-def __citing_authors_and_papers_from_publication(cites_id_and_cited_paper: Tuple[str, str]):
+async def __citing_authors_and_papers_from_publications(all_publication_info: List[Tuple[str, str, str]],
+                                                        metrics: MetricsCollector = PIPELINE_METRICS):
+    """
+    Get citing authors and papers for all publications, sharing a single Scholar fetcher.
+    """
+    async with ScholarFetcher(metrics=metrics) as fetcher:
+        with tqdm(desc='Finding citing authors and papers on your %d publications' % len(all_publication_info),
+                  total=len(all_publication_info)) as pbar:
+            async def _one_publication(cites_id_and_cited_paper):
+                result = await __citing_authors_and_papers_from_publication(fetcher, cites_id_and_cited_paper, metrics)
+                pbar.update(1)
+                return result
+
+            return await asyncio.gather(*(_one_publication(pub) for pub in all_publication_info))
+
+async def __citing_authors_and_papers_from_publication(fetcher: ScholarFetcher, cites_id_and_cited_paper: Tuple[str, str, str],
+                                                       metrics: MetricsCollector = PIPELINE_METRICS, key: Any = None):
     """
     Get citing authors and papers for a single publication.
+    `key` identifies the applicant to a fair (batch) fetcher.
     """
     cites_id, cited_paper_title, citation = cites_id_and_cited_paper
     try:
-        citing_author_ids, citing_papers = get_citing_author_ids_and_citing_papers(cites_id)
-        # Zip the two lists together to create proper tuples
+        with metrics.time_stage('citing_authors'):
+            citing_author_ids, citing_papers = await fetch_citing_author_ids_and_citing_papers(fetcher, cites_id, key)
+        # Zip the two lists together to create one record per citing author
         result = []
         for author_id, paper_info in zip(citing_author_ids, citing_papers):
             if isinstance(paper_info, dict):
                 citing_paper_title = paper_info.get('title', 'Unknown Title')
             else:
                 citing_paper_title = str(paper_info)
-            result.append((author_id, citing_paper_title, cited_paper_title, citation))
+            result.append(CitationRecord(author_id=author_id, citing_paper_title=citing_paper_title,
+                                         cited_paper_title=cited_paper_title, citation=citation))
         return result
     except Exception as e:
         print(f"Error getting citing authors for paper {cited_paper_title}: {str(e)}")
         return []
 
-def __affiliations_from_authors_conservative(citing_author_paper_info: str):
+async def __iter_citing_authors_and_papers_from_publications(all_publication_info: List[Tuple[str, str, str]],
+                                                            citing_paper_index: CitingPaperIndex,
+                                                            metrics: MetricsCollector = PIPELINE_METRICS):
+    """
+    Yield citing-author records (author ID, citing paper title, cited paper title, citation) as soon as
+    each publication's citation pages have been fetched, skipping citing papers already yielded.
+    """
+    async with ScholarFetcher(metrics=metrics) as fetcher:
+        tasks = [asyncio.ensure_future(__citing_authors_and_papers_from_publication(fetcher, pub, metrics))
+                 for pub in all_publication_info]
+        for next_done in asyncio.as_completed(tasks):
+            for citing_author_paper_record in deduplicate_citing_records(await next_done, citing_paper_index):
+                yield citing_author_paper_record
+
+def __affiliations_from_authors_conservative(citing_author_paper_record: CitationRecord) -> CitationRecord:
     """
     Get affiliations from authors using conservative approach.
     """
-    author_id, citing_paper_title, cited_paper_title, citation = citing_author_paper_info
+    author_id = citing_author_paper_record.author_id
     try:
-        author = scholarly.search_author_id(author_id)
-        author = scholarly.fill(author, sections=['affiliation'])
+        author = SCHOLAR_BREAKER.call(scholarly.search_author_id, author_id)
+        author = SCHOLAR_BREAKER.call(scholarly.fill, author, sections=['affiliation'])
         affiliation = author.get('affiliation', NO_AUTHOR_FOUND_STR)
         author_name = author.get('name', NO_AUTHOR_FOUND_STR)
-        return (author_name, citing_paper_title, cited_paper_title, affiliation, author_id, citation)
+        return citing_author_paper_record.replace(author_name=author_name, affiliation=affiliation)
     except Exception as e:
         print(f"Error getting affiliation for author {author_id}: {str(e)}")
-        return (NO_AUTHOR_FOUND_STR, citing_paper_title, cited_paper_title, NO_AUTHOR_FOUND_STR, author_id, citation)
+        return citing_author_paper_record.replace(author_name=NO_AUTHOR_FOUND_STR, affiliation=NO_AUTHOR_FOUND_STR)
 
-def __affiliations_from_authors_aggressive(citing_author_paper_info: str):
+def __affiliations_from_authors_aggressive(citing_author_paper_record: CitationRecord) -> CitationRecord:
     """
     Get affiliations from authors using aggressive approach.
     """
-    author_id, citing_paper_title, cited_paper_title, citation = citing_author_paper_info
+    author_id = citing_author_paper_record.author_id
     try:
-        author = scholarly.search_author_id(author_id)
-        author = scholarly.fill(author, sections=['affiliation'])
+        author = SCHOLAR_BREAKER.call(scholarly.search_author_id, author_id)
+        author = SCHOLAR_BREAKER.call(scholarly.fill, author, sections=['affiliation'])
         affiliation = author.get('affiliation', NO_AUTHOR_FOUND_STR)
         author_name = author.get('name', NO_AUTHOR_FOUND_STR)
-        return (author_name, citing_paper_title, cited_paper_title, affiliation, author_id, citation)
+        return citing_author_paper_record.replace(author_name=author_name, affiliation=affiliation)
     except Exception as e:
         print(f"Error getting affiliation for author {author_id}: {str(e)}")
-        return (NO_AUTHOR_FOUND_STR, citing_paper_title, cited_paper_title, NO_AUTHOR_FOUND_STR, author_id, citation)
-
-def __country_aware_comma_split(string_list: List[str]) -> List[str]:
-    """
-    Split strings by comma, but be aware of country names.
-    """
-    result = []
-    for string in string_list:
-        if not string:
-            continue
-        parts = string.split(',')
-        current_part = parts[0]
-        for part in parts[1:]:
-            if __iscountry(part.strip()):
-                result.append(current_part.strip())
-                current_part = part
-            else:
-                current_part += ',' + part
-        result.append(current_part.strip())
-    return result
+        return citing_author_paper_record.replace(author_name=NO_AUTHOR_FOUND_STR, affiliation=NO_AUTHOR_FOUND_STR)
 
-def __iscountry(string: str) -> bool:
+def __clean_affiliation_record(author_paper_affiliation_record: CitationRecord,
+                               cleaned_affiliations: Optional[Dict[str, Tuple[str, ...]]] = None) -> List[CitationRecord]:
     """
-    Check if a string is a country name.
+    Clean up the affiliation of one citing-author record.
+    Returns one record per affiliation found in the affiliation string.
+    `cleaned_affiliations` holds affiliations already cleaned in batch by `clean_affiliations`.
     """
-    try:
-        return pycountry.countries.get(name=string) is not None
-    except:
-        return False
+    if author_paper_affiliation_record.author_name == NO_AUTHOR_FOUND_STR:
+        return [author_paper_affiliation_record.replace(affiliation=NO_AUTHOR_FOUND_STR, author_id=NO_AUTHOR_FOUND_STR)]
+
+    affiliation = author_paper_affiliation_record.affiliation
+    if cleaned_affiliations is not None and affiliation in cleaned_affiliations:
+        cleaned_affiliation_list = cleaned_affiliations[affiliation]
+    else:
+        cleaned_affiliation_list = clean_affiliation(affiliation)
+    return [author_paper_affiliation_record.replace(affiliation=cleaned_affiliation)
+            for cleaned_affiliation in cleaned_affiliation_list]
+
+def __caching_geocoder(max_attempts: int = 3, offline_geocoding: bool = False,
+                       metrics: MetricsCollector = PIPELINE_METRICS) -> CachingGeocoder:
+    """
+    Gazetteer -> Nominatim -> Google Maps API fallback chain in front of the persistent geocode store.
+    """
+    return CachingGeocoder(GeocoderChain(default_geocoders(offline=offline_geocoding, max_retries=max_attempts - 1, metrics=metrics)),
+                           GeocodeStore(), load_reverse_geocoder(), metrics)
+
+def __add_geocode(author_paper_affiliation_record: CitationRecord, cached_data: Optional[dict]) -> CitationRecord:
+    """
+    Copy of an affiliation record with the location metadata filled in.
+    """
+    if cached_data is None:
+        return author_paper_affiliation_record
+    return author_paper_affiliation_record.replace(latitude=cached_data['lat'], longitude=cached_data['lng'],
+                                                   county=cached_data['county'], city=cached_data['city'],
+                                                   state=cached_data['state'], country=cached_data['country'])
 
-def __print_author_and_affiliation(author_paper_affiliation_tuple_list: List[Tuple[str]]) -> None:
+def __print_author_and_affiliation(author_paper_affiliation_records: List[CitationRecord]) -> None:
     """
     Print author and affiliation information.
     """
-    for item in author_paper_affiliation_tuple_list:
-        # Handle both 6-value and 12-value tuples
-        if len(item) == 6:
-            author_name, citing_paper_title, cited_paper_title, affiliation_name, author_id, citation = item
-        elif len(item) == 12:
-            author_name, citing_paper_title, cited_paper_title, affiliation_name, lat, lng, county, city, state, country, author_id, citation = item
-        else:
-            print(f"Unexpected tuple length: {len(item)}")
-            continue
-            
-        print(f"Author: {author_name}")
-        print(f"Affiliation: {affiliation_name}")
-        print(f"Citing Paper: {citing_paper_title}")
-        print(f"Cited Paper: {cited_paper_title}")
-        print(f"Citation: {citation}")
+    for record in author_paper_affiliation_records:
+        print(f"Author: {record.author_name}")
+        print(f"Affiliation: {record.affiliation}")
+        print(f"Citing Paper: {record.citing_paper_title}")
+        print(f"Cited Paper: {record.cited_paper_title}")
+        print(f"Citation: {record.citation}")
         print("-" * 80)
 
 def save_cache(data: Any, fpath: str) -> None:
@@ -491,12 +465,27 @@ def load_cache(fpath: str) -> Any:
 def setup_proxy_system(max_retries=3):
     """
     Set up proxy system for scholarly.
+    Uses the healthiest proxy from our own pool when one is configured, otherwise free proxies.
+    With configured proxies, the pool stops using the direct connection for every Scholar request,
+    and a RuntimeError is raised if none of them can be set up.
+    While a fixture server is in use, scholarly keeps sending its requests there and no proxy is set up.
     """
+    if fixture_server_url() is not None:
+        print(f"Using the fixture server at {fixture_server_url()}, not setting up proxies.")
+        return True
     pg = ProxyGenerator()
     success = False
+    if SCHOLAR_PROXY_POOL.has_proxies:
+        SCHOLAR_PROXY_POOL.allow_direct = False
     for attempt in range(max_retries):
         try:
-            success = pg.FreeProxies()
+            if SCHOLAR_PROXY_POOL.has_proxies:
+                proxy = SCHOLAR_PROXY_POOL.acquire()
+                success = pg.SingleProxy(http=proxy, https=proxy)
+                if not success:
+                    SCHOLAR_PROXY_POOL.report_failure(proxy)
+            else:
+                success = pg.FreeProxies()
             if success:
                 scholarly.use_proxy(pg)
                 print("Successfully set up proxy system.")
@@ -507,6 +496,8 @@ def setup_proxy_system(max_retries=3):
                 time.sleep(2)
             else:
                 print("Failed to set up proxy system after all attempts.")
+    if not success and SCHOLAR_PROXY_POOL.has_proxies:
+        raise RuntimeError("[ERROR!] Proxies were requested but none of the configured proxies could be set up.")
     return success
 
 def generate_citation_map(scholar_id: str,
@@ -518,58 +509,177 @@ def generate_citation_map(scholar_id: str,
                          num_processes: int = 16,
                          use_proxy: bool = False,
                          pin_colorful: bool = True,
-                         print_citing_affiliations: bool = True):
+                         print_citing_affiliations: bool = True,
+                         offline_geocoding: bool = False,
+                         render_mode: str = 'markers',
+                         report_load_time: bool = False):
     """
     Generate citation map for a given scholar ID.
+    With `offline_geocoding`, affiliations are located only through the local institution gazetteer.
+    `render_mode` is one of map_render.RENDER_MODES; 'cluster' or 'geojson' keep the HTML small for large maps.
+    With `report_load_time`, the saved map is loaded in headless Chrome to report its load time.
+    Metrics of the run (requests, retries, CAPTCHAs, cache hits, stage latencies) are written to
+    `citation_metrics.json` next to the CSV.
     """
     if use_proxy:
         setup_proxy_system()
-    
+
+    metrics = MetricsCollector('citation_map')
     if parse_csv:
         coordinates_and_info = read_csv_to_dict(csv_output_path)
     else:
-        # Step 1: Find all citing authors
-        all_citing_author_paper_tuple_list = find_all_citing_authors(scholar_id, num_processes)
-        
-        # Step 2: Find all citing affiliations
-        author_paper_affiliation_tuple_list = find_all_citing_affiliations(
-            all_citing_author_paper_tuple_list,
-            num_processes,
-            affiliation_conservative
-        )
-        
-        # Optional Step: Clean up affiliation names
-        cleaned_author_paper_affiliation_tuple_list = clean_affiliation_names(author_paper_affiliation_tuple_list)
-        
-        # Step 3: Convert affiliations to geocodes
-        coordinates_and_info = affiliation_text_to_geocode(cleaned_author_paper_affiliation_tuple_list)
-        
+        # Steps 1-4: Find citing authors, their affiliations, clean them up and geocode them.
+        # The stages are streamed so that geocoding overlaps the Google Scholar phase.
+        citing_paper_index = CitingPaperIndex()
+        with metrics.time_stage('pipeline'):
+            coordinates_and_info = stream_citation_pipeline(scholar_id, num_processes, affiliation_conservative,
+                                                            offline_geocoding=offline_geocoding,
+                                                            citing_paper_index=citing_paper_index,
+                                                            metrics=metrics)
+
+        breaker_stats = SCHOLAR_BREAKER.stats()
+        print(f"Google Scholar: {breaker_stats['num_blocks']} blocks in {breaker_stats['num_calls']} requests "
+              f"({breaker_stats['block_rate']:.1%}), circuit opened {breaker_stats['num_opens']} times.")
+        if SCHOLAR_PROXY_POOL.has_proxies:
+            for proxy_stats in SCHOLAR_PROXY_POOL.stats():
+                print(f"Proxy {proxy_stats['endpoint']}: score {proxy_stats['score']:.3f}, "
+                      f"{proxy_stats['num_successes']} successes, {proxy_stats['num_failures']} failures.")
+
         # Export to CSV
-        export_dict_to_csv(coordinates_and_info, csv_output_path)
+        with metrics.time_stage('export'):
+            export_dict_to_csv(coordinates_and_info, csv_output_path, citing_paper_index)
+            export_citation_statistics(citing_paper_index,
+                                       os.path.join(os.path.dirname(csv_output_path), 'citation_statistics.json'))
     
     # Create and save the map
-    m = create_map(coordinates_and_info, pin_colorful)
-    if m:
-        m.save(output_path)
-        print(f"Map saved to {output_path}")
+    with metrics.time_stage('render_map'):
+        m = create_map(coordinates_and_info, pin_colorful, render_mode)
+        if m:
+            save_map(m, output_path, report_load_time)
+
+    if not parse_csv:
+        # Reading back a CSV does no scraping, so keep the metrics of the run that produced it.
+        metrics.write_json(metrics_path_for_csv(csv_output_path))
     
     if print_citing_affiliations:
         __print_author_and_affiliation(coordinates_and_info)
     
     return coordinates_and_info
 
+def generate_citation_maps(applicants: Dict[str, str],
+                           output_base_folder: str,
+                           affiliation_conservative: bool = False,
+                           num_processes: int = 16,
+                           max_parallel_applicants: int = 4,
+                           use_proxy: bool = False,
+                           pin_colorful: bool = True,
+                           offline_geocoding: bool = False,
+                           render_mode: str = 'markers') -> Dict[str, List[CitationRecord]]:
+    """
+    Batch mode: generate the citation maps of several applicants in one process.
+    All applicants share one rate-limited Scholar fetcher that admits their requests round-robin, so one
+    huge profile cannot starve the others, plus in-process caches of Scholar pages and citing authors
+    and one geocoder (and its persistent store). An applicant's affiliation lookup, geocoding and export
+    start as soon as its Scholar pages are in, for up to `max_parallel_applicants` applicants at a time,
+    each with the same number of workers.
+    Each applicant's files are written to `output_base_folder/<applicant>/` as in `generate_citation_map`,
+    and the shared fetcher and geocoder metrics to `output_base_folder/citation_metrics.json`.
+
+    Parameters
+    --------
+    applicants: Applicant (e.g. email address, used as folder name) -> Google Scholar ID.
+    output_base_folder: Folder holding one output folder per applicant.
+    max_parallel_applicants: Applicants whose post-Scholar steps run at the same time.
+    """
+    if use_proxy:
+        setup_proxy_system()
+
+    batch_metrics = MetricsCollector('citation_batch')
+    author_cache = AuthorCache(batch_metrics)
+    geocoder = __caching_geocoder(offline_geocoding=offline_geocoding, metrics=batch_metrics)
+    try:
+        with ThreadPoolExecutor(max_workers=max_parallel_applicants) as executor:
+            results = asyncio.run(__citation_batch(applicants, output_base_folder, executor, author_cache, geocoder,
+                                                   batch_metrics, affiliation_conservative, num_processes,
+                                                   pin_colorful, render_mode))
+    finally:
+        geocoder.close()
+
+    coordinates_and_info_per_applicant = {}
+    for applicant, result in zip(applicants, results):
+        if isinstance(result, BaseException):
+            print(f"[ERROR!] Citation map failed for {applicant}: {str(result)}")
+        else:
+            coordinates_and_info_per_applicant[applicant] = result
+    print(f"Citation maps generated for {len(coordinates_and_info_per_applicant)} of {len(applicants)} applicants "
+          f"({len(author_cache)} unique citing authors looked up).")
+    batch_metrics.write_json(os.path.join(output_base_folder, METRICS_FILENAME))
+    return coordinates_and_info_per_applicant
+
+async def __citation_batch(applicants: Dict[str, str], output_base_folder: str, executor: ThreadPoolExecutor,
+                           author_cache: AuthorCache, geocoder: CachingGeocoder, batch_metrics: MetricsCollector,
+                           affiliation_conservative: bool, num_processes: int, pin_colorful: bool, render_mode: str):
+    """
+    Run every applicant's Scholar phase on one fair fetcher, and hand each applicant to `executor` when it is done.
+    Returns one result (the applicant's records, or the exception it failed with) per applicant.
+    """
+    loop = asyncio.get_running_loop()
+    async with ScholarFetcher(metrics=batch_metrics, fair=True, response_cache={}) as fetcher:
+        async def _one_applicant(applicant, scholar_id):
+            metrics = MetricsCollector('citation_map')
+            all_publication_info = await loop.run_in_executor(None, find_all_publication_info, scholar_id, num_processes, metrics)
+            all_citing_author_paper_info_nested = await asyncio.gather(
+                *(__citing_authors_and_papers_from_publication(fetcher, pub, metrics, key=applicant) for pub in all_publication_info))
+            citing_paper_index = CitingPaperIndex()
+            all_citing_author_paper_records = list(itertools.chain(*(
+                deduplicate_citing_records(citing_author_paper_info, citing_paper_index)
+                for citing_author_paper_info in all_citing_author_paper_info_nested)))
+            print(f"{applicant}: Scholar phase done, {len(all_citing_author_paper_records)} citing entries.")
+            return await loop.run_in_executor(executor, __finish_applicant, applicant, all_citing_author_paper_records,
+                                              citing_paper_index, os.path.join(output_base_folder, applicant), metrics,
+                                              author_cache, geocoder, affiliation_conservative, num_processes,
+                                              pin_colorful, render_mode)
+
+        return await asyncio.gather(*(_one_applicant(applicant, scholar_id) for applicant, scholar_id in applicants.items()),
+                                    return_exceptions=True)
+
+def __finish_applicant(applicant: str, all_citing_author_paper_records: List[CitationRecord],
+                       citing_paper_index: CitingPaperIndex, output_folder: str, metrics: MetricsCollector,
+                       author_cache: AuthorCache, geocoder: CachingGeocoder, affiliation_conservative: bool,
+                       num_processes: int, pin_colorful: bool, render_mode: str) -> List[CitationRecord]:
+    """
+    Steps 3-5 for one applicant of a batch: affiliations, cleaning, geocoding, then CSV, statistics, map and metrics.
+    """
+    author_paper_affiliation_records = find_all_citing_affiliations(all_citing_author_paper_records, num_processes,
+                                                                    affiliation_conservative, metrics, author_cache)
+    author_paper_affiliation_records = clean_affiliation_names(author_paper_affiliation_records, metrics)
+    coordinates_and_info = affiliation_text_to_geocode(author_paper_affiliation_records, metrics=metrics, geocoder=geocoder)
+
+    os.makedirs(output_folder, exist_ok=True)
+    csv_output_path = os.path.join(output_folder, 'citation_info.csv')
+    with metrics.time_stage('export'):
+        export_dict_to_csv(coordinates_and_info, csv_output_path, citing_paper_index)
+        export_citation_statistics(citing_paper_index, os.path.join(output_folder, 'citation_statistics.json'))
+    with metrics.time_stage('render_map'):
+        m = create_map(coordinates_and_info, pin_colorful, render_mode)
+        if m:
+            save_map(m, os.path.join(output_folder, 'citation_map.html'))
+    metrics.write_json(metrics_path_for_csv(csv_output_path))
+    print(f"{applicant}: citation map done.")
+    return coordinates_and_info
+
 def save_author_ids_for_debugging(scholar_id: str, output_path: str = 'author_ids_debug.csv'):
     """
     Save author IDs for debugging purposes.
     """
-    author = scholarly.search_author_id(scholar_id)
-    author = scholarly.fill(author, sections=['publications'])
+    author = SCHOLAR_BREAKER.call(scholarly.search_author_id, scholar_id)
+    author = SCHOLAR_BREAKER.call(scholarly.fill, author, sections=['publications'])
     publications = author['publications']
     
     author_ids = []
     for pub in publications:
         try:
-            pub = scholarly.fill(pub)
+            pub = SCHOLAR_BREAKER.call(scholarly.fill, pub)
             if 'cites_id' in pub:
                 for cites_id in pub['cites_id']:
                     citing_author_ids, citing_papers = get_citing_author_ids_and_citing_papers(cites_id)
@@ -586,14 +696,14 @@ def save_citation_info_for_debugging(scholar_id: str, output_path: str = 'citati
     """
     Save citation information for debugging purposes.
     """
-    author = scholarly.search_author_id(scholar_id)
-    author = scholarly.fill(author, sections=['publications'])
+    author = SCHOLAR_BREAKER.call(scholarly.search_author_id, scholar_id)
+    author = SCHOLAR_BREAKER.call(scholarly.fill, author, sections=['publications'])
     publications = author['publications']
     
     citation_info = []
     for pub in publications:
         try:
-            pub = scholarly.fill(pub)
+            pub = SCHOLAR_BREAKER.call(scholarly.fill, pub)
             if 'cites_id' in pub:
                 for cites_id in pub['cites_id']:
                     citing_author_ids, citing_papers = get_citing_author_ids_and_citing_papers(cites_id)
@@ -0,0 +1,116 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import os
+import pandas as pd
+from typing import List, Optional
+
+from scripts.citation_map.records import COLUMN_DTYPES
+
+CITATION_STORE_FILENAME = 'citation_info.parquet'
+
+# Columns added after the citation records themselves: at export time and by enrichment steps.
+ENRICHMENT_DTYPES = {
+    'google_scholar_link': 'string',
+    'citing_paper_key': 'string',
+    'num_cited_papers': 'Int64',
+    'email': 'string',
+    'rank': 'string',
+}
+
+
+def store_path_for_csv(csv_path: str) -> str:
+    '''
+    Path of the Parquet store behind a citation_info CSV (same folder and name, '.parquet').
+    '''
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+
+def csv_path_for_store(store_path: str) -> str:
+    '''
+    Path of the CSV view of a Parquet store (same folder and name, '.csv').
+    '''
+    return os.path.splitext(store_path)[0] + '.csv'
+
+
+class CitationStore:
+    '''
+    Typed Parquet store of one applicant's citation_info table.
+
+    The store is the source of truth: enrichment steps (emails, ranks, ...) add or replace columns in
+    it instead of writing another full copy, and the CSV is only an export view of it. Known columns
+    are cast to `COLUMN_DTYPES`/`ENRICHMENT_DTYPES` on every write, so readers never re-infer types.
+    Folders written before the store existed only have the CSV: it is read instead, with the same
+    dtypes, and the first write migrates the table to Parquet.
+
+    Parameters
+    --------
+    path: Location of the Parquet file, e.g. `<applicant folder>/citation_info.parquet`.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def for_csv(cls, csv_path: str) -> 'CitationStore':
+        return cls(store_path_for_csv(csv_path))
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def read(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        '''
+        Read the table, or only `columns` of it.
+        '''
+        if not self.exists():
+            citation_df = pd.read_csv(csv_path_for_store(self.path), usecols=columns,
+                                      dtype={**COLUMN_DTYPES, **ENRICHMENT_DTYPES})
+            # Older CSVs were written with their index.
+            citation_df = citation_df.loc[:, ~citation_df.columns.str.startswith('Unnamed: ')]
+            return _apply_schema(citation_df)
+        return pd.read_parquet(self.path, columns=columns)
+
+    def write(self, citation_df: pd.DataFrame) -> None:
+        '''
+        Replace the whole table. The file is swapped atomically, so readers never see a partial write.
+        '''
+        citation_df = _apply_schema(citation_df.reset_index(drop=True))
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary_path = self.path + '.tmp'
+        citation_df.to_parquet(temporary_path, index=False)
+        os.replace(temporary_path, self.path)
+
+    def add_columns(self, columns: dict) -> pd.DataFrame:
+        '''
+        Add or replace columns and return the updated table. Values are a list with one value per row,
+        or a Series indexed like `read()` (e.g. a column computed on a read, possibly re-sorted, table).
+        '''
+        citation_df = self.read()
+        for column, values in columns.items():
+            citation_df[column] = values if isinstance(values, pd.Series) else list(values)
+        self.write(citation_df)
+        return citation_df
+
+    def export_csv(self, csv_path: str, citation_df: Optional[pd.DataFrame] = None) -> None:
+        '''
+        Write the CSV view of the store (no index column).
+        '''
+        if citation_df is None:
+            citation_df = self.read()
+        citation_df.to_csv(csv_path, index=False)
+
+
+def _apply_schema(citation_df: pd.DataFrame) -> pd.DataFrame:
+    schema = {**COLUMN_DTYPES, **ENRICHMENT_DTYPES}
+    for column, dtype in schema.items():
+        if column not in citation_df.columns:
+            continue
+        if dtype == 'string':
+            if pd.api.types.is_float_dtype(citation_df[column]) and (citation_df[column].dropna() % 1 == 0).all():
+                # Whole numbers that became floats because of missing values, e.g. ranks: store '12', not '12.0'.
+                citation_df[column] = citation_df[column].astype('Int64')
+            citation_df[column] = citation_df[column].astype(object).where(citation_df[column].notna(), None).astype('string')
+        elif dtype == 'Int64':
+            citation_df[column] = pd.to_numeric(citation_df[column], errors='coerce').astype('Int64')
+        else:
+            citation_df[column] = pd.to_numeric(citation_df[column], errors='coerce').astype(dtype)
+    return citation_df
@@ -0,0 +1,112 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Tuple
+
+from scripts.citation_map.records import CitationRecord
+from scripts.citation_map.scholarly_support import NO_AUTHOR_FOUND_STR
+
+_TITLE_MARKER_PATTERN = re.compile(r'\[(html|pdf|citation|book|b)\]', re.IGNORECASE)
+_NON_ALNUM_PATTERN = re.compile(r'[\W_]+')
+
+
+def normalize_title(title: str) -> str:
+    '''
+    Lower-case a paper title and drop Scholar markers ([PDF], [HTML], ...) and punctuation.
+    '''
+    title = _TITLE_MARKER_PATTERN.sub(' ', title or '')
+    return _NON_ALNUM_PATTERN.sub(' ', title.lower()).strip()
+
+
+def citing_paper_key(title: str, author_ids: Iterable[str]) -> str:
+    '''
+    Normalized key of a citing paper: a hash of its normalized title plus its sorted author IDs.
+    '''
+    title_hash = hashlib.blake2b(normalize_title(title).encode('utf-8'), digest_size=8).hexdigest()
+    return title_hash + ':' + ','.join(sorted(set(author_ids)))
+
+
+class CitingPaperIndex:
+    '''
+    Many-to-many relation between unique citing papers and the cited (applicant's) papers.
+
+    Cited papers are interned once and each citing paper only stores a list of small integer indices,
+    so the relation stays compact even with tens of thousands of citing papers.
+    '''
+
+    def __init__(self):
+        self._cited_papers: List[Tuple[str, str]] = []
+        self._cited_paper_indices: Dict[Tuple[str, str], int] = {}
+        self._links: Dict[str, List[int]] = {}
+        self.num_duplicates = 0
+
+    def add(self, citing_title: str, author_ids: List[str], cited_title: str, citation: str = '') -> bool:
+        '''
+        Record that the citing paper cites `cited_title`.
+        Returns True the first time the citing paper is seen, False for duplicates.
+        '''
+        key = citing_paper_key(citing_title, author_ids)
+        cited_paper = (cited_title, citation)
+        cited_index = self._cited_paper_indices.setdefault(cited_paper, len(self._cited_papers))
+        if cited_index == len(self._cited_papers):
+            self._cited_papers.append(cited_paper)
+
+        is_new = key not in self._links
+        links = self._links.setdefault(key, [])
+        if cited_index not in links:
+            links.append(cited_index)
+        if not is_new:
+            self.num_duplicates += 1
+        return is_new
+
+    def cited_papers(self, key: str) -> List[Tuple[str, str]]:
+        '''
+        (cited paper title, citation) pairs cited by the citing paper `key`.
+        '''
+        return [self._cited_papers[cited_index] for cited_index in self._links.get(key, [])]
+
+    def num_cited_papers(self, key: str) -> int:
+        return len(self._links.get(key, []))
+
+    def statistics(self) -> dict:
+        citing_papers_per_cited_paper = [0] * len(self._cited_papers)
+        for links in self._links.values():
+            for cited_index in links:
+                citing_papers_per_cited_paper[cited_index] += 1
+        return {
+            'num_unique_citing_papers': len(self._links),
+            'num_citation_links': sum(len(links) for links in self._links.values()),
+            'num_duplicates_removed': self.num_duplicates,
+            'citing_papers_per_cited_paper': {
+                cited_title: count for (cited_title, _), count in zip(self._cited_papers, citing_papers_per_cited_paper)
+            },
+        }
+
+
+def deduplicate_citing_records(citing_author_paper_records: List[CitationRecord],
+                               citing_paper_index: CitingPaperIndex) -> List[CitationRecord]:
+    '''
+    Drop citing papers already seen for another cited paper.
+    The records kept carry their paper's `citing_paper_key`, so later stages never re-derive it
+    (the author ID of a record can change, e.g. to NO_AUTHOR_FOUND_STR when its lookup fails).
+
+    Parameters
+    --------
+    citing_author_paper_records: Citing-author records for ONE cited paper, with one record per citing author.
+    citing_paper_index: Index shared by all cited papers of the applicant.
+    '''
+    records_by_citing_paper = OrderedDict()
+    for record in citing_author_paper_records:
+        records_by_citing_paper.setdefault(normalize_title(record.citing_paper_title), []).append(record)
+
+    unique_records = []
+    for paper_records in records_by_citing_paper.values():
+        author_ids = [record.author_id for record in paper_records if record.author_id != NO_AUTHOR_FOUND_STR]
+        first_record = paper_records[0]
+        if citing_paper_index.add(first_record.citing_paper_title, author_ids,
+                                  first_record.cited_paper_title, first_record.citation):
+            key = citing_paper_key(first_record.citing_paper_title, author_ids)
+            unique_records.extend(record.replace(citing_paper_key=key) for record in paper_records)
+    return unique_records
@@ -0,0 +1,212 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import csv
+import glob
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import config
+
+# Institution coordinates, built locally by `InstitutionGazetteer.build` and by learning from network lookups.
+GAZETTEER_PATH = os.path.join(config.RANKINGS_BASE_PATH, 'institution_gazetteer.csv')
+GAZETTEER_COLUMNS = ['university_name', 'country', 'lat', 'lng', 'county', 'city', 'state']
+
+_PARENTHESES_PATTERN = re.compile(r'\(([^)]*)\)')
+_ALIAS_PREFIX_PATTERN = re.compile(r'^(a\.k\.a\.|formerly|former)\s+', re.IGNORECASE)
+_NON_ALNUM_PATTERN = re.compile(r'[\W_]+')
+
+
+def normalize_institution_name(name: str) -> str:
+    '''
+    Match key of an institution name: accents stripped, case-folded, '&' spelled out,
+    punctuation removed and a leading 'the' dropped.
+    '''
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(char for char in name if not unicodedata.combining(char))
+    name = _NON_ALNUM_PATTERN.sub(' ', name.casefold().replace('&', ' and ')).strip()
+    if name.startswith('the '):
+        name = name[4:]
+    return name
+
+
+def _name_variants(university_name: str) -> List[str]:
+    '''
+    The name without its parenthesized part, plus acronyms or former names given in parentheses,
+    e.g. 'Massachusetts Institute of Technology (MIT)' -> ['Massachusetts Institute of Technology', 'MIT'].
+    '''
+    variants = [_PARENTHESES_PATTERN.sub(' ', university_name)]
+    for inner in _PARENTHESES_PATTERN.findall(university_name):
+        inner = inner.strip()
+        if _ALIAS_PREFIX_PATTERN.match(inner):
+            variants.append(_ALIAS_PREFIX_PATTERN.sub('', inner))
+        elif ' ' not in inner and len(inner) >= 3 and sum(char.isupper() for char in inner) >= 2:
+            # Only acronym-like aliases ('KIT', 'UniKL'); '(China)' or '(Boston)' are not names.
+            variants.append(inner)
+    return variants
+
+
+class InstitutionGazetteer:
+    '''
+    Offline index from institution names to countries and coordinates.
+
+    Names come from the world rankings (`data/rankings/world/*.csv`); coordinates come from the local
+    gazetteer file, which is filled by `build` and grows as network geocoders resolve
+    affiliations that name a ranked institution. A lookup is a few dictionary probes.
+
+    Parameters
+    --------
+    rankings_paths: Rankings CSVs with 'university_name' and 'country' columns.
+    gazetteer_path: CSV of institution coordinates (`GAZETTEER_COLUMNS`).
+    '''
+
+    def __init__(self,
+                 rankings_paths: Optional[Iterable[str]] = None,
+                 gazetteer_path: str = GAZETTEER_PATH):
+        if rankings_paths is None:
+            rankings_paths = sorted(glob.glob(os.path.join(config.RANKINGS_WORLD_PATH, '*.csv')))
+        self.gazetteer_path = gazetteer_path
+        self._lock = threading.Lock()
+        # Normalized name or alias -> canonical institution name; None marks ambiguous names.
+        self._names: Dict[str, Optional[str]] = {}
+        self._countries: Dict[str, str] = {}
+        self._locations: Dict[str, dict] = {}
+        self._max_name_tokens = 1
+        for rankings_path in rankings_paths:
+            self._load_rankings(rankings_path)
+        self._load_gazetteer()
+
+    def __len__(self) -> int:
+        return len(self._countries)
+
+    @property
+    def institutions(self) -> List[str]:
+        return list(self._countries)
+
+    def country(self, institution: str) -> str:
+        return self._countries.get(institution, '')
+
+    def match(self, affiliation_name: str) -> Optional[str]:
+        '''
+        Canonical name of the ranked institution mentioned in `affiliation_name`, if any.
+        The longest institution name contained in the affiliation wins, so
+        'Dept. of CS, University of California, Berkeley' matches Berkeley rather than 'University of California'.
+        '''
+        tokens = normalize_institution_name(affiliation_name).split()
+        for num_tokens in range(min(len(tokens), self._max_name_tokens), 0, -1):
+            for start in range(len(tokens) - num_tokens + 1):
+                institution = self._names.get(' '.join(tokens[start:start + num_tokens]))
+                if institution is not None:
+                    return institution
+        return None
+
+    def lookup(self, affiliation_name: str) -> Optional[dict]:
+        '''
+        Location of the institution mentioned in `affiliation_name`, or None if it is not ranked
+        or its coordinates are not in the gazetteer yet.
+        '''
+        institution = self.match(affiliation_name)
+        if institution is None:
+            return None
+        return self._locations.get(institution)
+
+    def add_location(self, institution: str, location: dict) -> None:
+        '''
+        Record the coordinates of a ranked institution and append them to the gazetteer file.
+        '''
+        if not (location.get('lat') and location.get('lng')):
+            return
+        location = {
+            'lat': float(location['lat']),
+            'lng': float(location['lng']),
+            'county': location.get('county') or '',
+            'city': location.get('city') or '',
+            'state': location.get('state') or '',
+            'country': location.get('country') or self._countries.get(institution, ''),
+        }
+        with self._lock:
+            if institution in self._locations:
+                return
+            self._locations[institution] = location
+            os.makedirs(os.path.dirname(os.path.abspath(self.gazetteer_path)), exist_ok=True)
+            is_new_file = not os.path.exists(self.gazetteer_path)
+            with open(self.gazetteer_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=GAZETTEER_COLUMNS)
+                if is_new_file:
+                    writer.writeheader()
+                writer.writerow({'university_name': institution, **location})
+
+    def build(self, geocode: Callable[[str], dict], max_workers: int = 8) -> Tuple[int, int]:
+        '''
+        Geocode every ranked institution that has no coordinates yet, e.g. with `GeocoderChain.geocode`.
+        Returns (number of institutions located, number of institutions tried).
+        '''
+        missing = [institution for institution in self._countries if institution not in self._locations]
+
+        def _locate(institution):
+            country = self.country(institution)
+            location = geocode(f'{institution}, {country}' if country else institution)
+            self.add_location(institution, location)
+            return bool(location.get('lat') and location.get('lng'))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            located = list(tqdm(executor.map(_locate, missing),
+                                desc='Geocoding %d ranked institutions' % len(missing), total=len(missing)))
+        return sum(located), len(missing)
+
+    def _add_name(self, name: str, institution: str) -> None:
+        key = normalize_institution_name(name)
+        if not key:
+            return
+        if key in self._names and self._names[key] != institution:
+            self._names[key] = None
+        else:
+            self._names[key] = institution
+            self._max_name_tokens = max(self._max_name_tokens, len(key.split()))
+
+    def _load_rankings(self, rankings_path: str) -> None:
+        try:
+            with open(rankings_path, newline='', encoding='utf-8') as f:
+                rows = list(csv.DictReader(f))
+        except Exception as e:
+            print(f"[WARNING!] Could not read rankings {rankings_path}: {str(e)}")
+            return
+        for row in rows:
+            university_name = (row.get('university_name') or '').strip()
+            if not university_name:
+                continue
+            country = _PARENTHESES_PATTERN.sub('', row.get('country') or '').strip()
+            variants = _name_variants(university_name)
+            # Rankings spell the same institution (and its country) slightly differently; the first spelling seen is canonical.
+            institution = self._names.get(normalize_institution_name(variants[0])) or ' '.join(variants[0].split())
+            self._countries.setdefault(institution, country)
+            for variant in variants:
+                self._add_name(variant, institution)
+
+    def _load_gazetteer(self) -> None:
+        if not os.path.exists(self.gazetteer_path):
+            return
+        with open(self.gazetteer_path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    self._locations[row['university_name']] = {
+                        'lat': float(row['lat']),
+                        'lng': float(row['lng']),
+                        'county': row.get('county') or '',
+                        'city': row.get('city') or '',
+                        'state': row.get('state') or '',
+                        'country': row.get('country') or '',
+                    }
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+
+if __name__ == '__main__':
+    # Fill the gazetteer once (Nominatim, then Google Maps) so later runs can geocode offline.
+    from scripts.citation_map.geocoders import GeocoderChain, GoogleGeocoder, NominatimGeocoder
+    num_located, num_tried = InstitutionGazetteer().build(GeocoderChain([NominatimGeocoder(), GoogleGeocoder()]).geocode)
+    print(f"Located {num_located} out of {num_tried} institutions; gazetteer saved to {GAZETTEER_PATH}")
@@ -0,0 +1,147 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional
+
+import config
+
+GEOCODE_DB_PATH = os.path.join(config.CACHE_PATH, 'geocode_cache.sqlite3')
+# JSON caches written by earlier versions, imported once into the SQLite store.
+LEGACY_GEOCODE_JSON_PATHS = [os.path.join(config.FOLDER_PATH, 'geocode_cache.json'), 'geocode_cache.json']
+
+# Affiliations that could not be located are retried after a week; found ones are kept for a year.
+POSITIVE_TTL_SECONDS = 365 * 24 * 3600
+NEGATIVE_TTL_SECONDS = 7 * 24 * 3600
+
+LOCATION_FIELDS = ('lat', 'lng', 'county', 'city', 'state', 'country')
+
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+
+def normalize_affiliation_key(affiliation_name: str) -> str:
+    '''
+    Cache key of an affiliation: case-folded, whitespace collapsed, surrounding punctuation removed.
+    '''
+    return _WHITESPACE_PATTERN.sub(' ', affiliation_name.casefold()).strip(' ,;.-')
+
+
+class GeocodeStore:
+    '''
+    Persistent geocode cache (affiliation -> location metadata) backed by SQLite.
+
+    Every `put` is an individual upsert committed immediately, so a crash only loses the lookup in
+    progress. The database runs in WAL mode, so concurrent runs can read while one of them writes.
+    Negative results (affiliation not found) are cached too, with a shorter TTL.
+    Locations are dicts with the keys in `LOCATION_FIELDS`, as in the old JSON cache.
+
+    Parameters
+    --------
+    db_path: Location of the SQLite database.
+    legacy_json_paths: Old JSON caches to import the first time the database is created.
+    '''
+
+    def __init__(self,
+                 db_path: str = GEOCODE_DB_PATH,
+                 legacy_json_paths: Iterable[str] = tuple(LEGACY_GEOCODE_JSON_PATHS),
+                 positive_ttl: float = POSITIVE_TTL_SECONDS,
+                 negative_ttl: float = NEGATIVE_TTL_SECONDS):
+        self.db_path = db_path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS geocode (
+                    key TEXT PRIMARY KEY,
+                    affiliation TEXT NOT NULL,
+                    lat REAL,
+                    lng REAL,
+                    county TEXT,
+                    city TEXT,
+                    state TEXT,
+                    country TEXT,
+                    found INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )''')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self._import_legacy_json(legacy_json_paths)
+
+    def get(self, affiliation_name: str) -> Optional[dict]:
+        '''
+        Cached location of `affiliation_name`, or None if it is unknown or expired.
+        A cached negative result is returned as a location with empty fields.
+        '''
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT lat, lng, county, city, state, country, found, updated_at FROM geocode WHERE key = ?',
+                (normalize_affiliation_key(affiliation_name),)).fetchone()
+        if row is None:
+            return None
+        *location, found, updated_at = row
+        ttl = self.positive_ttl if found else self.negative_ttl
+        if time.time() - updated_at > ttl:
+            return None
+        if not found:
+            return {field: '' for field in LOCATION_FIELDS}
+        return dict(zip(LOCATION_FIELDS, location))
+
+    def put(self, affiliation_name: str, location: dict) -> None:
+        '''
+        Insert or update the location of one affiliation.
+        '''
+        found = bool(location.get('lat')) and bool(location.get('lng'))
+        values = [location.get(field) if found else None for field in LOCATION_FIELDS]
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO geocode (key, affiliation, lat, lng, county, city, state, country, found, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET affiliation = excluded.affiliation, lat = excluded.lat, '
+                'lng = excluded.lng, county = excluded.county, city = excluded.city, state = excluded.state, '
+                'country = excluded.country, found = excluded.found, updated_at = excluded.updated_at',
+                [normalize_affiliation_key(affiliation_name), affiliation_name, *values, int(found), time.time()])
+
+    def __contains__(self, affiliation_name: str) -> bool:
+        return self.get(affiliation_name) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM geocode').fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _import_legacy_json(self, legacy_json_paths: Iterable[str]) -> None:
+        with self._lock:
+            already_imported = self._connection.execute(
+                "SELECT value FROM meta WHERE name = 'legacy_json_imported'").fetchone()
+        if already_imported:
+            return
+        num_imported = 0
+        for json_path in dict.fromkeys(os.path.abspath(path) for path in legacy_json_paths):
+            if not os.path.exists(json_path):
+                continue
+            try:
+                with open(json_path, 'r') as f:
+                    legacy_cache = json.load(f)
+            except Exception as e:
+                print(f"Error loading legacy geocode cache {json_path}: {str(e)}")
+                continue
+            for affiliation_name, location in legacy_cache.items():
+                if affiliation_name not in self:
+                    self.put(affiliation_name, location)
+                    num_imported += 1
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('legacy_json_imported', ?)",
+                                     (str(time.time()),))
+        if num_imported:
+            print(f"Imported {num_imported} geocoded affiliations from the legacy JSON cache.")
@@ -0,0 +1,298 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from geopy.geocoders import Nominatim
+from tqdm import tqdm
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import GOOGLE_MAPS_API_KEY
+from scripts.citation_map.async_fetch import TokenBucket
+from scripts.citation_map.gazetteer import InstitutionGazetteer
+from scripts.citation_map.http_fixtures import route_url
+from scripts.citation_map.metrics import MetricsCollector, PIPELINE_METRICS
+from scripts.citation_map.reverse_geocode import LocalReverseGeocoder
+from scripts.citation_map.geocode_store import GeocodeStore, LOCATION_FIELDS, normalize_affiliation_key
+
+# Nominatim's usage policy allows at most one request per second.
+NOMINATIM_REQUESTS_PER_SECOND = 1.0
+GOOGLE_MAPS_REQUESTS_PER_SECOND = 10.0
+
+NOMINATIM_URL = 'https://nominatim.openstreetmap.org'
+
+
+def empty_location() -> dict:
+    return {field: '' for field in LOCATION_FIELDS}
+
+
+class Geocoder:
+    '''
+    A geocoding provider with its own rate limit.
+
+    Subclasses implement `_geocode`, which returns a location dict (keys `LOCATION_FIELDS`) with
+    county/city/state/country filled from the same response as the coordinates, or None if the
+    provider does not know the affiliation. Exceptions are retried up to `max_retries` times.
+    Local providers pass `requests_per_second=None` and are not rate limited.
+    Requests to `host` (outcome per attempt), retries and latencies are recorded in `metrics`.
+    '''
+    name = 'geocoder'
+    host = None
+
+    def __init__(self, requests_per_second: Optional[float], max_retries: int = 2,
+                 metrics: MetricsCollector = PIPELINE_METRICS):
+        self.limiter = TokenBucket(rate=requests_per_second, capacity=1) if requests_per_second else None
+        self.max_retries = max_retries
+        self.metrics = metrics
+
+    def geocode(self, affiliation_name: str) -> Optional[dict]:
+        return self.lookup(affiliation_name)[0]
+
+    def lookup(self, affiliation_name: str) -> Tuple[Optional[dict], bool]:
+        '''
+        (location or None, whether the provider answered). The provider has not answered when every attempt failed.
+        '''
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.metrics.record_retry(f'geocode.{self.name}')
+            if self.limiter is not None:
+                self.limiter.wait()
+            start_time = time.monotonic()
+            try:
+                location = self._geocode(affiliation_name)
+            except Exception as e:
+                if self.host is not None:
+                    self.metrics.record_http(self.host, type(e).__name__)
+                print(f"Error geocoding {affiliation_name} with {self.name} (attempt {attempt + 1}): {str(e)}")
+                continue
+            if self.host is not None:
+                self.metrics.record_http(self.host, 200)
+            self.metrics.record_latency(f'geocode.{self.name}', time.monotonic() - start_time)
+            return location, True
+        return None, False
+
+    def _geocode(self, affiliation_name: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def observe(self, affiliation_name: str, location: dict) -> None:
+        '''
+        Called with the location a later provider in the chain found for an affiliation this one missed.
+        '''
+
+
+class GazetteerGeocoder(Geocoder):
+    '''
+    Offline geocoder backed by an `InstitutionGazetteer`. Place it first in a `GeocoderChain`:
+    affiliations naming a ranked institution with known coordinates never reach the network, and
+    coordinates that later providers find for a ranked institution are added to the gazetteer.
+    '''
+    name = 'Gazetteer'
+
+    def __init__(self, gazetteer: Optional[InstitutionGazetteer] = None, metrics: MetricsCollector = PIPELINE_METRICS):
+        super().__init__(requests_per_second=None, max_retries=0, metrics=metrics)
+        self.gazetteer = gazetteer if gazetteer is not None else InstitutionGazetteer()
+
+    def _geocode(self, affiliation_name: str) -> Optional[dict]:
+        location = self.gazetteer.lookup(affiliation_name)
+        self.metrics.record_cache('gazetteer', hits=int(location is not None), misses=int(location is None))
+        return dict(location) if location is not None else None
+
+    def observe(self, affiliation_name: str, location: dict) -> None:
+        institution = self.gazetteer.match(affiliation_name)
+        if institution is not None:
+            self.gazetteer.add_location(institution, location)
+
+
+class NominatimGeocoder(Geocoder):
+    '''
+    OpenStreetMap Nominatim. Asks for address details in the forward request, so no reverse lookup is needed.
+    '''
+    name = 'Nominatim'
+    host = 'nominatim.openstreetmap.org'
+
+    def __init__(self, user_agent: str = 'citation_mapper', timeout: float = 30, **kwargs):
+        super().__init__(kwargs.pop('requests_per_second', NOMINATIM_REQUESTS_PER_SECOND), **kwargs)
+        # geopy builds request URLs from a scheme and a domain, so route the API root (see `http_fixtures`).
+        scheme, domain = route_url(NOMINATIM_URL).split('://', 1)
+        self.nominatim = Nominatim(user_agent=user_agent, scheme=scheme, domain=domain)
+        self.timeout = timeout
+
+    def _geocode(self, affiliation_name: str) -> Optional[dict]:
+        geo_location = self.nominatim.geocode(affiliation_name, addressdetails=True, language='en', timeout=self.timeout)
+        if not geo_location:
+            return None
+        address = geo_location.raw.get('address', {})
+        return {
+            'lat': geo_location.latitude,
+            'lng': geo_location.longitude,
+            'county': address.get('county'),
+            'city': address.get('city') or address.get('town') or address.get('village'),
+            'state': address.get('state'),
+            'country': address.get('country'),
+        }
+
+
+class GoogleGeocoder(Geocoder):
+    '''
+    Google Maps Geocoding API.
+    '''
+    name = 'Google Maps'
+    host = 'maps.googleapis.com'
+
+    def __init__(self, api_key: str = GOOGLE_MAPS_API_KEY, timeout: float = 30, **kwargs):
+        super().__init__(kwargs.pop('requests_per_second', GOOGLE_MAPS_REQUESTS_PER_SECOND), **kwargs)
+        self.api_key = api_key
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _geocode(self, affiliation_name: str) -> Optional[dict]:
+        response = self.session.get(route_url('https://maps.googleapis.com/maps/api/geocode/json'),
+                                    params={'address': affiliation_name, 'key': self.api_key},
+                                    timeout=self.timeout)
+        data = response.json()
+        if data['status'] == 'ZERO_RESULTS':
+            return None
+        if data['status'] != 'OK':
+            raise Exception(f"Google Maps API returned {data['status']}")
+
+        result = data['results'][0]
+        location = result['geometry']['location']
+        county, city, state, country = None, None, None, None
+        for component in result.get('address_components', []):
+            types = component['types']
+            if 'administrative_area_level_2' in types:
+                county = component['long_name']
+            elif 'locality' in types:
+                city = component['long_name']
+            elif 'administrative_area_level_1' in types:
+                state = component['long_name']
+            elif 'country' in types:
+                country = component['long_name']
+        return {'lat': location['lat'], 'lng': location['lng'],
+                'county': county, 'city': city, 'state': state, 'country': country}
+
+
+class GeocoderChain:
+    '''
+    Provider fallback chain, applied per affiliation: the first provider that locates it wins.
+    '''
+
+    def __init__(self, geocoders: Optional[List[Geocoder]] = None):
+        self.geocoders = geocoders if geocoders is not None else default_geocoders()
+
+    def geocode(self, affiliation_name: str) -> dict:
+        return self.locate(affiliation_name)[0]
+
+    def locate(self, affiliation_name: str) -> Tuple[dict, bool]:
+        '''
+        (location, whether the result is conclusive). A miss is only conclusive if a network provider
+        (one with a `host`) answered; a miss of the offline gazetteer alone says nothing about the
+        online providers, and neither does a provider that failed on every attempt.
+        '''
+        conclusive = False
+        for index, geocoder in enumerate(self.geocoders):
+            location, answered = geocoder.lookup(affiliation_name)
+            if location and location.get('lat') and location.get('lng'):
+                for missed_geocoder in self.geocoders[:index]:
+                    missed_geocoder.observe(affiliation_name, location)
+                return location, True
+            conclusive = conclusive or (answered and geocoder.host is not None)
+        return empty_location(), conclusive
+
+
+class CachingGeocoder:
+    '''
+    Geocoder chain in front of a `GeocodeStore`, safe to call from many threads.
+
+    Affiliations are looked up concurrently; every provider still respects its own rate limit, so while
+    one affiliation waits for Nominatim another can fall back to Google. Concurrent requests for the
+    same affiliation share a single lookup. Misses are only stored when they are conclusive (see
+    `GeocoderChain.locate`), so an offline run does not hide affiliations from later online runs.
+    With a `reverse_geocoder`, missing county/city/state/country fields are filled offline in one batch
+    by `fill_admin_fields`. Store hits and misses are recorded in `metrics`.
+    '''
+
+    def __init__(self, chain: Optional[GeocoderChain] = None, store: Optional[GeocodeStore] = None,
+                 reverse_geocoder: Optional[LocalReverseGeocoder] = None, metrics: MetricsCollector = PIPELINE_METRICS):
+        self.chain = chain if chain is not None else GeocoderChain()
+        self.store = store if store is not None else GeocodeStore()
+        self.reverse_geocoder = reverse_geocoder
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, threading.Event] = {}
+
+    def geocode(self, affiliation_name: str) -> dict:
+        with self.metrics.time_stage('geocoding'):
+            return self._geocode_cached(affiliation_name)
+
+    def _geocode_cached(self, affiliation_name: str) -> dict:
+        location = self.store.get(affiliation_name)
+        if location is not None:
+            self.metrics.record_cache('geocode', hits=1)
+            return location
+        self.metrics.record_cache('geocode', misses=1)
+
+        key = normalize_affiliation_key(affiliation_name)
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                self._in_flight[key] = threading.Event()
+        if in_flight is not None:
+            in_flight.wait()
+            return self.store.get(affiliation_name) or empty_location()
+
+        try:
+            location, conclusive = self.chain.locate(affiliation_name)
+            if conclusive:
+                self.store.put(affiliation_name, location)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key).set()
+        return location
+
+    def geocode_many(self, affiliation_names: Iterable[str], max_workers: int = 8) -> Dict[str, dict]:
+        '''
+        Geocode several affiliations concurrently. Returns affiliation name -> location.
+        '''
+        affiliation_names = list(dict.fromkeys(affiliation_names))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            locations = list(tqdm(executor.map(self.geocode, affiliation_names),
+                                  desc='Finding geographic coordinates from %d unique citing affiliations' % len(affiliation_names),
+                                  total=len(affiliation_names)))
+        locations = dict(zip(affiliation_names, locations))
+        self.fill_admin_fields(locations)
+        return locations
+
+    def fill_admin_fields(self, locations: Dict[str, dict]) -> int:
+        '''
+        Fill empty county/city/state/country fields of located affiliations with the local reverse
+        geocoder (one batched query, no network I/O), updating `locations` in place and the store.
+        Returns the number of affiliations updated.
+        '''
+        if self.reverse_geocoder is None:
+            return 0
+        filled = {affiliation_name: dict(location) for affiliation_name, location in locations.items()}
+        self.reverse_geocoder.fill_missing(list(filled.values()))
+        num_updated = 0
+        for affiliation_name, location in filled.items():
+            if location != locations[affiliation_name]:
+                locations[affiliation_name] = location
+                self.store.put(affiliation_name, location)
+                num_updated += 1
+        return num_updated
+
+    def close(self) -> None:
+        self.store.close()
+
+
+def default_geocoders(offline: bool = False, max_retries: int = 2,
+                      metrics: MetricsCollector = PIPELINE_METRICS) -> List[Geocoder]:
+    '''
+    The offline gazetteer first, then (unless `offline`) Nominatim and the Google Maps API.
+    '''
+    geocoders = [GazetteerGeocoder(metrics=metrics)]
+    if not offline:
+        geocoders += [NominatimGeocoder(max_retries=max_retries, metrics=metrics),
+                      GoogleGeocoder(max_retries=max_retries, metrics=metrics)]
+    return geocoders
@@ -0,0 +1,407 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+'''
+Record/replay HTTP fixture server for offline runs and benchmarks of the scraping pipeline.
+
+The pipeline routes its Scholar, Nominatim, Google Maps and PDF requests through `route_url`. When a
+fixture server is configured (`use_fixture_server`, or the `CITATION_MAP_FIXTURE_SERVER` environment
+variable), `https://host/path?query` becomes `<server>/https/host/path?query` and the request goes to
+the local server instead. The `scholarly` library's sessions get a transport that does the same, so its
+author lookups and fills are recorded and replayed too:
+
+- in 'record' mode the server forwards every request upstream and appends the response to a cassette;
+- in 'replay' mode it answers from the cassette, with optional latency, HTTP error and CAPTCHA injection.
+
+    python -m scripts.citation_map.http_fixtures record --cassette data/cache/run.jsonl --port 8765
+    python -m scripts.citation_map.http_fixtures replay --cassette data/cache/run.jsonl --port 8765 \\
+        --latency 0.2 --error-rate 0.05 --captcha-rate 0.02
+    CITATION_MAP_FIXTURE_SERVER=http://127.0.0.1:8765 python 1-citation-email.py ...
+'''
+import argparse
+import base64
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+import requests
+from scholarly import ProxyGenerator, scholarly
+
+from scripts.citation_map.circuit_breaker import ScholarBlockedError
+
+FIXTURE_SERVER_ENV = 'CITATION_MAP_FIXTURE_SERVER'
+
+# Query parameters that are credentials: never written to a cassette nor part of the lookup key.
+SECRET_QUERY_PARAMETERS = frozenset({'key', 'api_key', 'apikey', 'token'})
+# Request headers forwarded upstream when recording.
+_FORWARDED_HEADERS = ('User-Agent', 'Accept', 'Accept-Language', 'Referer')
+_TEXT_CONTENT_TYPES = ('text/', 'application/json', 'application/xml', 'application/javascript')
+
+# Served by replay with probability `captcha_rate`; `circuit_breaker.is_blocked_page` recognizes it.
+CAPTCHA_PAGE = ('<html><head><title>Sorry...</title></head><body><h1>Sorry...</h1>'
+                "<p>We're sorry... but your computer or network may be sending automated queries. "
+                "To protect our users, we can't process your request right now.</p>"
+                "<p>Please solve the CAPTCHA below to show you're not a robot.</p>"
+                '<div id="gs_captcha_ccl"><div class="g-recaptcha" data-sitekey="fixture"></div></div>'
+                '<script src="https://www.google.com/recaptcha/api.js"></script></body></html>')
+
+_fixture_server_url = None
+# Whether scholarly uses `FixtureProxyGenerator`s; their sessions go upstream again once no server is in use.
+_scholarly_routed = False
+
+
+def use_fixture_server(server_url: Optional[str]) -> None:
+    '''
+    Route every request of the pipeline to the fixture server at `server_url` (None routes them upstream again).
+    '''
+    global _fixture_server_url, _scholarly_routed
+    _fixture_server_url = server_url.rstrip('/') if server_url else None
+    if _fixture_server_url is not None and not _scholarly_routed:
+        scholarly.use_proxy(FixtureProxyGenerator(), FixtureProxyGenerator())
+        _scholarly_routed = True
+
+
+def fixture_server_url() -> Optional[str]:
+    '''
+    URL of the fixture server in use, or None.
+    '''
+    return _fixture_server_url
+
+
+def route_url(url: str) -> str:
+    '''
+    The URL to request for `url`: unchanged, or its fixture server URL if a fixture server is in use.
+    '''
+    if _fixture_server_url is None:
+        return url
+    parts = urlsplit(url)
+    routed = f'{_fixture_server_url}/{parts.scheme}/{parts.netloc}{parts.path or "/"}'
+    return f'{routed}?{parts.query}' if parts.query else routed
+
+
+class _RoutingTransport(httpx.BaseTransport):
+    '''
+    httpx transport that sends each request to `route_url` of its URL.
+    '''
+
+    def __init__(self):
+        self._transport = httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        routed_url = route_url(str(request.url))
+        if routed_url != str(request.url):
+            request.url = httpx.URL(routed_url)
+            request.headers['Host'] = request.url.netloc.decode('ascii')
+        return self._transport.handle_request(request)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class FixtureProxyGenerator(ProxyGenerator):
+    '''
+    `scholarly` proxy generator whose sessions send their requests through `route_url`.
+
+    A plain HTTP proxy would only see CONNECT tunnels for Scholar's https:// pages, so the sessions are
+    given a routing transport instead. scholarly solves a CAPTCHA by opening a browser and waiting for
+    someone to solve it; here the CAPTCHA is raised instead, and scholarly retries with a new session.
+    '''
+
+    def _new_session(self, **kwargs):
+        kwargs.setdefault('transport', _RoutingTransport())
+        return super()._new_session(**kwargs)
+
+    def _handle_captcha2(self, url):
+        raise ScholarBlockedError(f'CAPTCHA from Google Scholar at {url}.')
+
+
+use_fixture_server(os.environ.get(FIXTURE_SERVER_ENV))
+
+
+def _strip_secrets(url: str) -> str:
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+             if name.lower() not in SECRET_QUERY_PARAMETERS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ''))
+
+
+def fixture_key(method: str, url: str) -> str:
+    '''
+    Cassette lookup key of a request: method and URL with sorted query parameters and without credentials.
+    '''
+    parts = urlsplit(_strip_secrets(url))
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f'{method.upper()} {urlunsplit((parts.scheme, parts.netloc.lower(), parts.path or "/", query, ""))}'
+
+
+class HttpCassette:
+    '''
+    Recorded request/response pairs, one JSON object per line.
+
+    A request recorded several times is replayed with its responses in recording order, and the last
+    one is repeated after that, so paginated or retried requests replay the way they were recorded.
+
+    Parameters
+    --------
+    path: Location of the JSONL cassette; it is created on the first recorded response.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, List[dict]] = {}
+        self._replay_positions: Dict[str, int] = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as fd:
+                for line in fd:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._entries.setdefault(entry['key'], []).append(entry)
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self._entries.values())
+
+    def record(self, method: str, url: str, status: int, content_type: str, body: bytes, elapsed: float) -> None:
+        entry = {'key': fixture_key(method, url), 'method': method.upper(), 'url': _strip_secrets(url),
+                 'status': status, 'content_type': content_type, 'elapsed': round(elapsed, 4)}
+        if content_type.startswith(_TEXT_CONTENT_TYPES):
+            entry['body'] = body.decode('utf-8', errors='replace')
+        else:
+            entry['body_base64'] = base64.b64encode(body).decode('ascii')
+        with self._lock:
+            self._entries.setdefault(entry['key'], []).append(entry)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as fd:
+                fd.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def next_response(self, method: str, url: str) -> Optional[dict]:
+        '''
+        The next recorded response for a request, or None if it was never recorded.
+        '''
+        key = fixture_key(method, url)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                return None
+            position = self._replay_positions.get(key, 0)
+            self._replay_positions[key] = position + 1
+            return entries[min(position, len(entries) - 1)]
+
+
+def response_body(entry: dict) -> bytes:
+    if 'body_base64' in entry:
+        return base64.b64decode(entry['body_base64'])
+    return entry.get('body', '').encode('utf-8')
+
+
+class FixtureServer:
+    '''
+    Local HTTP server that records upstream responses into an `HttpCassette` or replays them.
+
+    Fault injection only applies in replay mode and is drawn from a seeded random generator, so the
+    same cassette, rates and seed give the same sequence of faults.
+
+    Parameters
+    --------
+    cassette: The cassette to record into or replay from.
+    mode: 'record' or 'replay'.
+    host, port: Address to listen on; port 0 picks a free port.
+    latency: Seconds added to every replayed response. None replays the latency that was recorded.
+    latency_jitter: Upper bound (seconds) of a uniform random delay added on top of `latency`.
+    error_rate: Probability of answering a replayed request with `error_status` instead.
+    error_status: HTTP status of injected errors.
+    captcha_rate: Probability of answering a replayed request with `CAPTCHA_PAGE`.
+    captcha_status: HTTP status of injected CAPTCHA pages (Scholar uses both 200 and 429).
+    seed: Seed of the fault and jitter generator.
+    upstream_timeout: Timeout of upstream requests in record mode.
+    '''
+
+    def __init__(self,
+                 cassette: HttpCassette,
+                 mode: str = 'replay',
+                 host: str = '127.0.0.1',
+                 port: int = 0,
+                 latency: Optional[float] = 0.0,
+                 latency_jitter: float = 0.0,
+                 error_rate: float = 0.0,
+                 error_status: int = 503,
+                 captcha_rate: float = 0.0,
+                 captcha_status: int = 200,
+                 seed: int = 0,
+                 upstream_timeout: float = 60):
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"Unknown fixture server mode {mode!r}, expected 'record' or 'replay'.")
+        self.cassette = cassette
+        self.mode = mode
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.captcha_rate = captcha_rate
+        self.captcha_status = captcha_status
+        self.upstream_timeout = upstream_timeout
+        self.stats = {'requests': 0, 'recorded': 0, 'replayed': 0, 'missing': 0,
+                      'injected_errors': 0, 'injected_captchas': 0, 'upstream_errors': 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._upstream = requests.Session()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> str:
+        '''
+        Serve in a background thread and return the server URL.
+        '''
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fixture-server', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _count(self, stat: str) -> None:
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _draw_fault(self) -> Tuple[Optional[str], float]:
+        with self._lock:
+            draw = self._random.random()
+            jitter = self._random.uniform(0, self.latency_jitter) if self.latency_jitter else 0.0
+        if draw < self.error_rate:
+            return 'error', jitter
+        if draw < self.error_rate + self.captcha_rate:
+            return 'captcha', jitter
+        return None, jitter
+
+    def _handler_class(self):
+        server = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self)
+
+            def do_HEAD(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        return _Handler
+
+    def _handle(self, handler: BaseHTTPRequestHandler) -> None:
+        self._count('requests')
+        scheme, _, rest = handler.path.lstrip('/').partition('/')
+        if scheme not in ('http', 'https') or not rest:
+            self._send(handler, 400, 'text/plain', f'Expected /<scheme>/<host>/<path>, got {handler.path}'.encode('utf-8'))
+            return
+        url = f'{scheme}://{rest}'
+        if self.mode == 'record':
+            self._record(handler, url)
+        else:
+            self._replay(handler, url)
+
+    def _record(self, handler: BaseHTTPRequestHandler, url: str) -> None:
+        headers = {name: handler.headers[name] for name in _FORWARDED_HEADERS if handler.headers.get(name)}
+        start_time = time.monotonic()
+        try:
+            response = self._upstream.request(handler.command, url, headers=headers, timeout=self.upstream_timeout)
+        except requests.RequestException as e:
+            self._count('upstream_errors')
+            self._send(handler, 502, 'text/plain', f'Upstream request failed: {str(e)}'.encode('utf-8'))
+            return
+        elapsed = time.monotonic() - start_time
+        content_type = response.headers.get('Content-Type', 'application/octet-stream')
+        self.cassette.record(handler.command, url, response.status_code, content_type, response.content, elapsed)
+        self._count('recorded')
+        self._send(handler, response.status_code, content_type, response.content)
+
+    def _replay(self, handler: BaseHTTPRequestHandler, url: str) -> None:
+        entry = self.cassette.next_response(handler.command, url)
+        fault, jitter = self._draw_fault()
+        latency = (entry or {}).get('elapsed', 0.0) if self.latency is None else self.latency
+        if latency + jitter > 0:
+            time.sleep(latency + jitter)
+
+        if fault == 'error':
+            self._count('injected_errors')
+            self._send(handler, self.error_status, 'text/plain', b'Injected error')
+        elif fault == 'captcha':
+            self._count('injected_captchas')
+            self._send(handler, self.captcha_status, 'text/html; charset=utf-8', CAPTCHA_PAGE.encode('utf-8'))
+        elif entry is None:
+            self._count('missing')
+            print(f"[WARNING!] No recorded response for {fixture_key(handler.command, url)}")
+            self._send(handler, 404, 'text/plain', b'No recorded response')
+        else:
+            self._count('replayed')
+            self._send(handler, entry['status'], entry['content_type'], response_body(entry))
+
+    @staticmethod
+    def _send(handler: BaseHTTPRequestHandler, status: int, content_type: str, body: bytes) -> None:
+        try:
+            handler.send_response(status)
+            handler.send_header('Content-Type', content_type)
+            handler.send_header('Content-Length', str(len(body)))
+            handler.end_headers()
+            if handler.command != 'HEAD':
+                handler.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (e.g. its timeout expired during injected latency).
+            pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Record or replay the HTTP traffic of the citation pipeline.')
+    parser.add_argument('mode', choices=['record', 'replay'])
+    parser.add_argument('--cassette', required=True, help='JSONL file to record into or replay from.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=None,
+                        help='Seconds added to every replayed response (default: the recorded latency).')
+    parser.add_argument('--latency-jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--captcha-rate', type=float, default=0.0)
+    parser.add_argument('--captcha-status', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = FixtureServer(HttpCassette(args.cassette), mode=args.mode, host=args.host, port=args.port,
+                           latency=args.latency, latency_jitter=args.latency_jitter,
+                           error_rate=args.error_rate, error_status=args.error_status,
+                           captcha_rate=args.captcha_rate, captcha_status=args.captcha_status, seed=args.seed)
+    server.start()
+    print(f"Fixture server ({args.mode}) listening on {server.url}; set {FIXTURE_SERVER_ENV}={server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"Fixture server stats: {server.stats}")
+
+
+if __name__ == '__main__':
+    main()
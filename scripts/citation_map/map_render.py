@@ -0,0 +1,203 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import folium
+import hashlib
+import html
+import json
+import os
+from collections import OrderedDict
+from folium.plugins import FastMarkerCluster
+from folium.utilities import JsCode
+from typing import List, Optional
+
+from scripts.citation_map.records import CitationRecord
+
+# 'markers': one folium.Marker per citing entry (the original map).
+# 'cluster': one marker per location, all in a single FastMarkerCluster layer.
+# 'geojson': one point per location, all in a single GeoJSON layer.
+RENDER_MODES = ('markers', 'cluster', 'geojson')
+
+MARKER_COLORS = ['red', 'blue', 'green', 'purple', 'orange', 'darkred', 'lightred', 'beige', 'darkblue', 'darkgreen',
+                 'cadetblue', 'darkpurple', 'pink', 'lightblue', 'lightgreen', 'gray', 'black', 'lightgray']
+# CSS colors of the marker colors above, for the GeoJSON circle markers.
+_CSS_COLORS = {'lightred': '#ff8e7f', 'beige': '#ffcb92', 'darkpurple': '#5b396b', 'cadetblue': '#436978'}
+
+# Citing entries listed in one location popup; the rest are summarized as a count.
+MAX_POPUP_ENTRIES = 20
+
+# Built once per marker, and only when its popup is opened.
+_CLUSTER_CALLBACK = '''
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({icon: 'info-sign', prefix: 'glyphicon', markerColor: row[2]})
+    });
+    marker.bindPopup(function () { return row[3]; }, {maxWidth: 300});
+    return marker;
+}
+'''
+
+_GEOJSON_STYLE_CALLBACK = '''
+function (feature, layer) {
+    var properties = feature.properties;
+    layer.setStyle({color: properties.color, fillColor: properties.color, radius: properties.radius});
+}
+'''
+
+
+def marker_color(key: str, pin_colorful: bool = True) -> str:
+    '''
+    Marker color of an affiliation: the same affiliation gets the same color in every run.
+    '''
+    if not pin_colorful:
+        return 'red'
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=4).digest()
+    return MARKER_COLORS[int.from_bytes(digest, 'big') % len(MARKER_COLORS)]
+
+
+def aggregate_by_location(coordinates_and_info: List[CitationRecord], pin_colorful: bool = True) -> List[dict]:
+    '''
+    Group located citing entries by coordinate. Each group has its coordinates, its affiliations, the
+    number of entries, a deterministic color (from its main affiliation) and the HTML of its popup.
+    '''
+    groups = OrderedDict()
+    for record in coordinates_and_info:
+        if not record.has_location():
+            continue
+        lat, lng = round(float(record.latitude), 5), round(float(record.longitude), 5)
+        groups.setdefault((lat, lng), []).append(record)
+
+    locations = []
+    for (lat, lng), records in groups.items():
+        affiliations = list(OrderedDict.fromkeys(record.affiliation for record in records))
+        first = records[0]
+        lines = [f"<b>{html.escape(', '.join(affiliations))}</b><br>",
+                 f"<b>Location:</b> {html.escape(f'{first.city}, {first.state}, {first.country}')}<br>",
+                 f"<b>Citing entries:</b> {len(records)}<br>"]
+        for record in records[:MAX_POPUP_ENTRIES]:
+            lines.append(f"<hr><b>Author:</b> {html.escape(str(record.author_name))}<br>"
+                         f"<b>Citing Paper:</b> {html.escape(str(record.citing_paper_title))}<br>"
+                         f"<b>Cited Paper:</b> {html.escape(str(record.cited_paper_title))}")
+        if len(records) > MAX_POPUP_ENTRIES:
+            lines.append(f"<hr>... and {len(records) - MAX_POPUP_ENTRIES} more")
+        locations.append({
+            'lat': lat,
+            'lng': lng,
+            'affiliations': affiliations,
+            'num_entries': len(records),
+            'color': marker_color(affiliations[0], pin_colorful),
+            'popup': ''.join(lines),
+        })
+    return locations
+
+
+def create_map(coordinates_and_info: List[CitationRecord], pin_colorful: bool = True,
+               render_mode: str = 'markers') -> Optional[folium.Map]:
+    '''
+    Create an interactive map using Folium.
+
+    Parameters
+    --------
+    coordinates_and_info: Citing entries; entries without coordinates are skipped.
+    pin_colorful: Color markers by affiliation (deterministically) instead of all red.
+    render_mode: One of `RENDER_MODES`. 'cluster' and 'geojson' aggregate entries per location and
+        keep the HTML small for highly cited applicants.
+    '''
+    if render_mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode {render_mode!r}, expected one of {RENDER_MODES}.")
+
+    # Create a map centered at the mean of all coordinates
+    valid_coords = [(float(record.latitude), float(record.longitude)) for record in coordinates_and_info
+                    if record.has_location()]
+    if not valid_coords:
+        print("No valid coordinates found to create map.")
+        return None
+
+    mean_lat = sum(lat for lat, _ in valid_coords) / len(valid_coords)
+    mean_lng = sum(lng for _, lng in valid_coords) / len(valid_coords)
+    m = folium.Map(location=[mean_lat, mean_lng], zoom_start=2)
+
+    if render_mode == 'markers':
+        _add_markers(m, coordinates_and_info, pin_colorful)
+    elif render_mode == 'cluster':
+        locations = aggregate_by_location(coordinates_and_info, pin_colorful)
+        FastMarkerCluster([[location['lat'], location['lng'], location['color'], location['popup']] for location in locations],
+                          callback=_CLUSTER_CALLBACK, name='Citing affiliations').add_to(m)
+    else:
+        locations = aggregate_by_location(coordinates_and_info, pin_colorful)
+        features = [{
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [location['lng'], location['lat']]},
+            'properties': {'color': _CSS_COLORS.get(location['color'], location['color']),
+                           'radius': min(4 + location['num_entries'], 12),
+                           'popup': location['popup']},
+        } for location in locations]
+        folium.GeoJson(
+            {'type': 'FeatureCollection', 'features': features},
+            name='Citing affiliations',
+            marker=folium.CircleMarker(radius=6, fill=True, fill_opacity=0.8),
+            # Styled in the browser from the feature properties; a Python style_function would embed the data twice.
+            on_each_feature=JsCode(_GEOJSON_STYLE_CALLBACK),
+            popup=folium.GeoJsonPopup(fields=['popup'], labels=False, max_width=300),
+        ).add_to(m)
+    return m
+
+
+def _add_markers(m: folium.Map, coordinates_and_info: List[CitationRecord], pin_colorful: bool) -> None:
+    # Add markers for each location
+    for record in coordinates_and_info:
+        if not record.has_location():
+            continue
+
+        # Create popup content
+        popup_content = f"""
+        <b>Author:</b> {record.author_name}<br>
+        <b>Affiliation:</b> {record.affiliation}<br>
+        <b>Citing Paper:</b> {record.citing_paper_title}<br>
+        <b>Cited Paper:</b> {record.cited_paper_title}<br>
+        <b>Location:</b> {record.city}, {record.state}, {record.country}<br>
+        <b>Citation:</b> {record.citation}
+        """
+
+        # Add marker to map
+        folium.Marker(
+            location=[float(record.latitude), float(record.longitude)],
+            popup=folium.Popup(popup_content, max_width=300),
+            icon=folium.Icon(color=marker_color(record.affiliation, pin_colorful), icon='info-sign')
+        ).add_to(m)
+
+
+def measure_load_time(html_path: str, timeout: float = 60) -> Optional[float]:
+    '''
+    Seconds a headless Chrome takes to load `html_path` (navigation start to load event end),
+    or None if Chrome cannot be started.
+    '''
+    try:
+        from selenium import webdriver
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless=new')
+        driver = webdriver.Chrome(options=options)
+    except Exception as e:
+        print(f"[WARNING!] Could not start Chrome to measure the map load time: {str(e)}")
+        return None
+    try:
+        driver.set_page_load_timeout(timeout)
+        driver.get('file://' + os.path.abspath(html_path))
+        timing = json.loads(driver.execute_script('return JSON.stringify(window.performance.timing)'))
+        return (timing['loadEventEnd'] - timing['navigationStart']) / 1000
+    finally:
+        driver.quit()
+
+
+def save_map(m: folium.Map, output_path: str, report_load_time: bool = False) -> dict:
+    '''
+    Save the map and report its HTML size (and, if asked, its load time in headless Chrome).
+    '''
+    m.save(output_path)
+    report = {'html_bytes': os.path.getsize(output_path), 'load_seconds': None}
+    message = f"Map saved to {output_path} ({report['html_bytes'] / 1024:.1f} KiB"
+    if report_load_time:
+        report['load_seconds'] = measure_load_time(output_path)
+        if report['load_seconds'] is not None:
+            message += f", loads in {report['load_seconds']:.2f} s"
+    print(message + ")")
+    return report
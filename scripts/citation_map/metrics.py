@@ -0,0 +1,158 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import contextlib
+import json
+import math
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Union
+from urllib.parse import urlsplit
+
+METRICS_FILENAME = 'citation_metrics.json'
+
+
+def metrics_path_for_csv(csv_path: str) -> str:
+    '''
+    Path of the metrics report written next to a citation_info CSV.
+    '''
+    return os.path.join(os.path.dirname(csv_path), METRICS_FILENAME)
+
+
+def url_host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def _percentile(sorted_samples: List[float], percentile: float) -> float:
+    # Nearest-rank percentile of an already sorted, non-empty list.
+    rank = max(1, math.ceil(percentile / 100 * len(sorted_samples)))
+    return sorted_samples[rank - 1]
+
+
+class MetricsCollector:
+    '''
+    Thread-safe collector of one pipeline run's metrics: HTTP responses by host and status, retries,
+    CAPTCHA hits, hits and misses per cache, free-form counters and per-item stage latencies.
+
+    One collector is threaded through every stage of a run, and `write_json` adds its report under
+    `name` to the JSON report next to `citation_info.csv`, so later steps (e.g. email enrichment)
+    add their own section to the same file.
+
+    Parameters
+    --------
+    name: Section of the JSON report this run is written to.
+    '''
+
+    def __init__(self, name: str = 'citation_map'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        self._http: Dict[str, Counter] = defaultdict(Counter)
+        self._retries = Counter()
+        self._captchas = Counter()
+        self._cache_hits = Counter()
+        self._cache_misses = Counter()
+        self._counters = Counter()
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+
+    def record_http(self, host: str, status: Union[int, str]) -> None:
+        '''
+        One response (or failure) from `host`. `status` is the HTTP status, or the exception name when
+        no response was received.
+        '''
+        with self._lock:
+            self._http[host][str(status)] += 1
+
+    def record_retry(self, operation: str) -> None:
+        with self._lock:
+            self._retries[operation] += 1
+
+    def record_captcha(self, host: str) -> None:
+        with self._lock:
+            self._captchas[host] += 1
+
+    def record_cache(self, cache: str, hits: int = 0, misses: int = 0) -> None:
+        with self._lock:
+            self._cache_hits[cache] += hits
+            self._cache_misses[cache] += misses
+
+    def count(self, counter: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += value
+
+    def record_latency(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies[stage].append(seconds)
+
+    @contextlib.contextmanager
+    def time_stage(self, stage: str):
+        '''
+        Record the time spent in the `with` block as one latency sample of `stage`.
+        '''
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_latency(stage, time.monotonic() - start_time)
+
+    def timed(self, stage: str, func):
+        '''
+        Wrap `func` so that every call is recorded as one latency sample of `stage`.
+        '''
+        def _timed(*args, **kwargs):
+            with self.time_stage(stage):
+                return func(*args, **kwargs)
+        return _timed
+
+    def report(self) -> dict:
+        with self._lock:
+            caches = {}
+            for cache in sorted(set(self._cache_hits) | set(self._cache_misses)):
+                hits, misses = self._cache_hits[cache], self._cache_misses[cache]
+                caches[cache] = {'hits': hits, 'misses': misses,
+                                 'hit_ratio': hits / (hits + misses) if hits + misses else None}
+            stages = {}
+            for stage, samples in sorted(self._latencies.items()):
+                sorted_samples = sorted(samples)
+                stages[stage] = {'count': len(samples),
+                                 'total_seconds': sum(samples),
+                                 'p50_seconds': _percentile(sorted_samples, 50),
+                                 'p95_seconds': _percentile(sorted_samples, 95),
+                                 'max_seconds': sorted_samples[-1]}
+            return {
+                'wall_seconds': time.monotonic() - self._start_time,
+                'http_requests': {host: dict(sorted(statuses.items())) for host, statuses in sorted(self._http.items())},
+                'num_http_requests': sum(sum(statuses.values()) for statuses in self._http.values()),
+                'retries': dict(sorted(self._retries.items())),
+                'captchas': dict(sorted(self._captchas.items())),
+                'caches': caches,
+                'counters': dict(sorted(self._counters.items())),
+                'stages': stages,
+            }
+
+    def write_json(self, json_output_path: str) -> dict:
+        '''
+        Write this run's report under `name` in `json_output_path`, keeping other sections of the file.
+        '''
+        report = self.report()
+        sections = {}
+        if os.path.exists(json_output_path):
+            try:
+                with open(json_output_path) as f:
+                    sections = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[WARNING!] Could not read the metrics report {json_output_path}, overwriting it: {str(e)}")
+        sections[self.name] = report
+        os.makedirs(os.path.dirname(os.path.abspath(json_output_path)), exist_ok=True)
+        temporary_path = json_output_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(sections, f, indent=2)
+        os.replace(temporary_path, json_output_path)
+        print(f"Metrics: {report['num_http_requests']} HTTP requests, {sum(report['retries'].values())} retries, "
+              f"{sum(report['captchas'].values())} CAPTCHAs in {report['wall_seconds']:.1f} s; report saved to {json_output_path}")
+        return report
+
+
+# Default collector for components used outside a metered run.
+PIPELINE_METRICS = MetricsCollector()
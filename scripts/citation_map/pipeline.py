@@ -0,0 +1,101 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import asyncio
+import queue
+import threading
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator
+
+# Maximum number of items buffered between two stages. Small enough to bound memory,
+# large enough that a fast stage is rarely stalled by a momentarily slow neighbour.
+DEFAULT_QUEUE_SIZE = 256
+
+_DONE = object()
+
+
+class _StageError:
+    __slots__ = ('exception',)
+
+    def __init__(self, exception: BaseException):
+        self.exception = exception
+
+
+def stream_stage(items: Iterable, func: Callable[[Any], Iterable], num_workers: int = 1,
+                 maxsize: int = DEFAULT_QUEUE_SIZE) -> Iterator:
+    '''
+    Run one pipeline stage in background threads.
+
+    `num_workers` threads pull items from `items`, call `func(item)` and push every element of the
+    returned iterable into a bounded queue; the returned iterator drains that queue. Chaining stages
+    therefore lets each of them run (and wait on its own rate limits) concurrently with the others.
+    An exception raised by `func` is re-raised in the consumer.
+
+    Parameters
+    --------
+    items: Input iterable, typically the output of the previous stage.
+    func: Maps one input item to zero or more output items.
+    num_workers: Number of threads running `func`.
+    maxsize: Capacity of the output queue.
+    '''
+    out_queue = queue.Queue(maxsize=maxsize)
+    items = iter(items)
+    items_lock = threading.Lock()
+
+    def worker():
+        try:
+            while True:
+                with items_lock:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        break
+                for result in func(item):
+                    out_queue.put(result)
+        except BaseException as e:
+            out_queue.put(_StageError(e))
+        finally:
+            out_queue.put(_DONE)
+
+    for _ in range(num_workers):
+        threading.Thread(target=worker, daemon=True).start()
+    return _drain(out_queue, num_workers)
+
+
+def stream_async(async_iterable_factory: Callable[[], AsyncIterator],
+                 maxsize: int = DEFAULT_QUEUE_SIZE) -> Iterator:
+    '''
+    Run an async generator on its own event loop in a background thread and stream its items.
+
+    Parameters
+    --------
+    async_iterable_factory: Zero-argument callable returning the async iterator to consume.
+    maxsize: Capacity of the output queue.
+    '''
+    out_queue = queue.Queue(maxsize=maxsize)
+
+    async def produce():
+        loop = asyncio.get_running_loop()
+        async for item in async_iterable_factory():
+            # Never block the event loop on a full queue: other fetches must keep going.
+            await loop.run_in_executor(None, out_queue.put, item)
+
+    def runner():
+        try:
+            asyncio.run(produce())
+        except BaseException as e:
+            out_queue.put(_StageError(e))
+        finally:
+            out_queue.put(_DONE)
+
+    threading.Thread(target=runner, daemon=True).start()
+    return _drain(out_queue, 1)
+
+
+def _drain(out_queue: queue.Queue, num_producers: int) -> Iterator:
+    while num_producers:
+        result = out_queue.get()
+        if result is _DONE:
+            num_producers -= 1
+        elif isinstance(result, _StageError):
+            raise result.exception
+        else:
+            yield result
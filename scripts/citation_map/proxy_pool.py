@@ -0,0 +1,193 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import asyncio
+import math
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# List of free proxies (you can add more), e.g. 'http://127.0.0.1:8080'.
+PROXY_LIST = [
+    None,  # Direct connection only for now
+    # Add working proxies here if available
+]
+
+# Seconds to wait for a TCP connection through a proxy. Dead proxies fail here
+# instead of costing the full request timeout.
+PROXY_CONNECT_TIMEOUT = 5
+
+
+class _ProxyHealth:
+    __slots__ = ('num_successes', 'num_failures', 'consecutive_failures', 'latency',
+                 'block_score', 'block_score_time', 'quarantined_until')
+
+    def __init__(self):
+        self.num_successes = 0
+        self.num_failures = 0
+        self.consecutive_failures = 0
+        self.latency = None
+        self.block_score = 0.0
+        self.block_score_time = 0.0
+        self.quarantined_until = 0.0
+
+
+class ProxyPool:
+    '''
+    Health-scored pool of proxy endpoints.
+
+    Every endpoint is scored by its smoothed success rate, its latency (exponentially weighted) and its
+    recent blocks, which decay with a half-life. New requests are routed to one of the `top_k` best
+    endpoints that are not quarantined. Blocks and repeated connection failures quarantine an endpoint
+    for a period that doubles with its recent block score; when every endpoint is quarantined, callers
+    wait for the first one to be released instead of being handed a dead proxy. `None` stands for a direct connection; set
+    `allow_direct` to False when traffic must go through a proxy.
+
+    Parameters
+    --------
+    endpoints: Proxy URLs (or None for a direct connection).
+    top_k: Number of best endpoints new requests are spread across.
+    latency_alpha: Weight of the newest sample in the latency average.
+    block_half_life: Seconds after which a block counts half as much.
+    base_quarantine: Quarantine length in seconds for an endpoint with no recent blocks.
+    max_quarantine: Upper bound on the quarantine length.
+    max_consecutive_failures: Connection failures in a row that trigger a quarantine.
+    clock: Monotonic time source, replaceable in tests.
+    '''
+
+    def __init__(self,
+                 endpoints: List[Optional[str]],
+                 top_k: int = 3,
+                 latency_alpha: float = 0.3,
+                 block_half_life: float = 600,
+                 base_quarantine: float = 60,
+                 max_quarantine: float = 1800,
+                 max_consecutive_failures: int = 2,
+                 clock: Callable[[], float] = time.monotonic):
+        self.top_k = top_k
+        self.latency_alpha = latency_alpha
+        self.block_half_life = block_half_life
+        self.base_quarantine = base_quarantine
+        self.max_quarantine = max_quarantine
+        self.max_consecutive_failures = max_consecutive_failures
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._health: Dict[Optional[str], _ProxyHealth] = {}
+        self.allow_direct = True
+        for endpoint in endpoints:
+            self.add(endpoint)
+
+    @property
+    def has_proxies(self) -> bool:
+        return any(endpoint is not None for endpoint in self._health)
+
+    def add(self, endpoint: Optional[str]) -> None:
+        with self._lock:
+            self._health.setdefault(endpoint, _ProxyHealth())
+
+    def try_acquire(self) -> Tuple[Optional[str], float]:
+        '''
+        Pick an endpoint for the next request among the best healthy ones.
+        Returns (endpoint, 0), or (None, seconds until the first quarantine expires) if every endpoint is
+        quarantined. Without `allow_direct`, the direct connection is never picked (None is only returned
+        with no wait if the pool has no proxy at all).
+        '''
+        with self._lock:
+            endpoints = [endpoint for endpoint in self._health if self.allow_direct or endpoint is not None]
+            if not endpoints:
+                return None, 0.0
+            now = self.clock()
+            healthy = [endpoint for endpoint in endpoints if self._health[endpoint].quarantined_until <= now]
+            if not healthy:
+                return None, min(self._health[endpoint].quarantined_until for endpoint in endpoints) - now
+            healthy.sort(key=lambda endpoint: self._score(endpoint, now), reverse=True)
+            return random.choice(healthy[:self.top_k]), 0.0
+
+    def acquire(self) -> Optional[str]:
+        '''
+        Block the calling thread until an endpoint is out of quarantine, and return it.
+        '''
+        while True:
+            endpoint, wait_time = self.try_acquire()
+            if wait_time <= 0:
+                return endpoint
+            time.sleep(wait_time)
+
+    async def acquire_async(self) -> Optional[str]:
+        '''
+        Suspend the calling coroutine until an endpoint is out of quarantine, and return it.
+        '''
+        while True:
+            endpoint, wait_time = self.try_acquire()
+            if wait_time <= 0:
+                return endpoint
+            await asyncio.sleep(wait_time)
+
+    def report_success(self, endpoint: Optional[str], latency: float) -> None:
+        with self._lock:
+            health = self._health.setdefault(endpoint, _ProxyHealth())
+            health.num_successes += 1
+            health.consecutive_failures = 0
+            if health.latency is None:
+                health.latency = latency
+            else:
+                health.latency += self.latency_alpha * (latency - health.latency)
+
+    def report_failure(self, endpoint: Optional[str]) -> None:
+        '''
+        Record a connection error or timeout.
+        '''
+        with self._lock:
+            health = self._health.setdefault(endpoint, _ProxyHealth())
+            health.num_failures += 1
+            health.consecutive_failures += 1
+            if health.consecutive_failures >= self.max_consecutive_failures:
+                self._quarantine(health, self.clock())
+
+    def report_block(self, endpoint: Optional[str]) -> None:
+        '''
+        Record a CAPTCHA or access-denied answer received through `endpoint`.
+        '''
+        with self._lock:
+            health = self._health.setdefault(endpoint, _ProxyHealth())
+            now = self.clock()
+            health.num_failures += 1
+            health.block_score = self._decayed_block_score(health, now) + 1
+            health.block_score_time = now
+            self._quarantine(health, now)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            now = self.clock()
+            return [{
+                'endpoint': endpoint or 'direct',
+                'score': self._score(endpoint, now),
+                'num_successes': health.num_successes,
+                'num_failures': health.num_failures,
+                'latency': health.latency,
+                'recent_blocks': self._decayed_block_score(health, now),
+                'quarantined_for': max(0.0, health.quarantined_until - now),
+            } for endpoint, health in self._health.items()]
+
+    def _decayed_block_score(self, health: _ProxyHealth, now: float) -> float:
+        if not health.block_score:
+            return 0.0
+        return health.block_score * 0.5 ** ((now - health.block_score_time) / self.block_half_life)
+
+    def _quarantine(self, health: _ProxyHealth, now: float) -> None:
+        recent_blocks = self._decayed_block_score(health, now)
+        duration = min(self.max_quarantine, self.base_quarantine * 2 ** max(0.0, recent_blocks - 1))
+        health.quarantined_until = now + duration
+        health.consecutive_failures = 0
+
+    def _score(self, endpoint: Optional[str], now: float) -> float:
+        # Higher is better: smoothed success rate, discounted by latency and recent blocks.
+        health = self._health[endpoint]
+        success_rate = (health.num_successes + 1) / (health.num_successes + health.num_failures + 2)
+        latency_factor = 1 / (1 + (health.latency or 0.0))
+        block_factor = math.exp(-self._decayed_block_score(health, now))
+        return success_rate * latency_factor * block_factor
+
+
+# One pool for all Google Scholar traffic in this process.
+SCHOLAR_PROXY_POOL = ProxyPool(PROXY_LIST)
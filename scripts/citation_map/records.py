@@ -0,0 +1,114 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import pandas as pd
+from typing import Iterable, List
+
+# Column name in citation_info.csv for each record field.
+CSV_COLUMNS = {
+    'author_name': 'citing author name',
+    'citing_paper_title': 'citing paper title',
+    'cited_paper_title': 'cited paper title',
+    'affiliation': 'affiliation',
+    'latitude': 'latitude',
+    'longitude': 'longitude',
+    'county': 'county',
+    'city': 'city',
+    'state': 'state',
+    'country': 'country',
+    'author_id': 'author_id',
+    'citation': 'citation',
+}
+
+# Column dtypes; string columns use the pandas nullable string type.
+COLUMN_DTYPES = {column: ('float64' if field in ('latitude', 'longitude') else 'string')
+                 for field, column in CSV_COLUMNS.items()}
+
+
+class CitationRecord:
+    '''
+    One citing entry as it moves through the pipeline.
+
+    The same record type is used by every stage: citing-paper lookup fills the author ID, titles and
+    citation; affiliation lookup fills the author name and affiliation; geocoding fills the location.
+    Fields that a stage has not reached yet are ''.
+    `citing_paper_key` is set by de-duplication (see `dedup.citing_paper_key`) and is not a CSV column.
+    '''
+    __slots__ = tuple(CSV_COLUMNS) + ('citing_paper_key',)
+
+    def __init__(self, author_id: str = '', citing_paper_title: str = '', cited_paper_title: str = '',
+                 citation: str = '', author_name: str = '', affiliation: str = '',
+                 latitude='', longitude='', county='', city='', state='', country='', citing_paper_key: str = ''):
+        self.author_id = author_id
+        self.citing_paper_title = citing_paper_title
+        self.cited_paper_title = cited_paper_title
+        self.citation = citation
+        self.author_name = author_name
+        self.affiliation = affiliation
+        self.latitude = latitude
+        self.longitude = longitude
+        self.county = county
+        self.city = city
+        self.state = state
+        self.country = country
+        self.citing_paper_key = citing_paper_key
+
+    def replace(self, **changes) -> 'CitationRecord':
+        '''
+        Copy of this record with some fields changed.
+        '''
+        record = CitationRecord.__new__(CitationRecord)
+        for field in self.__slots__:
+            setattr(record, field, changes.get(field, getattr(self, field)))
+        return record
+
+    def has_location(self) -> bool:
+        return self.latitude not in ('', None) and self.longitude not in ('', None) and not pd.isna(self.latitude) \
+            and not pd.isna(self.longitude)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CitationRecord):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    def __hash__(self) -> int:
+        return hash(tuple(getattr(self, field) for field in self.__slots__))
+
+    def __repr__(self) -> str:
+        return 'CitationRecord(%s)' % ', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)
+
+
+def records_to_frame(records: Iterable[CitationRecord]) -> pd.DataFrame:
+    '''
+    Build the citation_info table column by column, with typed columns named as in the CSV.
+    '''
+    records = list(records)
+    columns = {}
+    for field, column in CSV_COLUMNS.items():
+        values = [getattr(record, field) for record in records]
+        if COLUMN_DTYPES[column] == 'float64':
+            columns[column] = pd.to_numeric(pd.Series(values, dtype='object').replace('', None), errors='coerce')
+        else:
+            columns[column] = pd.Series(values, dtype='object').fillna('').astype(str).astype('string')
+    return pd.DataFrame(columns)
+
+
+def frame_to_records(citation_df: pd.DataFrame) -> List[CitationRecord]:
+    '''
+    Convert a citation_info table (as written by `records_to_frame`) back into records.
+    '''
+    columns = [citation_df[column].astype(object).where(citation_df[column].notna(), '').tolist()
+               for column in CSV_COLUMNS.values()]
+    fields = list(CSV_COLUMNS)
+    return [CitationRecord(**dict(zip(fields, values))) for values in zip(*columns)]
+
+
+def write_records(records: Iterable[CitationRecord], output_path: str) -> pd.DataFrame:
+    '''
+    Write records to `output_path` as Parquet (if it ends in '.parquet', requires pyarrow) or CSV.
+    '''
+    citation_df = records_to_frame(records)
+    if output_path.endswith('.parquet'):
+        citation_df.to_parquet(output_path, index=False)
+    else:
+        citation_df.to_csv(output_path, index=False)
+    return citation_df
@@ -0,0 +1,207 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import csv
+import io
+import os
+import zipfile
+import numpy as np
+import pycountry
+import requests
+from typing import Dict, List, Optional, Sequence
+
+import config
+
+# GeoNames dumps (https://download.geonames.org/export/dump/), downloaded once by `download_geonames`.
+GEONAMES_PATH = os.path.join(config.DATA_PATH, 'geonames')
+GEONAMES_CITIES_FILE = 'cities15000.txt'
+GEONAMES_ADMIN1_FILE = 'admin1CodesASCII.txt'
+GEONAMES_ADMIN2_FILE = 'admin2Codes.txt'
+GEONAMES_DUMP_URL = 'https://download.geonames.org/export/dump/'
+
+ADMIN_FIELDS = ('county', 'city', 'state', 'country')
+
+# Columns of the GeoNames 'geoname' table that we use.
+_NAME_COLUMN, _LAT_COLUMN, _LNG_COLUMN, _COUNTRY_COLUMN, _ADMIN1_COLUMN, _ADMIN2_COLUMN = 1, 4, 5, 8, 10, 11
+
+
+def _unit_vectors(lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    lats, lngs = np.radians(lats), np.radians(lngs)
+    cos_lats = np.cos(lats)
+    return np.ascontiguousarray(np.stack([cos_lats * np.cos(lngs), cos_lats * np.sin(lngs), np.sin(lats)], axis=1))
+
+
+class LocalReverseGeocoder:
+    '''
+    Offline reverse geocoder: coordinates -> county/city/state/country of the nearest known city.
+
+    City points are held in contiguous numpy arrays and bucketed into a latitude/longitude grid
+    (points sorted by cell, with per-cell offsets). A batch of coordinates is resolved in one
+    vectorized pass over the 3x3 cells around each query; the few queries whose answer could lie
+    outside that neighbourhood (empty cells, near the poles) are resolved exactly by brute force.
+
+    Parameters
+    --------
+    cities_path: GeoNames cities file (e.g. cities15000.txt).
+    admin1_path: GeoNames admin1CodesASCII.txt, for state names.
+    admin2_path: GeoNames admin2Codes.txt, for county names.
+    cell_degrees: Grid cell size in degrees.
+    '''
+
+    def __init__(self,
+                 cities_path: str = os.path.join(GEONAMES_PATH, GEONAMES_CITIES_FILE),
+                 admin1_path: str = os.path.join(GEONAMES_PATH, GEONAMES_ADMIN1_FILE),
+                 admin2_path: str = os.path.join(GEONAMES_PATH, GEONAMES_ADMIN2_FILE),
+                 cell_degrees: float = 1.0):
+        admin1_names = self._load_admin_names(admin1_path)
+        admin2_names = self._load_admin_names(admin2_path)
+        country_names = {}
+
+        lats, lngs, self.cities, self.counties, self.states, self.countries = [], [], [], [], [], []
+        with open(cities_path, encoding='utf-8') as f:
+            for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE):
+                country_code = row[_COUNTRY_COLUMN]
+                if country_code not in country_names:
+                    country = pycountry.countries.get(alpha_2=country_code)
+                    country_names[country_code] = getattr(country, 'common_name', None) or getattr(country, 'name', '')
+                lats.append(float(row[_LAT_COLUMN]))
+                lngs.append(float(row[_LNG_COLUMN]))
+                self.cities.append(row[_NAME_COLUMN])
+                self.states.append(admin1_names.get(f'{country_code}.{row[_ADMIN1_COLUMN]}', ''))
+                self.counties.append(admin2_names.get(f'{country_code}.{row[_ADMIN1_COLUMN]}.{row[_ADMIN2_COLUMN]}', ''))
+                self.countries.append(country_names[country_code])
+
+        self.cell_degrees = cell_degrees
+        self._num_rows = int(np.ceil(180 / cell_degrees))
+        self._num_cols = int(np.ceil(360 / cell_degrees))
+        self.latitudes = np.asarray(lats, dtype=np.float64)
+        self.longitudes = np.asarray(lngs, dtype=np.float64)
+        self._points = _unit_vectors(self.latitudes, self.longitudes)
+
+        cells = self._cells(self.latitudes, self.longitudes)
+        self._order = np.argsort(cells, kind='stable')
+        self._counts = np.bincount(cells, minlength=self._num_rows * self._num_cols)
+        self._starts = np.concatenate([[0], np.cumsum(self._counts)[:-1]])
+
+    def __len__(self) -> int:
+        return len(self.cities)
+
+    def nearest(self, lats: Sequence[float], lngs: Sequence[float]) -> np.ndarray:
+        '''
+        Index of the nearest city for every (lat, lng) pair.
+        '''
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        queries = _unit_vectors(lats, lngs)
+        num_queries = len(queries)
+        if num_queries == 0:
+            return np.empty(0, dtype=np.int64)
+
+        # Candidate cells: the 3x3 block around each query (longitude wraps around), each cell once.
+        rows, cols = np.divmod(self._cells(lats, lngs), self._num_cols)
+        offsets = np.array([-1, 0, 1])
+        neighbour_rows = np.clip(rows[:, None, None] + offsets[None, :, None], 0, self._num_rows - 1)
+        neighbour_cols = (cols[:, None, None] + offsets[None, None, :]) % self._num_cols
+        cells = np.sort((neighbour_rows * self._num_cols + neighbour_cols).reshape(num_queries, 9), axis=1)
+        cells[np.diff(cells, axis=1, prepend=-1) == 0] = -1
+
+        # Flatten every (query, candidate point) pair.
+        pair_counts = np.where(cells >= 0, self._counts[np.maximum(cells, 0)], 0).ravel()
+        pair_starts = self._starts[np.maximum(cells, 0)].ravel()
+        pair_queries = np.repeat(np.arange(num_queries), cells.shape[1])
+        total = int(pair_counts.sum())
+        group_offsets = np.cumsum(pair_counts) - pair_counts
+        positions = np.repeat(pair_starts - group_offsets, pair_counts) + np.arange(total)
+        candidate_points = self._order[positions]
+        candidate_queries = np.repeat(pair_queries, pair_counts)
+
+        best = np.full(num_queries, -1, dtype=np.int64)
+        best_dot = np.full(num_queries, -np.inf)
+        if total:
+            dots = np.einsum('ij,ij->i', queries[candidate_queries], self._points[candidate_points])
+            ranking = np.lexsort((-dots, candidate_queries))
+            first = np.concatenate([[True], np.diff(candidate_queries[ranking]) != 0])
+            winners = ranking[first]
+            best[candidate_queries[winners]] = candidate_points[winners]
+            best_dot[candidate_queries[winners]] = dots[winners]
+
+        # The 3x3 block is guaranteed to contain the nearest city only if that city is closer than the
+        # block's edge, at least one cell of latitude and cos(latitude) cells of longitude away.
+        edge_degrees = self.cell_degrees * np.cos(np.radians(np.minimum(np.abs(lats) + self.cell_degrees, 90)))
+        unresolved = np.flatnonzero(np.arccos(np.clip(best_dot, -1, 1)) > np.radians(edge_degrees))
+        for start in range(0, len(unresolved), 256):
+            chunk = unresolved[start:start + 256]
+            best[chunk] = np.argmax(queries[chunk] @ self._points.T, axis=1)
+        return best
+
+    def reverse(self, lats: Sequence[float], lngs: Sequence[float]) -> List[dict]:
+        '''
+        county/city/state/country of the nearest city for every (lat, lng) pair.
+        '''
+        return [{'county': self.counties[index], 'city': self.cities[index],
+                 'state': self.states[index], 'country': self.countries[index]}
+                for index in self.nearest(lats, lngs).tolist()]
+
+    def fill_missing(self, locations: List[dict]) -> int:
+        '''
+        Fill empty county/city/state/country fields of located entries (dicts with 'lat' and 'lng')
+        in place, with one batched query. Returns the number of entries changed.
+        '''
+        incomplete = [location for location in locations
+                      if location.get('lat') and location.get('lng')
+                      and not all(location.get(field) for field in ADMIN_FIELDS)]
+        if not incomplete:
+            return 0
+        admin = self.reverse([float(location['lat']) for location in incomplete],
+                             [float(location['lng']) for location in incomplete])
+        for location, nearest_admin in zip(incomplete, admin):
+            for field in ADMIN_FIELDS:
+                if not location.get(field):
+                    location[field] = nearest_admin[field]
+        return len(incomplete)
+
+    def _cells(self, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+        rows = np.clip(((lats + 90) // self.cell_degrees).astype(np.int64), 0, self._num_rows - 1)
+        cols = ((lngs + 180) // self.cell_degrees).astype(np.int64) % self._num_cols
+        return rows * self._num_cols + cols
+
+    @staticmethod
+    def _load_admin_names(path: str) -> Dict[str, str]:
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            return {row[0]: row[1] for row in csv.reader(f, delimiter='\t', quoting=csv.QUOTE_NONE) if len(row) > 1}
+
+
+def load_reverse_geocoder(geonames_path: str = GEONAMES_PATH) -> Optional[LocalReverseGeocoder]:
+    '''
+    Local reverse geocoder over the GeoNames files in `geonames_path`, or None if they are not downloaded.
+    '''
+    cities_path = os.path.join(geonames_path, GEONAMES_CITIES_FILE)
+    if not os.path.exists(cities_path):
+        print(f"Local reverse geocoding disabled: {cities_path} not found "
+              f"(run `python -m scripts.citation_map.reverse_geocode` to download it).")
+        return None
+    return LocalReverseGeocoder(cities_path,
+                                os.path.join(geonames_path, GEONAMES_ADMIN1_FILE),
+                                os.path.join(geonames_path, GEONAMES_ADMIN2_FILE))
+
+
+def download_geonames(geonames_path: str = GEONAMES_PATH) -> None:
+    '''
+    Download the GeoNames cities (population > 15000) and admin code files.
+    '''
+    os.makedirs(geonames_path, exist_ok=True)
+    response = requests.get(GEONAMES_DUMP_URL + GEONAMES_CITIES_FILE.replace('.txt', '.zip'), timeout=120)
+    response.raise_for_status()
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        archive.extract(GEONAMES_CITIES_FILE, geonames_path)
+    for file_name in (GEONAMES_ADMIN1_FILE, GEONAMES_ADMIN2_FILE):
+        response = requests.get(GEONAMES_DUMP_URL + file_name, timeout=120)
+        response.raise_for_status()
+        with open(os.path.join(geonames_path, file_name), 'wb') as f:
+            f.write(response.content)
+
+
+if __name__ == '__main__':
+    download_geonames()
+    print(f"GeoNames data saved to {GEONAMES_PATH}")
@@ -0,0 +1,207 @@
+# Copyright (c) 2024 Chen Liu
+# All rights reserved.
+import re
+from bs4 import BeautifulSoup
+from typing import Dict, List, Optional
+
+NO_AUTHOR_FOUND_STR = 'No_author_found'
+
+SCHOLAR_BASE_URL = 'https://scholar.google.com'
+
+_RESULT_COUNT_PATTERN = re.compile(r'([\d,.]+)\s+results?')
+_RESULT_COUNT_SEPARATOR_PATTERN = re.compile(r'[,.]')
+
+
+class CitationPage:
+    '''
+    What we extract from one Scholar "cited by" result page.
+
+    citing_author_ids and citing_papers are parallel lists with one entry per (citing paper, linked author);
+    papers without any linked author get one `NO_AUTHOR_FOUND_STR` entry.
+    '''
+    __slots__ = ('citing_author_ids', 'citing_papers', 'total_results', 'navigation_urls')
+
+    def __init__(self, citing_author_ids: List[str], citing_papers: List[dict],
+                 total_results: Optional[int], navigation_urls: Dict[int, str]):
+        self.citing_author_ids = citing_author_ids
+        self.citing_papers = citing_papers
+        self.total_results = total_results
+        # Page number -> URL of the page navigation buttons.
+        self.navigation_urls = navigation_urls
+
+    def next_page_url(self, current_page_number: int) -> Optional[str]:
+        return self.navigation_urls.get(current_page_number + 1)
+
+    def as_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
+class CitationPageParser:
+    '''
+    Parser backend for Scholar result pages. Subclasses implement `parse`.
+    '''
+    name = 'parser'
+
+    def parse(self, html: str) -> CitationPage:
+        raise NotImplementedError
+
+
+def _author_id_from_href(href: str) -> Optional[str]:
+    if 'user=' not in href:
+        return None
+    return href.split('user=')[1].split('&')[0]
+
+
+def _add_result(citing_author_ids: List[str], citing_papers: List[dict], title_text: str,
+                byline_text: Optional[str], hrefs: List[str]) -> None:
+    title = title_text.replace('[HTML]', '').replace('[PDF]', '')
+    # Get author name from the byline
+    author_name = byline_text.split('-')[0].strip() if byline_text is not None else 'Unknown Author'
+    paper_parsed = False
+    for href in hrefs:
+        author_id = _author_id_from_href(href)
+        if author_id is not None:
+            citing_author_ids.append(author_id)
+            citing_papers.append({'author': author_name, 'title': title})
+            paper_parsed = True
+    if not paper_parsed:
+        print("[WARNING!] Could not find author links for ", title)
+        citing_author_ids.append(NO_AUTHOR_FOUND_STR)
+        citing_papers.append({'author': author_name, 'title': title})
+
+
+def _parse_total_results(summary_text: Optional[str]) -> Optional[int]:
+    if not summary_text:
+        return None
+    match = _RESULT_COUNT_PATTERN.search(summary_text)
+    if not match:
+        return None
+    return int(_RESULT_COUNT_SEPARATOR_PATTERN.sub('', match.group(1)))
+
+
+def get_html_per_citation_page(soup) -> List[str]:
+    '''
+    Utility to query each page containing results for
+    cited work.
+    Parameters
+    --------
+    soup: Beautiful Soup object pointing to current page.
+    '''
+    citing_author_ids = []
+    citing_papers = []
+
+    for result in soup.find_all('div', class_='gs_ri'):
+        title_tag = result.find('h3', class_='gs_rt')
+        if title_tag:
+            byline = result.find('div', class_='gs_a')
+            _add_result(citing_author_ids, citing_papers, title_tag.get_text(),
+                        byline.text if byline else None,
+                        [link['href'] for link in result.find_all('a', href=True)])
+    return citing_author_ids, citing_papers
+
+
+def get_total_result_count(soup) -> Optional[int]:
+    '''
+    Parse the total number of results ("About 1,230 results (0.03 sec)") from a Scholar result page.
+    Returns None if the count is not shown.
+    '''
+    summary = soup.find('div', id='gs_ab_md')
+    return _parse_total_results(summary.get_text() if summary else None)
+
+
+class BeautifulSoupCitationPageParser(CitationPageParser):
+    '''
+    The original BeautifulSoup parser (pure-Python 'html.parser'): slowest, but needs no compiled dependency.
+    '''
+    name = 'bs4'
+
+    def parse(self, html: str) -> CitationPage:
+        soup = BeautifulSoup(html, 'html.parser')
+        citing_author_ids, citing_papers = get_html_per_citation_page(soup)
+        navigation_urls = {}
+        for navigation in soup.find_all('a', class_='gs_nma'):
+            page_number_str = navigation.text
+            if page_number_str and page_number_str.isnumeric() and navigation.get('href'):
+                navigation_urls.setdefault(int(page_number_str), SCHOLAR_BASE_URL + navigation['href'])
+        return CitationPage(citing_author_ids, citing_papers, get_total_result_count(soup), navigation_urls)
+
+
+def _class_xpath(tag: str, class_name: str) -> str:
+    return f"{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]"
+
+
+class LxmlCitationPageParser(CitationPageParser):
+    '''
+    libxml2-based parser. Only the `gs_ri` result blocks, the result count and the page navigation
+    are visited, through precompiled XPath expressions.
+    '''
+    name = 'lxml'
+
+    def __init__(self):
+        from lxml import etree, html as lxml_html
+        self._lxml_html = lxml_html
+        self._results = etree.XPath('//' + _class_xpath('div', 'gs_ri'))
+        self._title = etree.XPath('.//' + _class_xpath('h3', 'gs_rt'))
+        self._byline = etree.XPath('.//' + _class_xpath('div', 'gs_a'))
+        self._hrefs = etree.XPath('.//a/@href')
+        self._summary = etree.XPath("//div[@id='gs_ab_md']")
+        self._navigation = etree.XPath('//' + _class_xpath('a', 'gs_nma'))
+
+    def parse(self, html: str) -> CitationPage:
+        document = self._lxml_html.document_fromstring(html)
+        citing_author_ids, citing_papers = [], []
+        for result in self._results(document):
+            titles = self._title(result)
+            if not titles:
+                continue
+            bylines = self._byline(result)
+            _add_result(citing_author_ids, citing_papers, titles[0].text_content(),
+                        bylines[0].text_content() if bylines else None,
+                        [str(href) for href in self._hrefs(result)])
+
+        summaries = self._summary(document)
+        total_results = _parse_total_results(summaries[0].text_content() if summaries else None)
+
+        navigation_urls = {}
+        for navigation in self._navigation(document):
+            page_number_str = navigation.text_content()
+            if page_number_str and page_number_str.isnumeric() and navigation.get('href'):
+                navigation_urls.setdefault(int(page_number_str), SCHOLAR_BASE_URL + navigation.get('href'))
+        return CitationPage(citing_author_ids, citing_papers, total_results, navigation_urls)
+
+
+class FallbackCitationPageParser(CitationPageParser):
+    '''
+    Tries a fast backend first and re-parses with BeautifulSoup if it raises.
+    '''
+
+    def __init__(self, primary: CitationPageParser, fallback: Optional[CitationPageParser] = None):
+        self.primary = primary
+        self.fallback = fallback if fallback is not None else BeautifulSoupCitationPageParser()
+        self.name = f'{primary.name}+{self.fallback.name}'
+
+    def parse(self, html: str) -> CitationPage:
+        try:
+            return self.primary.parse(html)
+        except Exception as e:
+            print(f"[WARNING!] {self.primary.name} could not parse a Scholar page, falling back to {self.fallback.name}: {str(e)}")
+            return self.fallback.parse(html)
+
+
+PARSER_BACKENDS = {
+    'bs4': BeautifulSoupCitationPageParser,
+    'lxml': LxmlCitationPageParser,
+}
+
+
+def get_citation_page_parser(backend: Optional[str] = None) -> CitationPageParser:
+    '''
+    Parser for Scholar result pages. By default lxml (with the BeautifulSoup parser as fallback),
+    or BeautifulSoup alone if lxml is not installed.
+    '''
+    if backend is not None:
+        return PARSER_BACKENDS[backend]()
+    try:
+        return FallbackCitationPageParser(LxmlCitationPageParser())
+    except ImportError:
+        return BeautifulSoupCitationPageParser()
@@ -1,187 +1,109 @@
 # Copyright (c) 2024 Chen Liu
 # All rights reserved.
-import random
+import asyncio
 import requests
 import time
 from bs4 import BeautifulSoup
-from typing import List
+from typing import Hashable, List, Optional, Tuple
 
-NO_AUTHOR_FOUND_STR = 'No_author_found'
+from scripts.citation_map.async_fetch import SCHOLAR_JITTER_SECONDS, SCHOLAR_LIMITER, ScholarFetcher
+from scripts.citation_map.circuit_breaker import SCHOLAR_BREAKER, ScholarBlockedError, is_blocked_page
+from scripts.citation_map.http_fixtures import route_url
+from scripts.citation_map.proxy_pool import PROXY_CONNECT_TIMEOUT, SCHOLAR_PROXY_POOL
+from scripts.citation_map.scholar_parser import NO_AUTHOR_FOUND_STR, get_citation_page_parser
+
+# Google Scholar shows 10 results per page and never serves more than 1000 results per query.
+SCHOLAR_RESULTS_PER_PAGE = 10
+SCHOLAR_MAX_RESULTS = 1000
 
 # Create a session for persistent cookies
 session = requests.Session()
 
-# List of free proxies (you can add more)
-PROXY_LIST = [
-    None,  # Direct connection only for now
-    # Add working proxies here if available
-]
+# Parser backend for citation result pages (lxml with BeautifulSoup fallback when available).
+citation_page_parser = get_citation_page_parser()
 
-def rotate_proxy():
-    """Rotate to a different proxy"""
-    proxy = random.choice(PROXY_LIST)
+def rotate_proxy() -> Optional[str]:
+    """Pick the healthiest proxy from the pool (None means a direct connection)."""
+    proxy = SCHOLAR_PROXY_POOL.acquire()
     if proxy:
-        session.proxies = {'http': proxy, 'https': proxy}
         print(f"Using proxy: {proxy}")
-    else:
-        session.proxies = {}
-        print("Using direct connection")
+    return proxy
 
-def get_html_per_citation_page(soup) -> List[str]:
+async def fetch_citing_author_ids_and_citing_papers(fetcher: ScholarFetcher, cites_id: str,
+                                                    key: Hashable = None) -> Tuple[List[str], List[dict]]:
     '''
-    Utility to query each page containing results for
-    cited work.
+    Find the (Google Scholar IDs of authors, titles of papers) who cite a given paper on Google Scholar.
+    All pages are requested through `fetcher`, which enforces the shared rate limit.
+
     Parameters
     --------
-    soup: Beautiful Soup object pointing to current page.
+    fetcher: The shared asynchronous Scholar fetcher.
+    cites_id: The citation ID from Google Scholar.
+    key: Caller the requests are scheduled for by a fair fetcher, e.g. the applicant.
     '''
+    # Construct the URL for the citation page
+    paper_url = citation_page_url(cites_id)
+    html = await fetcher.fetch(paper_url, key)
+    if html is None:
+        return [], []
+
+    # The first page tells us how many results there are, so the remaining
+    # page URLs can be computed up front and fetched concurrently.
+    page = citation_page_parser.parse(html)
+    page_results = [(page.citing_author_ids, page.citing_papers)]
+    if page.total_results is not None:
+        remaining_urls = [citation_page_url(cites_id, start)
+                          for start in range(SCHOLAR_RESULTS_PER_PAGE, min(page.total_results, SCHOLAR_MAX_RESULTS), SCHOLAR_RESULTS_PER_PAGE)]
+        # `fetch_many` returns pages in request order, whatever order they were served in.
+        for page_html in await fetcher.fetch_many(remaining_urls, key):
+            if page_html is None:
+                continue
+            remaining_page = citation_page_parser.parse(page_html)
+            page_results.append((remaining_page.citing_author_ids, remaining_page.citing_papers))
+    else:
+        # Fall back to following the "next page" navigation button.
+        current_page_number = 1
+        while True:
+            next_url = page.next_page_url(current_page_number)
+            if next_url is None:
+                break
+            current_page_number += 1
+            page_html = await fetcher.fetch(next_url, key)
+            if page_html is None:
+                break
+            page = citation_page_parser.parse(page_html)
+            page_results.append((page.citing_author_ids, page.citing_papers))
+
     citing_author_ids = []
     citing_papers = []
-
-    for result in soup.find_all('div', class_='gs_ri'):
-        title_tag = result.find('h3', class_='gs_rt')
-        if title_tag:
-            paper_parsed = False
-            author_links = result.find_all('a', href=True)
-            title_text = title_tag.get_text()
-            title = title_text.replace('[HTML]', '').replace('[PDF]', '')
-            
-            # Get author name from the byline
-            byline = result.find('div', class_='gs_a')
-            author_name = byline.text.split('-')[0].strip() if byline else 'Unknown Author'
-            
-            for link in author_links:
-                if 'user=' in link['href']:
-                    author_id = link['href'].split('user=')[1].split('&')[0]
-                    citing_author_ids.append(author_id)
-                    citing_papers.append({'author': author_name, 'title': title})
-                    paper_parsed = True
-            if not paper_parsed:
-                print("[WARNING!] Could not find author links for ", title)
-                citing_author_ids.append(NO_AUTHOR_FOUND_STR)
-                citing_papers.append({'author': author_name, 'title': title})
-        else:
-            continue
+    for author_ids, papers in page_results:
+        citing_author_ids.extend(author_ids)
+        citing_papers.extend(papers)
     return citing_author_ids, citing_papers
 
 
-def get_citing_author_ids_and_citing_papers(cites_id: str) -> List[str]:
+def citation_page_url(cites_id: str, start: int = 0) -> str:
     '''
-    Find the (Google Scholar IDs of authors, titles of papers) who cite a given paper on Google Scholar.
+    URL of the citation result page for `cites_id` starting at result offset `start`.
+    '''
+    if start:
+        return f'https://scholar.google.com/scholar?start={start}&hl=en&cites={cites_id}'
+    return f'https://scholar.google.com/scholar?cites={cites_id}&hl=en'
+
+
+def get_citing_author_ids_and_citing_papers(cites_id: str) -> Tuple[List[str], List[dict]]:
+    '''
+    Synchronous wrapper around `fetch_citing_author_ids_and_citing_papers` with a private fetcher.
 
     Parameters
     --------
     cites_id: The citation ID from Google Scholar.
     '''
-    citing_author_ids = []
-    citing_papers = []
-
-    # Rotate proxy for this request
-    rotate_proxy()
-
-    headers = requests.utils.default_headers()
-    headers.update({
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
-        'Connection': 'keep-alive',
-        'Upgrade-Insecure-Requests': '1',
-        'Cache-Control': 'max-age=0',
-        'Sec-Fetch-Dest': 'document',
-        'Sec-Fetch-Mode': 'navigate',
-        'Sec-Fetch-Site': 'none',
-        'Sec-Fetch-User': '?1',
-    })
-
-    # Simulate human behavior: longer initial delay
-    time.sleep(random.uniform(3, 8))
+    async def _run():
+        async with ScholarFetcher() as fetcher:
+            return await fetch_citing_author_ids_and_citing_papers(fetcher, cites_id)
 
-    # Construct the URL for the citation page
-    paper_url = f'https://scholar.google.com/scholar?cites={cites_id}&hl=en'
-
-    # Try with exponential backoff
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            # Search the url of all citing papers.
-            response = session.get(paper_url, headers=headers, timeout=30)
-            if response.status_code != 200:
-                raise Exception('Failed to fetch the Google Scholar page')
-
-            # Get the HTML data.
-            soup = BeautifulSoup(response.text, 'html.parser')
-
-            # Check for common indicators of blocking
-            if 'CAPTCHA' in soup.text or 'not a robot' in soup.text:
-                print(f'[WARNING!] Blocked by CAPTCHA or robot check when searching {paper_url}. Attempt {attempt + 1}/{max_retries}')
-                if attempt < max_retries - 1:
-                    # Exponential backoff: wait longer each time
-                    wait_time = (2 ** attempt) * random.uniform(10, 20)
-                    print(f'Waiting {wait_time:.1f} seconds before retry...')
-                    time.sleep(wait_time)
-                    # Rotate proxy for next attempt
-                    rotate_proxy()
-                    continue
-                else:
-                    return [], []
-
-            if 'Access Denied' in soup.text or 'Forbidden' in soup.text:
-                print(f'[WARNING!] Access denied or forbidden when searching {paper_url}. Attempt {attempt + 1}/{max_retries}')
-                if attempt < max_retries - 1:
-                    wait_time = (2 ** attempt) * random.uniform(10, 20)
-                    print(f'Waiting {wait_time:.1f} seconds before retry...')
-                    time.sleep(wait_time)
-                    # Rotate proxy for next attempt
-                    rotate_proxy()
-                    continue
-                else:
-                    return [], []
-
-            # If we get here, the request was successful
-            break
-
-        except Exception as e:
-            print(f'[ERROR!] Exception on attempt {attempt + 1}: {str(e)}')
-            if attempt < max_retries - 1:
-                wait_time = (2 ** attempt) * random.uniform(5, 15)
-                print(f'Waiting {wait_time:.1f} seconds before retry...')
-                time.sleep(wait_time)
-                # Rotate proxy for next attempt
-                rotate_proxy()
-                continue
-            else:
-                return [], []
-
-    # Loop through the citation results and find citing authors and papers.
-    current_page_number = 1
-    author_ids, papers = get_html_per_citation_page(soup)
-    citing_author_ids.extend(author_ids)
-    citing_papers.extend(papers)
-
-    # Find the page navigation.
-    navigation_buttons = soup.find_all('a', class_='gs_nma')
-    for navigation in navigation_buttons:
-        page_number_str = navigation.text
-        if page_number_str and page_number_str.isnumeric() and int(page_number_str) == current_page_number + 1:
-            # Found the correct button for next page.
-            current_page_number += 1
-            next_url = 'https://scholar.google.com' + navigation['href']
-            
-            # Simulate human reading time
-            time.sleep(random.uniform(5, 10))  # Longer delay between pages
-
-            response = session.get(next_url, headers=headers, timeout=30)
-            if response.status_code != 200:
-                break
-            soup = BeautifulSoup(response.text, 'html.parser')
-            author_ids, papers = get_html_per_citation_page(soup)
-            citing_author_ids.extend(author_ids)
-            citing_papers.extend(papers)
-        else:
-            continue
-
-    return citing_author_ids, citing_papers
+    return asyncio.run(_run())
 
 def get_organization_name(organization_id: str) -> str:
     '''
@@ -195,15 +117,38 @@ def get_organization_name(organization_id: str) -> str:
 
     url = f'https://scholar.google.com/citations?view_op=view_org&org={organization_id}&hl=en'
 
-    time.sleep(random.uniform(1, 5))  # Random delay to reduce risk of being blocked.
-
-    response = requests.get(url, headers=headers)
-
-    if response.status_code != 200:
-        raise Exception(f'When getting organization name, failed to fetch {url}: {response.text}.')
+    SCHOLAR_BREAKER.wait()
+    # From here on this call may hold the breaker's half-open probe slot: any exit that records neither
+    # a success nor a block (errors, KeyboardInterrupt, ...) must give it back.
+    outcome_recorded = False
+    try:
+        SCHOLAR_LIMITER.wait(jitter=SCHOLAR_JITTER_SECONDS)
+        proxy = rotate_proxy()
+        proxies = {'http': proxy, 'https': proxy} if proxy else None
+        start_time = time.monotonic()
+        try:
+            response = session.get(route_url(url), headers=headers, proxies=proxies, timeout=(PROXY_CONNECT_TIMEOUT, 30))
+        except requests.RequestException:
+            SCHOLAR_PROXY_POOL.report_failure(proxy)
+            raise
+
+        if is_blocked_page(response.text, response.status_code, response.url):
+            SCHOLAR_BREAKER.record_block(reason=f'HTTP {response.status_code} for {url}')
+            outcome_recorded = True
+            SCHOLAR_PROXY_POOL.report_block(proxy)
+            raise ScholarBlockedError(f'When getting organization name, blocked by Google Scholar at {url}.')
+        if response.status_code != 200:
+            SCHOLAR_PROXY_POOL.report_failure(proxy)
+            raise Exception(f'When getting organization name, failed to fetch {url}: {response.text}.')
+        SCHOLAR_BREAKER.record_success()
+        outcome_recorded = True
+        SCHOLAR_PROXY_POOL.report_success(proxy, time.monotonic() - start_time)
+    finally:
+        if not outcome_recorded:
+            SCHOLAR_BREAKER.record_failure()
 
     soup = BeautifulSoup(response.text, 'html.parser')
     tag = soup.find('h2', {'class': 'gsc_authors_header'})
     if not tag:
         raise Exception(f'When getting organization name, failed to parse {url}.')
-    return tag.text.replace('Learn more', '').strip()
\ No newline at end of file
+    return tag.text.replace('Learn more', '').strip()
@@ -0,0 +1,225 @@
+"""
+Pool of warm headless Chrome browsers for the email scraper.
+
+Starting Chrome takes seconds, so instead of one browser per Google Scholar profile, callers check a
+browser out of the pool for each profile and give it back afterwards. Browsers are health-checked on
+every checkout, recycled after a number of page loads (Chrome's memory grows with every page), and
+always quit when the pool is closed, including on errors and at interpreter exit.
+
+    with DriverPool(size=4) as pool:
+        with pool.checkout() as driver:
+            driver.get(url)
+"""
+
+import atexit
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+
+# Page loads after which a browser is replaced.
+DEFAULT_MAX_PAGES_PER_DRIVER = 50
+DEFAULT_PAGE_LOAD_TIMEOUT = 30
+
+
+def create_headless_chrome(page_load_timeout: float = DEFAULT_PAGE_LOAD_TIMEOUT) -> webdriver.Chrome:
+    """
+    Start one headless Chrome with images disabled (the scraper only reads text and links).
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless=new')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    driver = webdriver.Chrome(service=Service(), options=options)
+    driver.set_page_load_timeout(page_load_timeout)
+    return driver
+
+
+class PooledDriver:
+    """
+    A pooled browser. Behaves like the wrapped webdriver and counts the pages loaded with `get`.
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.num_pages = 0
+
+    def get(self, url: str) -> None:
+        self.num_pages += 1
+        self.driver.get(url)
+
+    def __getattr__(self, name):
+        return getattr(self.driver, name)
+
+
+def _quit_driver(driver) -> None:
+    try:
+        driver.quit()
+    except Exception as e:
+        print(f"[WARNING!] Could not quit Chrome cleanly, killing it: {str(e)}")
+        process = getattr(getattr(driver, 'service', None), 'process', None)
+        if process is not None:
+            process.kill()
+
+
+def _is_healthy(pooled_driver: PooledDriver) -> bool:
+    process = getattr(getattr(pooled_driver.driver, 'service', None), 'process', None)
+    if process is not None and process.poll() is not None:
+        return False
+    try:
+        pooled_driver.driver.execute_script('return 1')
+        return True
+    except Exception:
+        return False
+
+
+class DriverPool:
+    """
+    Thread-safe pool of up to `size` headless Chrome browsers.
+
+    Parameters
+    --------
+    size: Number of browsers; also the number of profiles that can be scraped at the same time.
+    max_pages_per_driver: Page loads after which a browser is quit and replaced.
+    driver_factory: Starts one browser; `create_headless_chrome` by default.
+    warm: Start all browsers (in parallel) when the pool is created instead of on first use.
+    """
+
+    def __init__(self,
+                 size: int = 2,
+                 max_pages_per_driver: int = DEFAULT_MAX_PAGES_PER_DRIVER,
+                 driver_factory: Optional[Callable[[], object]] = None,
+                 warm: bool = True):
+        self.size = size
+        self.max_pages_per_driver = max_pages_per_driver
+        self.driver_factory = driver_factory if driver_factory is not None else create_headless_chrome
+        self._condition = threading.Condition()
+        self._idle = []
+        self._num_drivers = 0  # Started browsers, idle or checked out.
+        self._closed = False
+        self.stats = {'started': 0, 'recycled': 0, 'unhealthy': 0, 'checkouts': 0}
+        atexit.register(self.close)
+        if warm:
+            with ThreadPoolExecutor(max_workers=size) as executor:
+                for pooled_driver in executor.map(self._start_driver_quietly, range(size)):
+                    if pooled_driver is not None:
+                        self._put_idle(pooled_driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _start_driver(self) -> PooledDriver:
+        # The caller has already counted this browser in `_num_drivers`.
+        try:
+            pooled_driver = PooledDriver(self.driver_factory())
+        except BaseException:
+            with self._condition:
+                self._num_drivers -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self.stats['started'] += 1
+        return pooled_driver
+
+    def _start_driver_quietly(self, _=None) -> Optional[PooledDriver]:
+        # Warm start: a browser that fails to start here is retried on first use.
+        with self._condition:
+            self._num_drivers += 1
+        try:
+            return self._start_driver()
+        except Exception as e:
+            print(f"[WARNING!] Could not start Chrome for the driver pool: {str(e)}")
+            return None
+
+    def _put_idle(self, pooled_driver: PooledDriver) -> None:
+        with self._condition:
+            self._idle.append(pooled_driver)
+            self._condition.notify()
+
+    def _discard(self, pooled_driver: PooledDriver) -> None:
+        _quit_driver(pooled_driver.driver)
+        with self._condition:
+            self._num_drivers -= 1
+            self._condition.notify()
+
+    def _acquire(self, timeout: Optional[float]) -> PooledDriver:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        raise RuntimeError('The driver pool is closed.')
+                    if self._idle:
+                        pooled_driver = self._idle.pop()
+                        break
+                    if self._num_drivers < self.size:
+                        # Start another browser (outside the lock) since the pool is not full yet.
+                        self._num_drivers += 1
+                        pooled_driver = None
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f'No browser became available within {timeout} seconds.')
+                    self._condition.wait(remaining)
+            if pooled_driver is None:
+                return self._start_driver()
+            if _is_healthy(pooled_driver):
+                return pooled_driver
+            with self._condition:
+                self.stats['unhealthy'] += 1
+            self._discard(pooled_driver)
+
+    def _release(self, pooled_driver: PooledDriver, failed: bool) -> None:
+        if self._closed or pooled_driver.num_pages >= self.max_pages_per_driver or (failed and not _is_healthy(pooled_driver)):
+            if not self._closed:
+                with self._condition:
+                    self.stats['recycled'] += 1
+            self._discard(pooled_driver)
+            return
+        try:
+            # Drop the last page (and its memory) and the profile's cookies before the next caller.
+            pooled_driver.driver.delete_all_cookies()
+            pooled_driver.driver.get('about:blank')
+        except Exception:
+            self._discard(pooled_driver)
+            return
+        self._put_idle(pooled_driver)
+
+    @contextlib.contextmanager
+    def checkout(self, timeout: Optional[float] = None):
+        """
+        Check a healthy browser out for the duration of the `with` block.
+        Raises `TimeoutError` if none is available within `timeout` seconds.
+        """
+        pooled_driver = self._acquire(timeout)
+        with self._condition:
+            self.stats['checkouts'] += 1
+        failed = True
+        try:
+            yield pooled_driver
+            failed = False
+        finally:
+            self._release(pooled_driver, failed)
+
+    def close(self) -> None:
+        """
+        Quit every idle browser. Browsers still checked out are quit when they are returned.
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._condition.notify_all()
+        for pooled_driver in idle:
+            self._discard(pooled_driver)
+        atexit.unregister(self.close)
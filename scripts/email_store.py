@@ -0,0 +1,167 @@
+"""
+Persistent cache of the emails discovered for citing authors, backed by SQLite.
+
+Every discovery is stored twice: under the author's Google Scholar profile and under the homepage it
+links to, so a profile whose homepage was already crawled (e.g. a second Scholar account of the same
+author) only costs the Scholar profile request. Profiles without an email are cached too, with a
+shorter TTL, and `refresh=True` (`--refresh-emails`) bypasses the cache while still updating it.
+The emails found in CV PDFs are also kept, keyed by URL and ETag, so an unchanged CV is not downloaded again.
+
+    store = EmailStore()
+    discovery = store.get(profile_url)  # EmailDiscovery or None
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+import config
+
+EMAIL_DB_PATH = os.path.join(config.CACHE_PATH, 'email_cache.sqlite3')
+
+# Profiles without an email are scraped again after two weeks; found emails are kept for six months.
+POSITIVE_TTL_SECONDS = 180 * 24 * 3600
+NEGATIVE_TTL_SECONDS = 14 * 24 * 3600
+
+# Where an email was found: the homepage itself, one of its tabs, or a CV PDF.
+EMAIL_SOURCES = ('homepage', 'tab', 'cv_pdf')
+
+# Result of scraping one profile. `source` is where the first email was found, `updated_at` when it was
+# scraped, and `from_cache` tells whether it was served by the store. `error` is None, or 'blocked' / 'error'
+# when the scrape failed (such discoveries are never stored).
+EmailDiscovery = namedtuple('EmailDiscovery', ['emails', 'homepage_url', 'source', 'updated_at', 'from_cache', 'error'],
+                            defaults=(None,))
+
+
+def profile_key(profile_url):
+    """
+    Cache key of a Google Scholar profile: its `user` ID, whatever the other query parameters are.
+    """
+    user_ids = parse_qs(urlsplit(profile_url).query).get('user')
+    return 'profile:' + (user_ids[0] if user_ids else profile_url.strip())
+
+
+def homepage_key(homepage_url):
+    """
+    Cache key of a homepage: scheme and host case-folded, fragment and trailing slash removed.
+    """
+    parts = urlsplit(homepage_url.strip())
+    return 'homepage:' + urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+
+
+class EmailStore:
+    """
+    Persistent email cache keyed by Scholar profile and by homepage URL, plus the emails of CV PDFs
+    keyed by URL and ETag (revalidated on every use, so they have no TTL).
+
+    Like the geocode cache, every `put` is committed immediately and the database runs in WAL mode,
+    so concurrent runs (and the enrichment threads of one run) can share it.
+    """
+
+    def __init__(self,
+                 db_path=EMAIL_DB_PATH,
+                 positive_ttl=POSITIVE_TTL_SECONDS,
+                 negative_ttl=NEGATIVE_TTL_SECONDS):
+        self.db_path = db_path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS email (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    homepage_url TEXT,
+                    emails TEXT NOT NULL,
+                    source TEXT,
+                    found INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                )''')
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS pdf (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT NOT NULL,
+                    emails TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )''')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self, key):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT homepage_url, emails, source, found, updated_at FROM email WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        homepage_url, emails, source, found, updated_at = row
+        ttl = self.positive_ttl if found else self.negative_ttl
+        if time.time() - updated_at > ttl:
+            return None
+        return EmailDiscovery(json.loads(emails), homepage_url, source, updated_at, True)
+
+    def get(self, profile_url) -> Optional[EmailDiscovery]:
+        """
+        Cached discovery for a Scholar profile, or None if it is unknown or expired.
+        """
+        return self._get(profile_key(profile_url))
+
+    def get_homepage(self, homepage_url) -> Optional[EmailDiscovery]:
+        """
+        Cached discovery for a homepage, whichever profile it was reached from, or None.
+        """
+        return self._get(homepage_key(homepage_url))
+
+    def put(self, profile_url, discovery: EmailDiscovery) -> None:
+        """
+        Store the discovery of one profile, under the profile and (if it has one) its homepage.
+        """
+        rows = [(profile_key(profile_url), profile_url)]
+        if discovery.homepage_url:
+            rows.append((homepage_key(discovery.homepage_url), discovery.homepage_url))
+        values = (discovery.homepage_url, json.dumps(list(discovery.emails)), discovery.source,
+                  int(bool(discovery.emails)), discovery.updated_at)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT INTO email (key, url, homepage_url, emails, source, found, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET url = excluded.url, homepage_url = excluded.homepage_url, '
+                'emails = excluded.emails, source = excluded.source, found = excluded.found, '
+                'updated_at = excluded.updated_at',
+                [(key, url, *values) for key, url in rows])
+
+    def get_pdf(self, pdf_url) -> Optional[Tuple[str, list]]:
+        """
+        (ETag, emails) of the last download of a PDF, or None if it was never cached.
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT etag, emails FROM pdf WHERE url = ?', (pdf_url,)).fetchone()
+        return None if row is None else (row[0], json.loads(row[1]))
+
+    def put_pdf(self, pdf_url, etag, emails) -> None:
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT INTO pdf (url, etag, emails, updated_at) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, emails = excluded.emails, '
+                'updated_at = excluded.updated_at',
+                (pdf_url, etag, json.dumps(list(emails)), time.time()))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM email WHERE key LIKE 'profile:%'").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
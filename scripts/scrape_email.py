@@ -1,15 +1,96 @@
-from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from bs4 import BeautifulSoup
+import contextlib
 import re
+import threading
 import time
-from urllib.parse import urljoin  # For combining base and relative URLs
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urldefrag, urljoin, urlsplit  # For combining base and relative URLs
 import requests
+from requests.adapters import HTTPAdapter
 import io
 import PyPDF2  # For extracting text from PDFs
+try:
+    import pymupdf  # PyMuPDF: much faster text extraction than PyPDF2, which is used when it is not installed
+except ImportError:
+    pymupdf = None
+
+from scripts.citation_map.async_fetch import SCHOLAR_JITTER_SECONDS, SCHOLAR_LIMITER
+from scripts.citation_map.circuit_breaker import BLOCK_STATUSES, OPEN, SCHOLAR_BREAKER, ScholarBlockedError, is_blocked_page
+from scripts.citation_map.http_fixtures import route_url
+from scripts.citation_map.metrics import url_host
+from scripts.driver_pool import DriverPool
+from scripts.email_store import EmailDiscovery
+
+# Most academic homepages are static HTML, so pages are fetched with plain HTTP first and a browser is
+# only checked out when a page is clearly rendered by JavaScript or has no email in its raw HTML.
+HTTP_TIMEOUT = 10
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+# Classes of the homepage tab links, the same elements the browser crawler clicks through.
+TAB_LINK_CLASSES = ('aJHbb', 'tab', 'nav-link')
+HOMEPAGE_LINK_XPATH = "//a[contains(@class, 'gsc_prf_ila') and contains(text(), 'Homepage')]"
+# Pages with less visible text than this (after removing scripts) and any script are treated as JS-rendered.
+MIN_STATIC_TEXT_LENGTH = 200
+JS_APP_ROOT_IDS = ('root', 'app', '__next', '__nuxt')
+# CV PDFs: larger downloads are abandoned, and only the first pages are searched (emails are nearly always on page 1).
+MAX_PDF_BYTES = 10 * 1024 * 1024
+MAX_PDF_PAGES = 2
+PDF_CHUNK_BYTES = 64 * 1024
+# Per-site crawl limits: pages fetched (homepage included), link depth from the homepage, and tabs fetched at once.
+MAX_PAGES_PER_SITE = 12
+MAX_CRAWL_DEPTH = 2
+CRAWL_WORKERS = 4
+
+# Concurrent page fetches allowed per host; Google Scholar is also rate limited (replacing a fixed 2 s pause per profile),
+# by the same token bucket as the rest of the pipeline's Scholar requests
+MAX_REQUESTS_PER_HOST = 2
+HOST_LIMITERS = {'scholar.google.com': SCHOLAR_LIMITER}
+HOST_JITTER = {'scholar.google.com': SCHOLAR_JITTER_SECONDS}
+
+# Caps concurrent fetches per host and rate-limits the hosts in `limiters` (host -> TokenBucket), across all
+# threads, so many profiles can be scraped at once without hammering Google Scholar or any author's web server.
+class HostThrottle:
+    def __init__(self, max_per_host=MAX_REQUESTS_PER_HOST, limiters=None, jitter=None):
+        self.max_per_host = max_per_host
+        self.limiters = dict(HOST_LIMITERS if limiters is None else limiters)
+        self.jitter = dict(HOST_JITTER if jitter is None else jitter)
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def _for_host(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._semaphores[host]
+
+    @contextlib.contextmanager
+    def slot(self, url):
+        host = urlsplit(url).netloc.lower()
+        with self._for_host(host):
+            limiter = self.limiters.get(host)
+            if limiter is not None:
+                limiter.wait(jitter=self.jitter.get(host, 0.0))
+            yield
+
+host_throttle = HostThrottle()
+
+# Function to create the pooled HTTP client shared by all profiles (keep-alive connections per host)
+def create_http_session(pool_maxsize=32):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(HTTP_HEADERS)
+    return session
+
+http_session = create_http_session()
 
 # Function to extract email addresses from a webpage
 def extract_emails(text):
@@ -29,69 +110,310 @@ def extract_emails(text):
     all_emails = standard_emails #+ email_keyword_matches + mailto_emails
     return all_emails
 
-# Function to extract text from a PDF URL
-def extract_text_from_pdf(pdf_url):
-    try:
-        # Download the PDF content
-        response = requests.get(pdf_url)
-        response.raise_for_status()
-
-        # Stream the PDF content
-        with io.BytesIO(response.content) as pdf_file:
-            reader = PyPDF2.PdfReader(pdf_file)
-            text = ""
-            for page in reader.pages:
-                text += page.extract_text()
-        return text
-    except Exception as e:
-        print(f"Error extracting text from PDF {pdf_url}: {e}")
-        return ""
-
-# Function to analyze a webpage for email addresses
-def analyze_page(driver):
+# Function to read a streamed PDF response, up to `max_bytes` (None if the PDF is larger)
+def read_pdf_body(response, max_bytes=MAX_PDF_BYTES):
+    content_length = response.headers.get('Content-Length', '')
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        return None
+    body = bytearray()
+    for chunk in response.iter_content(PDF_CHUNK_BYTES):
+        body += chunk
+        if len(body) > max_bytes:
+            return None
+    return bytes(body)
+
+# Function to find the emails in the first `max_pages` pages of a PDF, stopping at the first page that has one
+def extract_emails_from_pdf_bytes(pdf_bytes, max_pages=MAX_PDF_PAGES):
+    if pymupdf is not None:
+        with pymupdf.open(stream=pdf_bytes, filetype='pdf') as document:
+            for page_number in range(min(max_pages, document.page_count)):
+                emails = extract_emails(document[page_number].get_text())
+                if emails:
+                    return emails
+        return []
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    for page in reader.pages[:max_pages]:
+        emails = extract_emails(page.extract_text() or '')
+        if emails:
+            return emails
+    return []
+
+# Function to find the emails in a PDF (e.g. a CV) from its URL. The download is streamed and abandoned
+# past MAX_PDF_BYTES, and only the first pages are searched. With `pdf_cache` (an EmailStore), the result
+# is kept by URL and ETag, and an unchanged PDF is not downloaded again. `response` is a streamed response
+# for `pdf_url` that was already requested. The download's HTTP status is recorded in `metrics` (a MetricsCollector).
+def extract_emails_from_pdf(pdf_url, session=None, pdf_cache=None, response=None, metrics=None):
+    session = session if session is not None else http_session
+    cached_pdf = pdf_cache.get_pdf(pdf_url) if pdf_cache is not None else None
     try:
-        # Get the page source and parse it with BeautifulSoup
-        page_source = driver.page_source
-        soup = BeautifulSoup(page_source, 'html.parser')
-
-        # Extract all text from the page
-        page_text = soup.get_text()
-
-        # Find email addresses in the text
-        emails = extract_emails(page_text)
-
-        # Find mailto links in the HTML
-        mailto_links = soup.find_all('a', href=lambda href: href and href.startswith('mailto:'))
-        for link in mailto_links:
-            email = link['href'].replace('mailto:', '')
-            emails.append(email)
-
+        if response is None:
+            headers = {'If-None-Match': cached_pdf[0]} if cached_pdf is not None else {}
+            try:
+                with host_throttle.slot(pdf_url):
+                    response = session.get(route_url(pdf_url), headers=headers, stream=True, timeout=HTTP_TIMEOUT)
+            except Exception as e:
+                if metrics is not None:
+                    metrics.record_http(url_host(pdf_url), type(e).__name__)
+                raise
+            if metrics is not None:
+                metrics.record_http(url_host(pdf_url), response.status_code)
+        with response:
+            etag = response.headers.get('ETag')
+            if cached_pdf is not None and (response.status_code == 304 or etag == cached_pdf[0]):
+                return cached_pdf[1]
+            response.raise_for_status()
+            pdf_bytes = read_pdf_body(response)
+        if pdf_bytes is None:
+            print(f"Skipping PDF {pdf_url}: larger than {MAX_PDF_BYTES // (1024 * 1024)} MB")
+            return []
+        emails = extract_emails_from_pdf_bytes(pdf_bytes)
+        if pdf_cache is not None and etag:
+            pdf_cache.put_pdf(pdf_url, etag, emails)
         return emails
     except Exception as e:
-        print(f"Error analyzing page: {e}")
+        print(f"Error extracting text from PDF {pdf_url}: {e}")
         return []
 
-# Function to process CV (PDF) and extract emails
-def process_cv(driver, tab_name, full_url):
+# Function to record where each new email was found (`found` maps email -> source, in discovery order)
+def add_emails(found, emails, source):
+    for email in emails:
+        found.setdefault(email, source)
+
+# Function to find email addresses and mailto links in the HTML of a page
+def extract_emails_from_html(html):
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # Find email addresses in the text
+    emails = extract_emails(soup.get_text())
+
+    # Find mailto links in the HTML
+    mailto_links = soup.find_all('a', href=lambda href: href and href.startswith('mailto:'))
+    for link in mailto_links:
+        email = link['href'].replace('mailto:', '').split('?')[0]
+        emails.append(email)
+
+    return emails
+
+# Function to decide whether a page's raw HTML is only a shell that JavaScript fills in
+def is_js_rendered(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    if not soup.find('script'):
+        return False
+    for noscript in soup.find_all('noscript'):
+        if 'javascript' in noscript.get_text().lower():
+            return True
+    for root_id in JS_APP_ROOT_IDS:
+        root = soup.find(id=root_id)
+        if root is not None and not root.get_text(strip=True):
+            return True
+    for element in soup(['script', 'style', 'noscript', 'template']):
+        element.decompose()
+    return len(soup.get_text(' ', strip=True)) < MIN_STATIC_TEXT_LENGTH
+
+# Function to fetch a page over HTTP; returns (final URL, content type, response) or None on failure.
+# The body is streamed: it is read by `response.text`, or in bounded chunks for PDFs.
+def fetch_page(url, session=None, throttle=None, metrics=None):
+    return fetch_page_with_status(url, session, throttle, metrics)[0]
+
+# Same as `fetch_page`, but returns (page or None, HTTP status), so callers can tell an error status
+# (e.g. 404, or 429 when blocked) from a network failure (status None).
+# With `metrics` (a MetricsCollector), the status (or exception name) is recorded per host, and 403/429 as a CAPTCHA.
+def fetch_page_with_status(url, session=None, throttle=None, metrics=None):
+    session = session if session is not None else http_session
+    throttle = throttle if throttle is not None else host_throttle
+    response = None
     try:
-        print(f"Checking CV file on tab: {tab_name}")
-        
-        # Locate the iframe containing the PDF
-        iframe = driver.find_element(By.XPATH, "//iframe[contains(@src, 'drive.google.com')]")
-        pdf_url = iframe.get_attribute('src')
-
-        # Extract the download URL from the parent element
-        pdf_download_url = driver.find_element(By.XPATH, "//div[@data-embed-download-url]").get_attribute('data-embed-download-url')
-        print(f"Found PDF download URL: {pdf_download_url}")
-
-        # Extract text from the PDF
-        pdf_text = extract_text_from_pdf(pdf_download_url)
-        print('Extracting email from CV PDF.....')
-        pdf_emails = extract_emails(pdf_text)
-        return pdf_emails
+        with throttle.slot(url):
+            response = session.get(route_url(url), timeout=HTTP_TIMEOUT, stream=True)
+        response.raise_for_status()
     except Exception as e:
-        print(f"Error extracting text from CV: {e}")
-        return []
+        status = None
+        if response is not None:
+            status = response.status_code
+            response.close()
+        if metrics is not None:
+            metrics.record_http(url_host(url), status if status is not None else type(e).__name__)
+            if status in BLOCK_STATUSES:
+                metrics.record_captcha(url_host(url))
+        print(f"Error fetching {url} over HTTP: {e}")
+        return None, status
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    # Redirects are followed on the routed URL, so relative links resolve against the original one.
+    final_url = url if route_url(url) != url else response.url
+    if metrics is not None:
+        metrics.record_http(url_host(url), response.status_code)
+    return (final_url, content_type, response), response.status_code
+
+# Function to turn a link into the absolute URL it points to, without fragment (None for non-web links)
+def normalize_link(base_url, href):
+    full_url = urldefrag(urljoin(base_url, href.strip()))[0]
+    return full_url if full_url.startswith(('http://', 'https://')) else None
+
+# Function to find the tab links of a homepage in its HTML, as (tab name, absolute URL) without duplicates
+def find_tab_links(html, base_url):
+    soup = BeautifulSoup(html, 'html.parser')
+    tab_links = []
+    # Case 1: Tabs inside <div class="menu">
+    for menu in soup.find_all(lambda tag: tag.name == 'div' and tag.get('class') == ['menu']):
+        tab_links.extend(menu.find_all('a'))
+    # Case 2: Tabs with specific classes
+    for link in soup.find_all('a', class_=True):
+        class_attribute = ' '.join(link.get('class'))
+        if any(tab_class in class_attribute for tab_class in TAB_LINK_CLASSES):
+            tab_links.append(link)
+    tabs = {}
+    for link in tab_links:
+        full_url = normalize_link(base_url, link.get('href') or '')
+        if full_url is not None and full_url not in tabs:
+            tabs[full_url] = link.get_text().strip()
+    return [(tab_name, full_url) for full_url, tab_name in tabs.items()]
+
+# Function to find the download URL of a CV embedded from Google Drive in raw HTML
+def find_embedded_pdf_url(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    embed = soup.find(attrs={'data-embed-download-url': True})
+    return embed['data-embed-download-url'] if embed is not None else None
+
+# Function to find the emails of one tab page from its HTML (and its embedded CV, for CV tabs)
+def analyze_tab_html(tab_name, html, session=None, pdf_cache=None, metrics=None):
+    emails = dict.fromkeys(extract_emails_from_html(html), 'tab')
+    if "cv" in tab_name.lower():
+        pdf_download_url = find_embedded_pdf_url(html)
+        if pdf_download_url:
+            print(f"Found PDF download URL: {pdf_download_url}")
+            add_emails(emails, extract_emails_from_pdf(pdf_download_url, session, pdf_cache, metrics=metrics), 'cv_pdf')
+    return emails
+
+# Function to crawl one tab over HTTP; returns (emails, HTML to follow links from, page URL, needs_browser).
+# Only pages rendered by JavaScript or blocked (403/429, CAPTCHA) need the browser; other failures, such as
+# a 404 or a timeout, would fail in the browser too, so the link is dropped.
+def crawl_tab_http(tab_name, full_url, session=None, pdf_cache=None, metrics=None):
+    print(f"Crawling tab over HTTP: {tab_name} ({full_url})")
+    page, status = fetch_page_with_status(full_url, session, metrics=metrics)
+    if page is None:
+        return {}, None, full_url, status in BLOCK_STATUSES
+    final_url, content_type, response = page
+    if content_type == 'application/pdf':
+        tab_emails = extract_emails_from_pdf(full_url, session, pdf_cache, response, metrics)
+        return dict.fromkeys(tab_emails, 'cv_pdf'), None, final_url, False
+    html = response.text
+    if is_blocked_page(html, status, str(response.url)):
+        if metrics is not None:
+            metrics.record_captcha(url_host(full_url))
+        return {}, None, final_url, True
+    if is_js_rendered(html):
+        return {}, None, final_url, True
+    return analyze_tab_html(tab_name, html, session, pdf_cache, metrics), html, final_url, False
+
+# Function to crawl the tabs of a homepage, level by level up to `max_depth` links away and `max_pages` pages
+# in total (the homepage included). The tab links of each level are collected once from the pages of the
+# previous level, deduplicated, and fetched over HTTP `CRAWL_WORKERS` at a time. Tabs that need a browser
+# are passed to `render` (tab URL -> rendered HTML) one at a time, or skipped without one.
+# Links are only followed from pages on the homepage's site. Emails are added to `emails`;
+# `visited` (URLs already crawled) is updated with every tab fetched. `pdf_cache` is passed to
+# `extract_emails_from_pdf`, and HTTP statuses are recorded in `metrics`.
+def crawl_tabs(homepage_html, homepage_url, emails, visited, session=None, render=None, pdf_cache=None,
+               max_pages=MAX_PAGES_PER_SITE, max_depth=MAX_CRAWL_DEPTH, metrics=None):
+    site = urlsplit(homepage_url).netloc.lower()
+    num_pages = 1
+    frontier = [(homepage_html, homepage_url)]
+    with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as executor:
+        for depth in range(1, max_depth + 1):
+            # Snapshot every new tab link of this level before fetching any of them
+            tabs = {}
+            for html, page_url in frontier:
+                if urlsplit(page_url).netloc.lower() != site:
+                    continue
+                for tab_name, full_url in find_tab_links(html, page_url):
+                    if full_url not in visited and full_url not in tabs:
+                        tabs[full_url] = tab_name
+            tabs = list(tabs.items())[:max(0, max_pages - num_pages)]
+            if not tabs:
+                break
+            print(f"Found {len(tabs)} tabs to crawl at depth {depth}.")
+            num_pages += len(tabs)
+            visited.update(full_url for full_url, _ in tabs)
+
+            frontier = []
+            results = executor.map(lambda tab: crawl_tab_http(tab[1], tab[0], session, pdf_cache, metrics), tabs)
+            for (full_url, tab_name), (tab_emails, html, page_url, needs_browser) in zip(tabs, results):
+                if needs_browser and render is None:
+                    # Left for the browser crawler
+                    visited.discard(full_url)
+                    continue
+                if needs_browser:
+                    try:
+                        html = render(full_url)
+                        tab_emails = analyze_tab_html(tab_name, html, session, pdf_cache, metrics)
+                    except Exception as e:
+                        print(f"Error crawling tab {tab_name}: {e}")
+                        continue
+                for email, source in tab_emails.items():
+                    emails.setdefault(email, source)
+                if html is not None:
+                    frontier.append((html, page_url))
+    return emails
+
+# Function to crawl a homepage and its tabs over HTTP only.
+# Returns (emails, needs_browser): emails maps each email to its source ('homepage', 'tab' or 'cv_pdf'),
+# needs_browser is True when the browser crawler should take over.
+# Pages crawled here are added to `visited` unless they need the browser.
+def crawl_homepage_http(homepage_url, session=None, visited=None, pdf_cache=None, metrics=None):
+    visited = visited if visited is not None else set()
+    page = fetch_page(homepage_url, session, metrics=metrics)
+    if page is None:
+        return {}, True
+    final_url, content_type, response = page
+    print(f"Crawling homepage over HTTP: {homepage_url}")
+
+    # A homepage that is a PDF (e.g. a CV) needs no browser either
+    if content_type == 'application/pdf':
+        return dict.fromkeys(extract_emails_from_pdf(homepage_url, session, pdf_cache, response, metrics), 'cv_pdf'), False
+    html = response.text
+    if is_js_rendered(html):
+        print(f"Homepage {homepage_url} is rendered by JavaScript.")
+        return {}, True
+
+    emails = dict.fromkeys(extract_emails_from_html(html), 'homepage')
+    visited.update({normalize_link(homepage_url, homepage_url), normalize_link(final_url, final_url)})
+    crawl_tabs(html, final_url, emails, visited, session, pdf_cache=pdf_cache, metrics=metrics)
+    return emails, not emails
+
+# Function to find the homepage link of a Google Scholar profile over HTTP.
+# Returns (homepage URL or None, whether the profile was read). The profile was not read when it could not
+# be fetched or Scholar served a CAPTCHA instead; otherwise a None homepage means the profile has no link.
+# The request goes through `SCHOLAR_BREAKER`, like every other Scholar request: it waits while the circuit is
+# open, and a CAPTCHA opens it for the whole pipeline.
+def find_homepage_url_http(profile_url, session=None, metrics=None):
+    SCHOLAR_BREAKER.wait()
+    # Any exit that records neither a success nor a block gives back a half-open probe slot
+    outcome_recorded = False
+    try:
+        page, status = fetch_page_with_status(profile_url, session, metrics=metrics)
+        if page is None:
+            if status in BLOCK_STATUSES:
+                SCHOLAR_BREAKER.record_block(reason=f'HTTP {status} for {profile_url}')
+                outcome_recorded = True
+            return None, False
+        final_url, _, response = page
+        html = response.text
+        if is_blocked_page(html, status, str(response.url)):
+            SCHOLAR_BREAKER.record_block(reason=f'CAPTCHA for {profile_url}')
+            outcome_recorded = True
+            if metrics is not None:
+                metrics.record_captcha(url_host(profile_url))
+            print(f"Google Scholar served a CAPTCHA for {profile_url}.")
+            return None, False
+        SCHOLAR_BREAKER.record_success()
+        outcome_recorded = True
+    finally:
+        if not outcome_recorded:
+            SCHOLAR_BREAKER.record_failure()
+    soup = BeautifulSoup(html, 'html.parser')
+    for link in soup.find_all('a', class_='gsc_prf_ila', href=True):
+        if 'Homepage' in link.get_text():
+            return urljoin(final_url, link['href']), True
+    return None, True
 
 # # Function to crawl a homepage and its tabs for emails
 # def crawl_homepage(driver, homepage_url, visited=None):
@@ -168,114 +490,158 @@ def process_cv(driver, tab_name, full_url):
 #         print(f"Error crawling homepage {homepage_url}: {e}")
 #         return []
 
-# Function to crawl a homepage and its tabs for emails
-def crawl_homepage(driver, homepage_url, visited=None):
+# Function to crawl a homepage and its tabs for emails: over HTTP first, in the browser only if needed.
+# Returns a dict mapping each email to where it was found ('homepage', 'tab' or 'cv_pdf').
+# `driver` is a browser or a callable that checks one out, so no browser is needed for static pages.
+def crawl_homepage(driver, homepage_url, visited=None, session=None, pdf_cache=None, metrics=None):
+    visited = visited if visited is not None else set()
+    emails, needs_browser = crawl_homepage_http(homepage_url, session, visited, pdf_cache, metrics)
+    if not needs_browser:
+        return emails
+    print(f"Falling back to the browser for {homepage_url}")
+    # Tabs already crawled over HTTP had no email; the browser crawler skips them
+    visited.discard(normalize_link(homepage_url, homepage_url))
+    if callable(driver):
+        with driver() as checked_out_driver:
+            return crawl_homepage_with_browser(checked_out_driver, homepage_url, visited, session, pdf_cache, metrics)
+    return crawl_homepage_with_browser(driver, homepage_url, visited, session, pdf_cache, metrics)
+
+# Function to load a page in the browser and return its rendered HTML
+def render_page(driver, url):
+    print(f"Navigating to: {url}")
+    driver.get(url)
+    time.sleep(3)  # Wait for the page to load
+    return driver.page_source
+
+# Function to crawl a homepage and its tabs for emails in the browser.
+# Only the homepage and the tabs that are not static HTML are rendered; the others are fetched over HTTP.
+def crawl_homepage_with_browser(driver, homepage_url, visited=None, session=None, pdf_cache=None, metrics=None):
     if visited is None:
         visited = set()  # Track visited pages to avoid recursion
 
     try:
-        emails = set()  # Use a set to avoid duplicate emails
-
         # Skip if the page has already been visited
-        if homepage_url in visited:
-            return list(emails)
-        visited.add(homepage_url)  # Mark this page as visited
-
-        # Navigate to the homepage
-        driver.get(homepage_url)
-        time.sleep(3)  # Wait for the page to load
+        homepage_key = normalize_link(homepage_url, homepage_url)
+        if homepage_key in visited:
+            return {}
+        visited.add(homepage_key)  # Mark this page as visited
 
-        # Analyze the homepage itself
+        # Navigate to the homepage and analyze it
         print(f"Crawling homepage: {homepage_url}")
-        homepage_emails = analyze_page(driver)
-        emails.update(homepage_emails)
-
-        # Find all tab elements using a flexible XPath
-        # Case 1: Tabs inside <div class="menu">
-        menu_tabs = driver.find_elements(By.XPATH, "//div[@class='menu']//a")
-        # Case 2: Tabs with specific classes (existing logic)
-        class_tabs = driver.find_elements(By.XPATH, "//a[contains(@class, 'aJHbb') or contains(@class, 'tab') or contains(@class, 'nav-link')]")
-        
-        # Combine both sets of tabs
-        tab_elements = menu_tabs + class_tabs
-        print(f"Found {len(tab_elements)} tabs to crawl.")
-
-        # Iterate through the tabs
-        for i in range(len(tab_elements)):
-            try:
-                # Re-locate the tab elements after each navigation
-                menu_tabs = driver.find_elements(By.XPATH, "//div[@class='menu']//a")
-                class_tabs = driver.find_elements(By.XPATH, "//a[contains(@class, 'aJHbb') or contains(@class, 'tab') or contains(@class, 'nav-link')]")
-                tab_elements = menu_tabs + class_tabs
-                if i >= len(tab_elements):
-                    break  # Exit if there are no more tabs
-
-                tab = tab_elements[i]
-                tab_name = tab.text.strip()  # Get the name of the tab
-                print(f"Crawling tab: {tab_name}")
-
-                # Get the relative URL from the href attribute
-                relative_url = tab.get_attribute('href')
-                if not relative_url:
-                    print(f"Skipping tab {tab_name}: No href attribute found.")
-                    continue
-
-                # Construct the full URL
-                full_url = urljoin(homepage_url, relative_url)
-                if full_url in visited and "cv" not in tab_name.lower():
-                    print(f"Skipping tab {tab_name}: Already visited.")
-                    continue
-
-                print(f"Navigating to: {full_url}")
-
-                # Navigate to the full URL
-                driver.get(full_url)
-                time.sleep(3)  # Wait for the new content to load
-
-                # Analyze the content of the tab
-                tab_emails = analyze_page(driver)
-                emails.update(tab_emails)
-
-                # Check for embedded PDFs (e.g., CV)
-                if "cv" in tab_name.lower():
-                    cv_emails = process_cv(driver, tab_name, full_url)
-                    emails.update(cv_emails)
+        homepage_html = render_page(driver, homepage_url)
+        emails = dict.fromkeys(extract_emails_from_html(homepage_html), 'homepage')
 
-                # Mark this URL as visited
-                visited.add(full_url)
-            except Exception as e:
-                print(f"Error crawling tab {tab_name}: {e}")
-
-        return list(emails)
+        # Collect the tabs from the rendered homepage once, then crawl them
+        return crawl_tabs(homepage_html, homepage_url, emails, visited, session,
+                          render=lambda url: render_page(driver, url), pdf_cache=pdf_cache, metrics=metrics)
     except Exception as e:
         print(f"Error crawling homepage {homepage_url}: {e}")
-        return []
-    
-# Function to scrape Google Scholar profile and find homepage
-def scrape_email_from_google_scholar_profile(profile_url):
+        return {}
+
+# Function to find the emails of a Google Scholar profile, with their homepage and source, as an EmailDiscovery.
+# Browsers come from `driver_pool` (a DriverPool) and are only checked out when the HTTP path is not enough;
+# without a pool, a single browser is started on demand and quit.
+# With `email_store` (an EmailStore), cached profiles and homepages are not scraped again unless `refresh` is set,
+# and new discoveries are stored, including profiles without a homepage link. Failed scrapes are not cached: their
+# discovery has `error` set to 'blocked' (Google Scholar served a CAPTCHA) or 'error'. CV PDFs are cached in it by
+# URL and ETag (revalidated on every use, so even with `refresh`). HTTP statuses and CAPTCHAs are recorded per host
+# in `metrics` (a MetricsCollector).
+def discover_emails_from_google_scholar_profile(profile_url, driver_pool=None, session=None, email_store=None, refresh=False,
+                                                metrics=None):
+    if driver_pool is None:
+        # The browser is only started if a page needs it
+        with DriverPool(size=1, warm=False) as single_driver_pool:
+            return discover_emails_from_google_scholar_profile(profile_url, single_driver_pool, session, email_store, refresh,
+                                                               metrics)
+    if email_store is not None and not refresh:
+        cached_discovery = email_store.get(profile_url)
+        if cached_discovery is not None:
+            return cached_discovery
     try:
-        # Set up Selenium to visit the Google Scholar profile
-        options = webdriver.ChromeOptions()
-        options.add_argument('--headless')  # Run in headless mode (no GUI)
-        driver = webdriver.Chrome(service=Service(), options=options)
-        driver.get(profile_url)
-
-        # Wait for the "Homepage" button to load
-        wait = WebDriverWait(driver, 10)  # Wait up to 10 seconds
-        homepage_button = wait.until(
-            EC.presence_of_element_located((By.XPATH, "//a[contains(@class, 'gsc_prf_ila') and contains(text(), 'Homepage')]"))
-        )
-        homepage_url = homepage_button.get_attribute('href')
-
-        # Crawl the homepage and its tabs for emails
-        emails = crawl_homepage(driver, homepage_url)
-        driver.quit()
-        return emails
+        homepage_url, emails = find_profile_emails(profile_url, driver_pool, session, email_store, refresh, metrics)
+    except ScholarBlockedError as e:
+        print(f"Blocked by Google Scholar: {e}")
+        return EmailDiscovery([], None, None, time.time(), False, 'blocked')
     except Exception as e:
         print(f"Error scraping Google Scholar profile: {e}")
-        return []
-
-
+        return EmailDiscovery([], None, None, time.time(), False, 'error')
+    if isinstance(emails, EmailDiscovery):
+        # The homepage was already crawled from another profile
+        discovery = emails._replace(homepage_url=homepage_url)
+    else:
+        discovery = EmailDiscovery(list(emails), homepage_url, next(iter(emails.values()), None), time.time(), False)
+    if email_store is not None:
+        email_store.put(profile_url, discovery)
+    return discovery
+
+# Function to find a profile's homepage and crawl it; returns (homepage URL, emails -> source or a cached EmailDiscovery).
+# A profile without a homepage link is a final result: (None, {}).
+def find_profile_emails(profile_url, driver_pool, session=None, email_store=None, refresh=False, metrics=None):
+    # The homepage link is in the profile's static HTML, unless Scholar served something else (e.g. a CAPTCHA)
+    homepage_url, profile_read = find_homepage_url_http(profile_url, session, metrics)
+    if profile_read and homepage_url is None:
+        print(f"No homepage link on {profile_url}.")
+        return None, {}
+    if homepage_url is None:
+        if SCHOLAR_BREAKER.state == OPEN:
+            # Scholar is blocking us: the browser would load the same CAPTCHA, so leave the profile for a later run
+            raise ScholarBlockedError(f'Google Scholar circuit is open, not loading {profile_url} in the browser.')
+        # Check out a warm browser to visit the Google Scholar profile; the pool takes it back even on errors
+        with driver_pool.checkout() as driver:
+            load_profile_in_browser(driver, profile_url, metrics)
+
+            # Wait for the "Homepage" button to load
+            wait = WebDriverWait(driver.driver, 10)  # Wait up to 10 seconds
+            try:
+                homepage_button = wait.until(
+                    EC.presence_of_element_located((By.XPATH, HOMEPAGE_LINK_XPATH))
+                )
+            except TimeoutException:
+                if is_blocked_page(driver.page_source, url=driver.current_url):
+                    SCHOLAR_BREAKER.record_block(reason=f'CAPTCHA for {profile_url} in the browser')
+                    if metrics is not None:
+                        metrics.record_captcha(url_host(profile_url))
+                    raise ScholarBlockedError(f'Blocked by Google Scholar at {profile_url}.')
+                # The profile loaded in the browser and has no homepage link
+                print(f"No homepage link on {profile_url}.")
+                return None, {}
+            homepage_url = homepage_button.get_attribute('href')
+            cached_discovery = email_store.get_homepage(homepage_url) if email_store is not None and not refresh else None
+            if cached_discovery is not None:
+                return homepage_url, cached_discovery
+
+            # Crawl the homepage and its tabs for emails
+            return homepage_url, crawl_homepage(driver, homepage_url, session=session, pdf_cache=email_store, metrics=metrics)
+
+    cached_discovery = email_store.get_homepage(homepage_url) if email_store is not None and not refresh else None
+    if cached_discovery is not None:
+        return homepage_url, cached_discovery
+    return homepage_url, crawl_homepage(driver_pool.checkout, homepage_url, session=session, pdf_cache=email_store,
+                                        metrics=metrics)
+
+# Function to load a Google Scholar profile in the browser under `SCHOLAR_BREAKER` and the Scholar rate limit.
+# Raises ScholarBlockedError (after opening the circuit) when Scholar serves a CAPTCHA.
+def load_profile_in_browser(driver, profile_url, metrics=None):
+    SCHOLAR_BREAKER.wait()
+    outcome_recorded = False
+    try:
+        with host_throttle.slot(profile_url):
+            driver.get(profile_url)
+        if is_blocked_page(driver.page_source, url=driver.current_url):
+            SCHOLAR_BREAKER.record_block(reason=f'CAPTCHA for {profile_url} in the browser')
+            outcome_recorded = True
+            if metrics is not None:
+                metrics.record_captcha(url_host(profile_url))
+            raise ScholarBlockedError(f'Blocked by Google Scholar at {profile_url}.')
+        SCHOLAR_BREAKER.record_success()
+        outcome_recorded = True
+    finally:
+        if not outcome_recorded:
+            SCHOLAR_BREAKER.record_failure()
+
+# Function to scrape Google Scholar profile and find homepage; returns the list of emails found
+def scrape_email_from_google_scholar_profile(profile_url, driver_pool=None, session=None):
+    return discover_emails_from_google_scholar_profile(profile_url, driver_pool, session).emails
 
 if __name__ == '__main__':
     # Example usage
@@ -286,7 +652,8 @@ if __name__ == '__main__':
                     'maarten': "https://scholar.google.com/citations?user=ekCd0LoAAAAJ&hl=en"
     }
 
-    # Loop through each profile URL and scrape emails
-    for name, profile_url in profile_url_dict.items():
-        emails = scrape_email_from_google_scholar_profile(profile_url)
-        print(f"Found emails for {name}: {emails}")
\ No newline at end of file
+    # Loop through each profile URL and scrape emails, reusing the same browsers
+    with DriverPool(size=2) as driver_pool:
+        for name, profile_url in profile_url_dict.items():
+            emails = scrape_email_from_google_scholar_profile(profile_url, driver_pool)
+            print(f"Found emails for {name}: {emails}")
\ No newline at end of file
@@ -5,11 +5,14 @@ setup(
     version="4.6",
     packages=find_packages(),
     install_requires=[
+        'aiohttp',
         'backoff',
         'bs4',
         'folium',
         'geopy',
+        'numpy',
         'pandas',
+        'pyarrow',
         'pycountry',
         'requests',
         'scholarly',